@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Computes spheroid metrics for every iteration of a simulation.
+
+The metrics are computed one iteration at a time with vectorised reductions
+over the cells, either while the simulation runs, using SpheroidMetrics as an
+iteration hook, or over a saved simulation in a single streaming pass over its
+data file. They are saved as a small table with one row per iteration next to
+the data file (e.g. sim_data.metrics.csv), which the graph panel plots.
+
+Usage: python analytics.py sim_data.csv
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from data import build_iteration_arrays, get_sidecar_file, iterate_data_file
+
+# Cell cycle phases that the fraction of cells in is recorded for
+PHASES = ("G0", "G1", "S", "G2", "M")
+# Fraction of the core's cells that lie within the recorded core radius
+CORE_QUANTILE = 0.9
+# Ratio of the radius of a uniform solid sphere to its radius of gyration
+SPHERE_RADIUS_PER_GYRATION_RADIUS = np.sqrt(5 / 3)
+
+def get_metrics_file(data_file):
+    """Gets the name of the spheroid metrics file saved alongside a simulation data file."""
+    return get_sidecar_file(data_file, "metrics")
+
+def load_spheroid_metrics(data_file):
+    """Loads the spheroid metrics of a simulation data file.
+
+    The metrics file is read if it is at least as new as the data file. Otherwise
+    the metrics are computed from the data file and saved so later loads are instant.
+
+    Parameters
+    ----------
+    data_file : string
+        the name of the simulation data file
+
+    Returns
+    -------
+    SpheroidMetrics
+        the spheroid metrics of each iteration of the simulation
+    """
+    metrics_file = get_metrics_file(data_file)
+    if (os.path.exists(metrics_file)
+            and os.path.getmtime(metrics_file) >= os.path.getmtime(data_file)):
+        return SpheroidMetrics.read(metrics_file)
+
+    metrics = SpheroidMetrics.from_data_file(data_file)
+    metrics.write(metrics_file)
+    return metrics
+
+
+class SpheroidMetrics:
+    COLUMNS = (
+        "alive_cells", "dead_cells",
+        "cell_radius_mean", "cell_radius_std",
+        "cell_radius_p10", "cell_radius_p50", "cell_radius_p90",
+        *(f"fraction_{phase}" for phase in PHASES), "fraction_dead",
+        "centre_x", "centre_y", "centre_z",
+        "radius_of_gyration", "spheroid_radius",
+        "quiescent_core_radius", "necrotic_core_radius"
+    )
+    COLUMN_INDICES = {column: i for i, column in enumerate(COLUMNS)}
+
+    def __init__(self):
+        """Constructs the necessary attributes for the SpheroidMetrics object.
+
+        The metrics of each iteration are:
+        - the number of alive and dead cells
+        - the mean, standard deviation and 10th, 50th and 90th percentiles of the
+          alive cell radii
+        - the fraction of all cells in each cell cycle phase, and dead
+        - the centre of mass of the alive cells, weighting each cell by its volume
+        - the radius of gyration of the alive cells about their centre of mass, and
+          the radius of the uniform sphere with the same radius of gyration
+        - the radius about the centre of mass holding CORE_QUANTILE of the dead
+          cells (the necrotic core), and of the quiescent and dead cells (the
+          quiescent core, i.e. all non-proliferating cells)
+
+        Metrics that are undefined for an iteration, e.g. the core radii when no
+        cells have died, are NaN.
+
+        Other defined attributes
+        ------------------------
+        values : dict
+            a dictionary relating each iteration to an array of its metrics, in
+            the order of COLUMNS
+        """
+        self.values = {}
+
+    def record_iteration(self, iteration, cells):
+        """Computes the metrics of an iteration of a running simulation.
+
+        This can be called from an iteration hook, e.g.
+        lambda sim: metrics.record_iteration(sim.sim_iteration, sim.cells)
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        cells : list
+            the cell objects in the simulation
+        """
+        self.record_arrays(iteration, build_iteration_arrays(cells))
+
+    def record_arrays(self, iteration, iteration_arrays):
+        """Computes the metrics of an iteration from its cell data arrays.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        iteration_arrays : dict
+            the cell data arrays of the iteration, in the format of the IterationRingBuffer
+        """
+        values = np.full(len(self.COLUMNS), np.nan)
+        column = self.COLUMN_INDICES
+
+        is_dead = np.asarray(iteration_arrays["is_dead"], dtype=bool)
+        live = ~is_dead
+        num_cells = len(is_dead)
+        num_alive = int(np.count_nonzero(live))
+        values[column["alive_cells"]] = num_alive
+        values[column["dead_cells"]] = num_cells - num_alive
+        if num_cells == 0:
+            self.values[iteration] = values
+            return
+
+        # Count the cells in each phase using the codes of the distinct phase names
+        phase_names, phase_codes = np.unique(
+            np.asarray(iteration_arrays["current_phase"], dtype=str), return_inverse=True)
+        phase_codes = phase_codes.ravel()
+        phase_counts = np.bincount(phase_codes[live], minlength=len(phase_names))
+        for phase in PHASES:
+            values[column[f"fraction_{phase}"]] = 0
+        for phase_name, count in zip(phase_names.tolist(), phase_counts.tolist()):
+            if phase_name in PHASES:
+                values[column[f"fraction_{phase_name}"]] = count / num_cells
+        values[column["fraction_dead"]] = (num_cells - num_alive) / num_cells
+
+        if num_alive == 0:
+            self.values[iteration] = values
+            return
+
+        positions = np.asarray(iteration_arrays["pos"], dtype=np.float64).reshape(-1, 3)
+        radii = np.asarray(iteration_arrays["radius"], dtype=np.float64)
+        live_radii = radii[live]
+
+        values[column["cell_radius_mean"]] = live_radii.mean()
+        values[column["cell_radius_std"]] = live_radii.std()
+        values[[column["cell_radius_p10"], column["cell_radius_p50"], column["cell_radius_p90"]]] = \
+            np.percentile(live_radii, (10, 50, 90))
+
+        # Weight each cell by its volume
+        weights = live_radii ** 3
+        total_weight = weights.sum()
+        centre = weights @ positions[live] / total_weight
+        values[[column["centre_x"], column["centre_y"], column["centre_z"]]] = centre
+
+        squared_distances = np.einsum("ij,ij->i", positions - centre, positions - centre)
+        radius_of_gyration = np.sqrt(weights @ squared_distances[live] / total_weight)
+        values[column["radius_of_gyration"]] = radius_of_gyration
+        values[column["spheroid_radius"]] = radius_of_gyration * SPHERE_RADIUS_PER_GYRATION_RADIUS
+
+        distances = np.sqrt(squared_distances)
+        quiescent = is_dead.copy()
+        if "G0" in phase_names:
+            quiescent |= live & (phase_codes == np.searchsorted(phase_names, "G0"))
+        if quiescent.any():
+            values[column["quiescent_core_radius"]] = np.quantile(distances[quiescent], CORE_QUANTILE)
+        if is_dead.any():
+            values[column["necrotic_core_radius"]] = np.quantile(distances[is_dead], CORE_QUANTILE)
+
+        self.values[iteration] = values
+
+    def get_iterations(self):
+        """Gets the iterations with recorded metrics in ascending order."""
+        return sorted(self.values)
+
+    def get_metric(self, column):
+        """Gets the values of a metric over the simulation.
+
+        Parameters
+        ----------
+        column : string
+            the name of the metric, one of COLUMNS
+
+        Returns
+        -------
+        iterations : list
+            the iterations in ascending order
+        numpy.ndarray
+            the value of the metric at each iteration
+        """
+        iterations = self.get_iterations()
+        index = self.COLUMN_INDICES[column]
+        return iterations, np.array([self.values[iteration][index] for iteration in iterations])
+
+    def write(self, metrics_file):
+        """Writes the metrics to a tab separated file with one row per iteration."""
+        with open(metrics_file, "w", newline="") as f:
+            csvwriter = csv.writer(f, delimiter="\t")
+            csvwriter.writerow(("iteration",) + self.COLUMNS)
+            for iteration in self.get_iterations():
+                csvwriter.writerow([iteration] + [f"{value:.6g}" for value in self.values[iteration]])
+
+    @classmethod
+    def read(cls, metrics_file):
+        """Reads metrics written by the write function.
+
+        Columns are matched by name, so metrics missing from the file are NaN.
+
+        Returns
+        -------
+        SpheroidMetrics
+            the metrics read from the file
+        """
+        metrics = cls()
+        with open(metrics_file, newline="") as f:
+            csvreader = csv.reader(f, delimiter="\t")
+            header = next(csvreader, None)
+            if header is None:
+                return metrics
+            indices = [cls.COLUMN_INDICES.get(column) for column in header[1:]]
+            for row in csvreader:
+                values = np.full(len(cls.COLUMNS), np.nan)
+                for index, value in zip(indices, row[1:]):
+                    if index is not None:
+                        values[index] = float(value)
+                metrics.values[int(row[0])] = values
+        return metrics
+
+    @classmethod
+    def from_data_file(cls, data_file):
+        """Computes the metrics of a simulation data file in a single streaming pass.
+
+        Only one iteration's cell data is held in memory at a time.
+
+        Returns
+        -------
+        SpheroidMetrics
+            the metrics of each iteration in the data file
+        """
+        metrics = cls()
+        for iteration, iteration_arrays in iterate_data_file(data_file):
+            metrics.record_arrays(iteration, iteration_arrays)
+        return metrics
+
+    @classmethod
+    def from_trajectory(cls, trajectory):
+        """Computes the metrics of every iteration of a Trajectory.
+
+        Returns
+        -------
+        SpheroidMetrics
+            the metrics of each iteration of the trajectory
+        """
+        metrics = cls()
+        iteration_range = trajectory.get_iteration_range()
+        if iteration_range is not None:
+            for iteration in range(iteration_range[0], iteration_range[1] + 1):
+                iteration_arrays = trajectory.get_iteration_arrays(iteration)
+                if iteration_arrays is not None:
+                    metrics.record_arrays(iteration, iteration_arrays)
+        return metrics
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the spheroid metrics of a saved simulation.")
+    parser.add_argument("input_file", help="simulation data file")
+    parser.add_argument("-o", "--output-file", default=None,
+                        help="metrics file to write (default: next to the data file)")
+    args = parser.parse_args()
+
+    output_file = args.output_file if args.output_file is not None else get_metrics_file(args.input_file)
+    metrics = SpheroidMetrics.from_data_file(args.input_file)
+    metrics.write(output_file)
+    print(f"Wrote the metrics of {len(metrics.values)} iterations to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
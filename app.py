@@ -1,26 +1,47 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from PySide6.QtCore import QRect, QSize, Qt, QTimer
-from PySide6.QtGui import QAction
-from PySide6.QtOpenGLWidgets import QOpenGLWidget
-from PySide6.QtWidgets import (QApplication, QProgressDialog, QFileDialog, 
-    QComboBox, QDoubleSpinBox, QFrame, QHBoxLayout, QLabel, QMainWindow,
-    QPushButton, QScrollArea, QMessageBox, QSizePolicy, QSlider, QSpacerItem, 
-    QSpinBox, QVBoxLayout, QWidget)
-
-import yappi
-
-from cell_type import *
-from environment import *
-from graphs import *
-from simulation import Simulation
+from startup import StartupTimer
+
+# Time each of the imports needed before the main window can be shown. Heavy
+# optional dependencies (matplotlib, OpenGL, cv2, glfw) are imported when the
+# feature that needs them is first used instead
+startup_timer = StartupTimer()
+
+with startup_timer.measure("PySide6"):
+    from PySide6.QtCore import QRect, QSize, Qt, QThread, QTimer
+    from PySide6.QtGui import QAction
+    from PySide6.QtOpenGLWidgets import QOpenGLWidget
+    from PySide6.QtWidgets import (QApplication, QProgressDialog, QFileDialog, 
+        QCheckBox, QComboBox, QDoubleSpinBox, QFrame, QHBoxLayout, QLabel, QMainWindow,
+        QPushButton, QScrollArea, QMessageBox, QSizePolicy, QSlider, QSpacerItem, 
+        QSpinBox, QVBoxLayout, QWidget)
+
+with startup_timer.measure("cell_type"):
+    from cell_type import *
+with startup_timer.measure("environment"):
+    from environment import *
+with startup_timer.measure("sim_worker"):
+    from sim_worker import SimulationWorker
+    from physics import PHYSICS_SOLVERS
+    from placement import PLACEMENT_STRATEGIES
+    from seeding import SEEDING_STRATEGIES
+with startup_timer.measure("analytics"):
+    from analytics import SpheroidMetrics, get_metrics_file
+with startup_timer.measure("data"):
+    from data import IterationRingBuffer, Trajectory
+with startup_timer.measure("memory"):
+    from memory import MEMORY_ENV_VAR, get_memory_tracker_from_env
+with startup_timer.measure("profiling"):
+    from profiling import PROFILE_ENV_VAR, get_profiler_from_env
 import utils
-from visualiser import Visualiser
 
 class MainWindow(QMainWindow):
 
     SIM_DATA_FILE = "sim_data.csv"
+    POPULATION_GRAPH = "Population"
+    # Number of the most recent iterations held in memory for visualising a running simulation
+    LIVE_BUFFER_ITERATIONS = 200
 
     def __init__(self):
         """Constructs the GUI."""
@@ -212,7 +233,7 @@ class MainWindow(QMainWindow):
         """Constructs the simulation setup section of the model setup panel."""
 
         self.sim_setup_widget = QWidget(self.scroll_area_widget_contents)
-        self.sim_setup_widget.setMinimumHeight(50)
+        self.sim_setup_widget.setMinimumHeight(80)
         self.sim_setup_layout = QVBoxLayout(self.sim_setup_widget)
         self.sim_setup_layout.setContentsMargins(0, 0, 0, 0)
         
@@ -247,6 +268,35 @@ class MainWindow(QMainWindow):
 
         self.sim_setup_layout.addLayout(self.sim_iter_and_seed_layout)
 
+        self.sim_options_layout = QHBoxLayout()
+
+        self.sim_solver_label = QLabel("Solver:")
+        self.sim_options_layout.addWidget(self.sim_solver_label)
+
+        self.sim_solver_combo_box = QComboBox(self.sim_setup_widget)
+        self.sim_solver_combo_box.addItems(PHYSICS_SOLVERS)
+        self.sim_options_layout.addWidget(self.sim_solver_combo_box)
+
+        self.sim_placement_label = QLabel("Daughter placement:")
+        self.sim_options_layout.addWidget(self.sim_placement_label)
+
+        self.sim_placement_combo_box = QComboBox(self.sim_setup_widget)
+        self.sim_placement_combo_box.addItems(PLACEMENT_STRATEGIES)
+        self.sim_options_layout.addWidget(self.sim_placement_combo_box)
+
+        self.sim_seeding_label = QLabel("Seeding:")
+        self.sim_options_layout.addWidget(self.sim_seeding_label)
+
+        self.sim_seeding_combo_box = QComboBox(self.sim_setup_widget)
+        self.sim_seeding_combo_box.addItems(SEEDING_STRATEGIES)
+        self.sim_options_layout.addWidget(self.sim_seeding_combo_box)
+
+        self.horizontal_spacer_sim_options = QSpacerItem(
+            40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+        self.sim_options_layout.addItem(self.horizontal_spacer_sim_options)
+
+        self.sim_setup_layout.addLayout(self.sim_options_layout)
+
         self.scroll_area_layout.addWidget(self.sim_setup_widget)
 
     def init_graphs_panel(self):
@@ -265,9 +315,55 @@ class MainWindow(QMainWindow):
         self.hline_4.setFrameShadow(QFrame.Sunken)
         self.graphs_layout.addWidget(self.hline_4)
 
-        self.graph_canvas = PopulationGraphCanvas(self.SIM_DATA_FILE, self.graphs_widget)
-        self.graph_canvas.clear()
-        self.graphs_layout.addWidget(self.graph_canvas)
+        self.graph_select_layout = QHBoxLayout()
+
+        self.graph_select_label = QLabel("GRAPH:")
+        self.graph_select_layout.addWidget(self.graph_select_label)
+
+        # The spheroid metric graphs are added when the graph canvas is created
+        self.graph_select_combo_box = QComboBox(self.graphs_widget)
+        self.graph_select_combo_box.addItem(self.POPULATION_GRAPH)
+        self.graph_select_combo_box.setEnabled(False)
+        self.graph_select_combo_box.currentTextChanged.connect(self.plot_selected_graph)
+        self.graph_select_layout.addWidget(self.graph_select_combo_box)
+
+        self.horizontal_spacer_10 = QSpacerItem(
+            40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+        self.graph_select_layout.addItem(self.horizontal_spacer_10)
+
+        self.graphs_layout.addLayout(self.graph_select_layout)
+
+        # The graph canvas is created on first use so matplotlib is not imported at startup
+        self.graph_canvas = None
+
+    def get_graph_canvas(self):
+        """Gets the population graph canvas, creating it if it does not exist yet.
+
+        Returns
+        -------
+        PopulationGraphCanvas
+            the canvas that the population graphs are plotted on
+        """
+        if self.graph_canvas is None:
+            from graphs import METRIC_GRAPHS, PopulationGraphCanvas
+
+            self.graph_canvas = PopulationGraphCanvas(self.SIM_DATA_FILE, self.graphs_widget)
+            self.graph_canvas.clear()
+            self.graphs_layout.addWidget(self.graph_canvas)
+            self.graph_select_combo_box.addItems(list(METRIC_GRAPHS))
+        return self.graph_canvas
+
+    def plot_selected_graph(self):
+        """Plots the graph chosen in the graph selection combo box for the finished simulation."""
+        if self.trajectory is None or self.graph_canvas is None:
+            return
+
+        graph_title = self.graph_select_combo_box.currentText()
+        if graph_title == self.POPULATION_GRAPH:
+            self.graph_canvas.plot_data(self.graph_cell_types, self.trajectory.get_population_summary())
+        else:
+            self.graph_canvas.plot_metrics(self.trajectory.get_spheroid_metrics(), graph_title)
+        self.graph_canvas.draw()
 
     def init_playback_panel(self):
         """Constructs the visualisation playback panel."""
@@ -289,6 +385,29 @@ class MainWindow(QMainWindow):
         self.playback_fps_spin_box.valueChanged.connect(self.change_fps)
         self.playback_fps_and_iter_layout.addWidget(self.playback_fps_spin_box)
 
+        self.playback_impostors_check_box = QCheckBox("IMPOSTORS", self.playback_widget)
+        self.playback_impostors_check_box.setToolTip(
+            "Draw cells covering only a few pixels as flat shaded sprites")
+        self.playback_impostors_check_box.toggled.connect(self.impostors_toggled)
+        self.playback_fps_and_iter_layout.addWidget(self.playback_impostors_check_box)
+
+        self.playback_cull_check_box = QCheckBox("CULL", self.playback_widget)
+        self.playback_cull_check_box.setToolTip("Skip drawing cells hidden inside dense clusters")
+        self.playback_cull_check_box.toggled.connect(self.visualiser_options_changed)
+        self.playback_fps_and_iter_layout.addWidget(self.playback_cull_check_box)
+
+        self.playback_clip_label = QLabel("CLIP:")
+        self.playback_fps_and_iter_layout.addWidget(self.playback_clip_label)
+
+        self.playback_clip_spin_box = QSpinBox(self.playback_widget)
+        self.playback_clip_spin_box.setToolTip(
+            "Depth of the cross-section plane as a percentage of the environment, 0 to show everything")
+        self.playback_clip_spin_box.setRange(0, 100)
+        self.playback_clip_spin_box.setSingleStep(5)
+        self.playback_clip_spin_box.setSuffix("%")
+        self.playback_clip_spin_box.valueChanged.connect(self.visualiser_options_changed)
+        self.playback_fps_and_iter_layout.addWidget(self.playback_clip_spin_box)
+
         self.horizontal_spacer_8 = QSpacerItem(
             20, 20, QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Minimum)
         self.playback_fps_and_iter_layout.addItem(self.horizontal_spacer_8)
@@ -344,6 +463,19 @@ class MainWindow(QMainWindow):
         self.current_iteration = 0
         self.max_iteration = 0
 
+        self.first_available_iteration = 0
+        self.last_available_iteration = 0
+
+        self.trajectory = None
+        self.spheroid_metrics = None
+        self.graph_cell_types = []
+        self.profile_prefix = None
+        self.memory_prefix = None
+        self.sim_worker = None
+        self.sim_thread = None
+        self.progress_dialog = None
+        self.live_buffer = None
+
     def add_cell_type_widget(self, e=None):
         """Adds a widget to the cell setup section of the model setup panel
         for an additional cell type.
@@ -438,19 +570,23 @@ class MainWindow(QMainWindow):
     def export_data(self, e):
         """Exports the simulation data to the chosen file location."""
 
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
-        save_file_name, _ = QFileDialog.getSaveFileName(self, 
-            "Save File", "", "All Files(*)", options = options)
-        if save_file_name:
-            if save_file_name[-4:] != ".csv":
-                save_file_name += ".csv"
-            with open(self.SIM_DATA_FILE, 'r') as data_file:
-                with open(save_file_name, 'w') as save_file:
-                    for line in data_file:
-                        save_file.write(line)
-            data_file.close()
-            save_file.close()
+        if self.trajectory != None:
+            options = QFileDialog.Options()
+            options |= QFileDialog.DontUseNativeDialog
+            save_file_name, _ = QFileDialog.getSaveFileName(self, 
+                "Save File", "", "All Files(*)", options = options)
+            if save_file_name:
+                if save_file_name[-4:] != ".csv":
+                    save_file_name += ".csv"
+                self.trajectory.export(save_file_name)
+
+        else:
+            QMessageBox.critical(
+                self, 
+                "Alert", 
+                "No simulation data to export!", 
+                buttons=QMessageBox.Ok
+            )
 
     def export_video(self, e):
         """Exports a video of the simulation visualisation to the chosen
@@ -465,7 +601,25 @@ class MainWindow(QMainWindow):
                 if save_file_name[-4:] != ".mp4":
                     save_file_name += ".mp4"
                 fps = self.playback_fps_spin_box.value()
-                self.visualiser.save_video(save_file_name, self.max_iteration, fps)
+
+                progress_dialog = QProgressDialog(
+                    "Exporting video...", "Cancel", 0, self.max_iteration + 1, self)
+                progress_dialog.setWindowModality(Qt.WindowModal)
+                progress_dialog.setWindowTitle("Export Video")
+                progress_dialog.setMinimumDuration(0)
+
+                def update_progress(frames_written, num_frames):
+                    progress_dialog.setValue(frames_written)
+                    return not progress_dialog.wasCanceled()
+
+                stats = self.visualiser.save_video(
+                    save_file_name, self.max_iteration, fps, update_progress)
+                progress_dialog.close()
+
+                if stats is not None and not stats["cancelled"]:
+                    self.statusBar().showMessage(
+                        f"Exported {stats['frames']} frames in {stats['seconds']:.1f}s "
+                        f"({stats['fps']:.1f} frames per second)")
                                            
         else:
             QMessageBox.critical(
@@ -480,7 +634,10 @@ class MainWindow(QMainWindow):
         layer widgets from the model setup panel if they have been added.
         """
         self.timer.stop()
+        self.cancel_model()
         
+        self.trajectory = None
+        self.graph_select_combo_box.setEnabled(False)
         if self.visualiser != None:
             self.visualiser.deleteLater()
             self.visualiser = None
@@ -528,9 +685,13 @@ class MainWindow(QMainWindow):
         
         self.sim_iter_spin_box.setValue(1)
         self.sim_rand_seed_spin_box.setValue(0)
+        self.sim_solver_combo_box.setCurrentIndex(0)
+        self.sim_placement_combo_box.setCurrentIndex(0)
+        self.sim_seeding_combo_box.setCurrentIndex(0)
 
-        self.graph_canvas.clear()
-        self.graph_canvas.draw()
+        if self.graph_canvas is not None:
+            self.graph_canvas.clear()
+            self.graph_canvas.draw()
 
         self.playback_fps_spin_box.setValue(1)
         self.reset_playback_iteration()
@@ -546,20 +707,25 @@ class MainWindow(QMainWindow):
     def reset_playback_iteration(self):
         """Resets the playback panel to the first iteration."""
         self.current_iteration = 0
+        self.first_available_iteration = 0
+        self.last_available_iteration = 0
         self.playback_iter_spin_box.setValue(0)
         self.playback_iter_spin_box.setEnabled(False)
         self.playback_play_pause_button.setText("Play")
         self.playback_play_pause_button.setEnabled(False)
+        self.playing = False
         self.playback_slider.setSliderPosition(0)
         self.playback_slider.setEnabled(False)
 
     def run_model(self, e):
-        """Runs a simulation with the user's chosen setup and produces the
-        graphs and visualisation for it when it has run.
+        """Starts a simulation with the user's chosen setup in a worker thread.
+
+        The population graph is plotted and the visualisation playback is extended
+        as each iteration arrives from the worker. Iterations are visualised from
+        an in-memory ring buffer while the simulation is running.
         """
-        # ====== Uncomment yappi lines for profiling ======
-        #yappi.set_clock_type("wall")
-        #yappi.start()
+        if self.sim_thread is not None:
+            return
 
         self.timer.stop()
 
@@ -590,7 +756,7 @@ class MainWindow(QMainWindow):
         self.max_iteration = self.sim_iter_spin_box.value()
         random_seed = self.sim_rand_seed_spin_box.value()
         
-        progress_dialog = QProgressDialog(
+        self.progress_dialog = QProgressDialog(
             "Running simulation...", 
             "Cancel", 
             0, 
@@ -598,63 +764,259 @@ class MainWindow(QMainWindow):
             self
         )
 
-        progress_dialog.setWindowModality(Qt.WindowModal)
-        progress_dialog.setWindowTitle("Run Model")
-        progress_dialog.setMinimumDuration(0)
-
-        self.sim = Simulation(self.SIM_DATA_FILE, input_cell_types, input_cell_nums, 
-                              self.env_size, input_env_layers, self.max_iteration, random_seed)
+        # The dialog is not modal so the visualisation can be played back while it runs
+        self.progress_dialog.setWindowModality(Qt.NonModal)
+        self.progress_dialog.setWindowTitle("Run Model")
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self.cancel_model)
 
-        cancelled = False
-        for i in range(1, self.max_iteration+1):
-            if progress_dialog.wasCanceled():
-                cancelled = True
-                break
+        self.trajectory = None
+        if self.visualiser != None:
+            self.visualiser.deleteLater()
+            self.visualiser = None
 
-            self.sim.run_iteration()
-            progress_dialog.setValue(i)
+        # The population is plotted live, and the other graphs can be chosen once the simulation has finished
+        graph_canvas = self.get_graph_canvas()
+        self.graph_select_combo_box.blockSignals(True)
+        self.graph_select_combo_box.setCurrentText(self.POPULATION_GRAPH)
+        self.graph_select_combo_box.blockSignals(False)
+        self.graph_select_combo_box.setEnabled(False)
+        graph_canvas.start_live_plot(input_cell_types)
+        graph_canvas.draw()
+
+        # The simulation saves each iteration into the live buffer that the visualiser reads
+        self.live_buffer = IterationRingBuffer(self.LIVE_BUFFER_ITERATIONS)
+        live_buffer = self.live_buffer
+        save_live_iteration = lambda sim: live_buffer.save_iteration(sim.sim_iteration, sim.cells)
+
+        # The spheroid metrics are computed from the arrays just saved in the live buffer
+        self.spheroid_metrics = SpheroidMetrics()
+        spheroid_metrics = self.spheroid_metrics
+        record_metrics = lambda sim: spheroid_metrics.record_arrays(
+            sim.sim_iteration, live_buffer.get_iteration_arrays(sim.sim_iteration))
+
+        from visualiser import Visualiser
+
+        width, height = self.visualiser_widget.width(), self.visualiser_widget.height()
+        self.visualiser = Visualiser(self.visualiser_widget, width, height, 
+                                     None, self.env_size, data_source=self.live_buffer)
+        self.visualiser.set_use_impostors(self.playback_impostors_check_box.isChecked())
+        self.set_visualiser_options()
+        self.visualiser_layout.addWidget(self.visualiser)
 
-        if not cancelled:
-            self.sim.write_simulation()
+        # The stages of each iteration are profiled if the profiling environment variable is set
+        profiler, self.profile_prefix = get_profiler_from_env()
+
+        # The memory of each iteration, including the live buffer, is tracked if the memory environment variable is set
+        memory_tracker, self.memory_prefix = get_memory_tracker_from_env()
+        if self.memory_prefix is not None:
+            memory_tracker.track_data_source("live_buffer", self.live_buffer)
+
+        # Run the simulation in a worker thread so the GUI stays responsive
+        self.sim_worker = SimulationWorker(self.SIM_DATA_FILE, input_cell_types, input_cell_nums,
+                                           self.env_size, input_env_layers, self.max_iteration,
+                                           random_seed, [save_live_iteration, record_metrics],
+                                           profiler, memory_tracker,
+                                           self.sim_solver_combo_box.currentText(),
+                                           self.sim_placement_combo_box.currentText(),
+                                           self.sim_seeding_combo_box.currentText())
+        self.sim_thread = QThread(self)
+        self.sim_worker.moveToThread(self.sim_thread)
+        self.sim_thread.started.connect(self.sim_worker.run)
+        self.sim_worker.iteration_finished.connect(self.model_iteration_finished)
+        self.sim_worker.simulation_finished.connect(self.model_finished)
+        self.sim_worker.simulation_cancelled.connect(self.model_cancelled)
+        self.sim_worker.simulation_failed.connect(self.model_failed)
+
+        self.model_setup_widget.setEnabled(False)
+        self.sim_thread.start()
+
+    def cancel_model(self):
+        """Requests the running simulation to stop."""
+        if self.sim_worker is not None:
+            self.sim_worker.cancel()
+
+    def stop_model_thread(self):
+        """Waits for the simulation worker thread to stop and releases it."""
+        if self.sim_thread is not None:
+            self.sim_thread.quit()
+            self.sim_thread.wait()
+            self.sim_worker.deleteLater()
+            self.sim_thread.deleteLater()
+            self.sim_worker = None
+            self.sim_thread = None
+
+        if self.progress_dialog is not None:
+            self.progress_dialog.close()
+            self.progress_dialog = None
+
+        self.model_setup_widget.setEnabled(True)
+
+    def model_iteration_finished(self, iteration, iteration_time, population_counts):
+        """Updates the progress dialog and population graph when the worker
+        has simulated an iteration.
+
+        Parameters
+        ----------
+        iteration : int
+            the iteration that has been simulated
+        iteration_time : float
+            the time in seconds that the iteration took
+        population_counts : dict
+            a dictionary relating each cell type name to its alive population
+        """
+        if self.progress_dialog is not None:
+            self.progress_dialog.setLabelText(
+                f"Running simulation...\nIteration {iteration}/{self.max_iteration} took "
+                f"{iteration_time:.2f}s, {sum(population_counts.values())} alive cells")
+            self.progress_dialog.setValue(iteration)
 
-            self.graph_canvas.plot_data(input_cell_types)
-            self.graph_canvas.draw()
+        self.graph_canvas.add_population_counts(iteration, population_counts)
+        self.extend_live_playback()
 
-            if self.visualiser != None:
-                self.visualiser.deleteLater()
-                self.visualiser = None
+    def extend_live_playback(self):
+        """Extends the playback panel to the iterations held in the live buffer.
 
-            width, height = self.visualiser_widget.width(), self.visualiser_widget.height()
-            self.visualiser = Visualiser(self.visualiser_widget, width, height, 
-                                         self.SIM_DATA_FILE, self.env_size)
-            self.visualiser_layout.addWidget(self.visualiser)
-            
-            self.playback_iter_spin_box.setRange(0, self.max_iteration)
+        If the visualisation is showing the latest iteration, it follows the
+        simulation on to the newly arrived iteration.
+        """
+        if self.live_buffer is None:
+            return
+        iteration_range = self.live_buffer.get_iteration_range()
+        if iteration_range is None:
+            return
+
+        following = self.current_iteration >= self.last_available_iteration
+        self.first_available_iteration, self.last_available_iteration = iteration_range
+        
+        self.playback_iter_spin_box.setRange(*iteration_range)
+        self.playback_slider.setRange(*iteration_range)
+        self.playback_play_pause_button.setEnabled(True)
+        if not self.playing:
             self.playback_iter_spin_box.setEnabled(True)
-            self.playback_play_pause_button.setEnabled(True)
-            self.playback_slider.setRange(0, self.max_iteration)
             self.playback_slider.setEnabled(True)
 
-        else:
-            self.sim = None
-            if self.visualiser != None:
-                self.visualiser.deleteLater()
-                self.visualiser = None
+            if following or self.current_iteration < self.first_available_iteration:
+                self.current_iteration = self.last_available_iteration
+                self.set_playback_iter_and_slider()
+                self.update_visualiser()
+
+    def model_finished(self):
+        """Sets up the visualisation playback when the worker has finished the simulation."""
+        sim = self.sim_worker.sim
+        self.stop_model_thread()
+
+        # Save the spheroid metrics alongside the simulation data
+        self.spheroid_metrics.write(get_metrics_file(self.SIM_DATA_FILE))
+
+        # Share one handle on the saved data between the graph, playback and export.
+        # Its cell data is kept in memory from the run unless older iterations have
+        # been dropped, in which case the data file is decoded once when needed.
+        self.trajectory = Trajectory(
+            self.SIM_DATA_FILE,
+            self.live_buffer if self.live_buffer.holds_all_iterations() else None,
+            sim.population_summary, self.spheroid_metrics)
+        self.live_buffer = None
+        self.spheroid_metrics = None
+        self.visualiser.set_data_source(self.trajectory)
+
+        # Redraw the chosen graph from the simulation's population summary or spheroid metrics
+        self.graph_cell_types = sim.cell_types
+        self.graph_select_combo_box.setEnabled(True)
+        self.plot_selected_graph()
+
+        self.first_available_iteration = 0
+        self.last_available_iteration = self.max_iteration
+        
+        self.playback_iter_spin_box.setRange(0, self.max_iteration)
+        self.playback_iter_spin_box.setEnabled(not self.playing)
+        self.playback_play_pause_button.setEnabled(True)
+        self.playback_slider.setRange(0, self.max_iteration)
+        self.playback_slider.setEnabled(not self.playing)
+        self.update_visualiser()
+
+        # Export the profile of the simulation's stages if profiling is enabled
+        if self.profile_prefix is not None:
+            profile_files = sim.profiler.export(self.profile_prefix)
+            print(f"Saved the simulation profile ({PROFILE_ENV_VAR}) to {', '.join(profile_files)}")
+
+        # Export the memory report of the simulation if memory tracking is enabled
+        if self.memory_prefix is not None:
+            sim.memory_tracker.stop()
+            memory_files = sim.memory_tracker.export(self.memory_prefix)
+            print(f"Saved the simulation memory report ({MEMORY_ENV_VAR}) to {', '.join(memory_files)}")
+
+    def model_cancelled(self):
+        """Clears the panels when the simulation has been cancelled."""
+        if self.memory_prefix is not None and self.sim_worker is not None:
+            self.sim_worker.memory_tracker.stop()
+        self.stop_model_thread()
+
+        self.timer.stop()
+        self.reset_playback_iteration()
+
+        self.trajectory = None
+        self.live_buffer = None
+        self.spheroid_metrics = None
+        self.graph_select_combo_box.setEnabled(False)
+        if self.visualiser != None:
+            self.visualiser.deleteLater()
+            self.visualiser = None
+        if self.graph_canvas is not None:
             self.graph_canvas.clear()
             self.graph_canvas.draw()
 
-        # ====== Uncomment yappi lines for profiling ======
-        #yappi.stop()
-        #yappi.get_func_stats().print_all()
-        #yappi.get_thread_stats().print_all()
-        #yappi.clear_stats()
-        
+    def model_failed(self, error_traceback):
+        """Clears the panels and alerts the user when the simulation raised an exception.
+
+        Parameters
+        ----------
+        error_traceback : string
+            the traceback of the exception raised in the worker
+        """
+        self.model_cancelled()
+        message_box = QMessageBox(
+            QMessageBox.Critical,
+            "Alert",
+            "The simulation failed:\n" + error_traceback.strip().splitlines()[-1],
+            buttons=QMessageBox.Ok,
+            parent=self
+        )
+        message_box.setDetailedText(error_traceback)
+        message_box.exec()
+
+    def closeEvent(self, event):
+        """Stops any running simulation before the window closes."""
+        self.cancel_model()
+        if self.sim_thread is not None:
+            self.sim_thread.quit()
+            self.sim_thread.wait()
+        super().closeEvent(event)
 
     def change_fps(self, new_fps):
         """Change the fps of the visualisation playback."""
         if self.timer != None:
             self.timer.setInterval(1000/new_fps)
 
+    def impostors_toggled(self, checked):
+        """Sets whether the visualiser draws small cells as impostors."""
+        if self.visualiser != None:
+            self.visualiser.set_use_impostors(checked)
+            self.visualiser.update()
+
+    def visualiser_options_changed(self):
+        """Applies the culling and cross-section options and redraws the visualiser."""
+        if self.visualiser != None:
+            self.set_visualiser_options()
+            self.visualiser.update()
+
+    def set_visualiser_options(self):
+        """Sets the visualiser's culling and cross-section options from the playback panel."""
+        self.visualiser.set_cull_hidden_cells(self.playback_cull_check_box.isChecked())
+        clip_percentage = self.playback_clip_spin_box.value()
+        self.visualiser.set_clip_depth(
+            self.visualiser.env_size * clip_percentage / 100 if clip_percentage > 0 else None)
+
     def playback_iter_changed(self):
         """Sets the iteration to what the user has chosen in the iteration 
         spin box and updates the visualiser.
@@ -667,8 +1029,8 @@ class MainWindow(QMainWindow):
     def play_pause(self, e):
         """Toggles between playing and pausing the visualisation."""
         if not self.playing:
-            if self.current_iteration == self.max_iteration:
-                self.current_iteration = 0
+            if self.current_iteration == self.last_available_iteration and self.sim_thread is None:
+                self.current_iteration = self.first_available_iteration
                 self.set_playback_iter_and_slider()
             self.playback_play_pause_button.setText("Pause")
             self.playback_iter_spin_box.setEnabled(False)
@@ -682,6 +1044,10 @@ class MainWindow(QMainWindow):
             self.playback_slider.setEnabled(True)
             self.playing = False
 
+            # Redraw the paused frame at full detail
+            self.visualiser.reset_detail()
+            self.visualiser.update()
+
     def playback_slider_changed(self):
         """Sets the iteration to what the user has set the playback slider
         to and updates the visualiser.
@@ -693,15 +1059,23 @@ class MainWindow(QMainWindow):
     
     def play_next_iteration(self):
         """Increments the current visualised iteration, and stops the playback
-        if it has reached the end"""
+        if it has reached the end. While the simulation is still running, the
+        playback waits at the latest iteration for the next one to arrive.
+        The level of detail is adjusted to keep each frame within the
+        playback frame time."""
+        self.visualiser.adjust_detail(1.0 / self.playback_fps_spin_box.value())
+
         self.current_iteration += 1
-        if self.current_iteration > self.max_iteration:
-            self.current_iteration = self.max_iteration
-            self.timer.stop()
-            self.playback_play_pause_button.setText("Play")
-            self.playback_iter_spin_box.setEnabled(True)
-            self.playback_slider.setEnabled(True)
-            self.playing = False
+        if self.current_iteration > self.last_available_iteration:
+            self.current_iteration = self.last_available_iteration
+            if self.sim_thread is None:
+                self.timer.stop()
+                self.playback_play_pause_button.setText("Play")
+                self.playback_iter_spin_box.setEnabled(True)
+                self.playback_slider.setEnabled(True)
+                self.playing = False
+                self.visualiser.reset_detail()
+                self.visualiser.update()
         else:
             self.set_playback_iter_and_slider()
             self.update_visualiser()
@@ -724,4 +1098,7 @@ class MainWindow(QMainWindow):
 app = QApplication([])
 window = MainWindow()
 window.show()
+
+# Report the startup time once the event loop has started and the window appears
+QTimer.singleShot(0, startup_timer.report)
 app.exec()
\ No newline at end of file
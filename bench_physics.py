@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks how the physical models scale with the number of cells.
+
+Synthetic packings of cells with random positions are generated for every
+combination of cell count, packing density (the fraction of the environment
+volume filled by cells) and cell radius, using a fixed random seed, and the
+overlap between them is solved with PhysicalModel, PhysicalModelWithLocals,
+PhysicalModelWithActiveSet and/or PhysicalModelWithClusters.
+The wall time, solver passes, cell pair checks and peak traced memory of each
+solve are printed and saved as JSON, so runs can be compared across commits:
+
+    python bench_physics.py -o before.json
+    python bench_physics.py -o after.json --compare before.json
+
+Cases whose estimated pair checks or pair matrix memory exceed the size guards
+are skipped rather than run, and solves taking longer than --timeout seconds
+are stopped through the model's cancel event. Both are recorded in the results.
+
+Usage: python bench_physics.py [--cells 100,1000] [--densities 0.1,0.3]
+                               [--radii 5,10] [--models auto,base,locals,active_set,clusters]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from cell_body import CellBody
+from physics import (PHYSICS_SOLVERS, PhysicalModelWithActiveSet, PhysicalModelWithClusters,
+                     PhysicalModelWithLocals, create_physical_model)
+
+DEFAULT_CELLS = (100, 1000, 10000, 100000)
+DEFAULT_DENSITIES = (0.1, 0.3, 0.5)
+DEFAULT_RADII = (5.0, 10.0)
+# Fractional spread of the cell radii about the chosen radius
+RADIUS_SPREAD = 0.2
+DEFAULT_SEED = 1
+
+# Size guards above which a case is skipped
+DEFAULT_MAX_PAIR_CHECKS = 5 * 10 ** 6
+DEFAULT_MAX_MATRIX_BYTES = 2 * 1024 ** 3
+DEFAULT_TIMEOUT = 60.0
+
+
+class BenchmarkEnvironment:
+
+    def __init__(self, env_size):
+        """Constructs the necessary attributes for the BenchmarkEnvironment object.
+
+        This holds the environment size read by the cell bodies, in place of a
+        Simulation, so cells can be packed without seeding a full simulation.
+
+        Parameters
+        ----------
+        env_size : float
+            the width of the environment
+        """
+        self.env_size = env_size
+
+
+class BenchmarkCell:
+
+    def __init__(self, env, id, pos, radius):
+        """Constructs the necessary attributes for the BenchmarkCell object.
+
+        The cell has only the attributes the physical models use.
+
+        Parameters
+        ----------
+        env : BenchmarkEnvironment
+            the environment that the cell is in
+        id : int
+            the ID of the cell, which is its index in the cells list
+        pos : numpy.ndarray(3)
+            the 3D position of the cell in the environment
+        radius : float
+            the radius of the cell
+        """
+        self.id = id
+        self.is_dead = False
+        self.cell_body = CellBody(env, pos, radius)
+
+
+def get_env_size(num_cells, density, radius):
+    """Gets the width of the cubic environment that num_cells cells fill to the given density."""
+    cell_volume = num_cells * (4 / 3) * np.pi * radius ** 3
+    return float(np.cbrt(cell_volume / density))
+
+def create_packing(num_cells, density, radius, seed):
+    """Creates cells with random positions and radii filling an environment to the given density.
+
+    Parameters
+    ----------
+    num_cells : int
+        the number of cells
+    density : float
+        the fraction of the environment volume filled by cells
+    radius : float
+        the mean cell radius, which the radii are spread about by RADIUS_SPREAD
+    seed : int
+        the random seed, so each case gets the same packing every run
+
+    Returns
+    -------
+    env_size : float
+        the width of the environment
+    cells : list
+        the BenchmarkCell objects
+    """
+    rng = np.random.default_rng(seed)
+    env_size = get_env_size(num_cells, density, radius)
+    env = BenchmarkEnvironment(env_size)
+    radii = radius * rng.uniform(1 - RADIUS_SPREAD, 1 + RADIUS_SPREAD, num_cells)
+    positions = rng.uniform(radii[:, None], env_size - radii[:, None], (num_cells, 3))
+    cells = [BenchmarkCell(env, i, positions[i], radii[i]) for i in range(num_cells)]
+    return env_size, cells
+
+def create_model(model_name, env_size, max_cell_radius):
+    """Creates the physical model named "base", "locals", "active_set", "clusters"
+    or "auto" (chosen as in the Simulation)."""
+    return create_physical_model(env_size, max_cell_radius, model_name)
+
+def get_model_name(model):
+    """Gets the short name of a physical model object."""
+    if isinstance(model, PhysicalModelWithClusters):
+        return "conjugate_gradient" if model.relaxation == "conjugate_gradient" else "clusters"
+    if isinstance(model, PhysicalModelWithActiveSet):
+        return "active_set"
+    return "locals" if isinstance(model, PhysicalModelWithLocals) else "base"
+
+def estimate_costs(model, num_cells):
+    """Estimates the pair checks per solver pass and the pair matrix memory of a model.
+
+    Parameters
+    ----------
+    model : PhysicalModel / PhysicalModelWithLocals / PhysicalModelWithActiveSet / PhysicalModelWithClusters
+        the physical model
+    num_cells : int
+        the number of cells
+
+    Returns
+    -------
+    pair_checks : int
+        the estimated number of cell pairs checked in each pass, assuming the
+        cells are spread evenly
+    matrix_bytes : int
+        the memory used by the matrix of checked pairs, or 0 if the model has none
+    """
+    all_pairs = num_cells * (num_cells - 1) // 2
+    if isinstance(model, PhysicalModelWithActiveSet):
+        # The first solve checks every cell against those in the neighbouring grid buckets
+        buckets_per_side = max(1, int(model.env_size / model.get_bucket_size(model.max_cell_radius)))
+        return int(all_pairs * min(1.0, 27 / buckets_per_side ** 3)), 0
+    if not isinstance(model, PhysicalModelWithLocals):
+        return all_pairs, 0
+
+    # Cells are checked against those in the same and neighbouring local environments,
+    # and the matrix is built as a nested list of bools before becoming an array
+    neighbour_fraction = min(1.0, 27 / model.num_local_environments)
+    return int(all_pairs * neighbour_fraction), num_cells ** 2 * 9
+
+def time_solve(model, cells, timeout):
+    """Solves the overlap of the cells, stopping after the timeout.
+
+    Returns
+    -------
+    seconds : float
+        the wall time of the solve
+    timed_out : bool
+        whether the solve was stopped by the timeout
+    """
+    model.cancel_event = threading.Event()
+    timer = threading.Timer(timeout, model.cancel_event.set)
+    timer.start()
+    try:
+        start_time = time.perf_counter()
+        model.solve_overlap(0, cells)
+        seconds = time.perf_counter() - start_time
+    finally:
+        timer.cancel()
+    return seconds, model.cancel_event.is_set()
+
+def get_total_overlap(model, cells):
+    """Gets the remaining overlap between the cells, without counting the pair checks."""
+    pair_checks = model.pair_checks
+    total_overlap, _ = model.get_total_overlap_and_forces(cells)
+    model.pair_checks = pair_checks
+    return float(total_overlap)
+
+def run_case(model_name, num_cells, density, radius, args):
+    """Benchmarks solving the overlap of one synthetic packing.
+
+    Each repeat solves a fresh copy of the same packing. The peak memory is
+    measured in a separate solve, as tracing the allocations slows it down.
+
+    Returns
+    -------
+    result : dict
+        the case parameters and measurements, or the reason it was skipped
+    """
+    env_size, cells = create_packing(num_cells, density, radius, args.seed)
+    max_cell_radius = max(cell.cell_body.radius for cell in cells)
+    model = create_model(model_name, env_size, max_cell_radius)
+
+    try:
+        result = {"model": get_model_name(model), "requested_model": model_name,
+                  "cells": num_cells, "density": density, "radius": radius,
+                  "env_size": env_size, "seed": args.seed}
+        if isinstance(model, PhysicalModelWithLocals) and model.local_envs_per_side < 2:
+            result["skipped"] = "the environment is too small to split into local environments"
+            return result
+
+        estimated_pair_checks, matrix_bytes = estimate_costs(model, num_cells)
+        result["estimated_pair_checks_per_pass"] = estimated_pair_checks
+        if estimated_pair_checks > args.max_pair_checks:
+            result["skipped"] = f"estimated {estimated_pair_checks} pair checks per pass " \
+                                f"exceeds --max-pair-checks {args.max_pair_checks}"
+            return result
+        if matrix_bytes > args.max_matrix_bytes:
+            result["skipped"] = f"pair matrix of {matrix_bytes} bytes " \
+                                f"exceeds --max-matrix-bytes {args.max_matrix_bytes}"
+            return result
+
+        result["initial_overlap"] = get_total_overlap(model, cells)
+        times = []
+        for repeat in range(args.repeats):
+            if repeat > 0:
+                _, cells = create_packing(num_cells, density, radius, args.seed)
+            seconds, timed_out = time_solve(model, cells, args.timeout)
+            times.append(seconds)
+            if timed_out:
+                result["timed_out"] = True
+                break
+
+        result["seconds"] = times
+        result["best_seconds"] = min(times)
+        result["mean_seconds"] = sum(times) / len(times)
+        result["passes"] = model.solve_passes
+        result["pair_checks"] = model.pair_checks
+        result["pair_checks_per_second"] = model.pair_checks / min(times) if min(times) > 0 else None
+        result["final_overlap"] = get_total_overlap(model, cells)
+
+        if args.memory and not result.get("timed_out"):
+            _, cells = create_packing(num_cells, density, radius, args.seed)
+            tracemalloc.start()
+            try:
+                time_solve(model, cells, args.timeout)
+                result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        return result
+    finally:
+        # Shut down the worker pool of the cluster solvers
+        model.close()
+
+def get_case_key(result):
+    """Gets the key that identifies the same case in different benchmark runs."""
+    return (result["requested_model"], result["cells"], result["density"], result["radius"])
+
+def get_metadata(args):
+    """Gets details of the machine, software and code the benchmark was run with."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "arguments": vars(args)}
+
+def print_result(result):
+    """Prints a line summarising the result of a case."""
+    model = f"({result['model']})"
+    case = f"{result['requested_model']:>18} {model:<20} {result['cells']:>7} cells " \
+           f"density {result['density']:<4} radius {result['radius']:<5}"
+    if "skipped" in result:
+        print(f"{case} skipped: {result['skipped']}")
+        return
+    line = f"{case} {result['best_seconds']:9.3f}s {result['passes']:4d} passes " \
+           f"{result['pair_checks']:>11} pair checks"
+    if "peak_memory_bytes" in result:
+        line += f" {result['peak_memory_bytes'] / 1024 ** 2:8.1f} MiB peak"
+    if result.get("timed_out"):
+        line += " (timed out)"
+    print(line, flush=True)
+
+def print_comparison(results, baseline_file):
+    """Prints the speed up of each case relative to the same case in a baseline results file."""
+    with open(baseline_file) as f:
+        baseline = {get_case_key(result): result for result in json.load(f)["results"]}
+
+    print(f"\nCompared with {baseline_file}:")
+    for result in results:
+        baseline_result = baseline.get(get_case_key(result))
+        if (baseline_result is None or "best_seconds" not in result
+                or "best_seconds" not in baseline_result):
+            continue
+        speed_up = baseline_result["best_seconds"] / result["best_seconds"]
+        print(f"{result['requested_model']:>18} {result['cells']:>7} cells density "
+              f"{result['density']:<4} radius {result['radius']:<5} "
+              f"{baseline_result['best_seconds']:9.3f}s -> {result['best_seconds']:9.3f}s "
+              f"({speed_up:.2f}x)")
+
+def parse_list(text, value_type):
+    """Parses a comma separated list of values."""
+    return [value_type(value) for value in text.split(",") if value]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scaling of the physical models.")
+    parser.add_argument("--cells", default=",".join(map(str, DEFAULT_CELLS)),
+                        help="comma separated numbers of cells")
+    parser.add_argument("--densities", default=",".join(map(str, DEFAULT_DENSITIES)),
+                        help="comma separated fractions of the environment volume filled by cells")
+    parser.add_argument("--radii", default=",".join(map(str, DEFAULT_RADII)),
+                        help="comma separated mean cell radii")
+    parser.add_argument("--models", default="auto",
+                        help="comma separated models: base, locals, active_set, clusters or auto "
+                             "(chosen as in the Simulation)")
+    parser.add_argument("--repeats", type=int, default=3, help="timed solves of each case")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="random seed of the packings")
+    parser.add_argument("--max-pair-checks", type=int, default=DEFAULT_MAX_PAIR_CHECKS,
+                        help="skip cases with more estimated pair checks per solver pass")
+    parser.add_argument("--max-matrix-bytes", type=int, default=DEFAULT_MAX_MATRIX_BYTES,
+                        help="skip cases whose checked pair matrix would use more memory")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="seconds after which a solve is stopped")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="don't measure the peak memory with tracemalloc")
+    parser.add_argument("-o", "--output", default="bench_physics.json",
+                        help="JSON file to save the results to")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    for model_name in parse_list(args.models, str):
+        if model_name not in PHYSICS_SOLVERS:
+            parser.error(f"unknown model {model_name}")
+
+    results = []
+    for model_name, num_cells, density, radius in itertools.product(
+            parse_list(args.models, str), parse_list(args.cells, int),
+            parse_list(args.densities, float), parse_list(args.radii, float)):
+        result = run_case(model_name, num_cells, density, radius, args)
+        print_result(result)
+        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"metadata": get_metadata(args), "results": results}, f, indent=2)
+    print(f"Saved the results to {args.output}")
+
+    if args.compare is not None:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks the throughput of whole simulations and flags slowdowns.
+
+Each named scenario runs Simulation.run_iteration from a fixed random seed,
+timing the cell behaviour, buffer merge, physics and data saving stages of
+every iteration. The iterations per second and stage breakdown of each
+scenario are printed and saved as JSON, and compared against a stored baseline:
+
+    python bench_simulation.py --save-baseline        (record the baseline)
+    python bench_simulation.py                        (compare against it)
+
+A scenario is flagged as a regression if its iterations per second are more
+than --threshold (a fraction, 0.1 by default) below the baseline's, and the
+script then exits with status 1, so it can gate changes. Timings depend on the
+machine, so the baseline should be recorded on the machine it is compared on.
+
+The physical model is chosen as in the Simulation unless --solver is given,
+e.g. --solver active_set, and the daughter cells are placed randomly unless
+--placement is given, e.g. --placement least_crowded. Scenarios are only
+compared with baseline results that used the same solver and placement, and
+the change in their total solver passes is printed alongside their throughput.
+
+Usage: python bench_simulation.py [--scenarios generic_growth,mixed] [--repeats 3]
+                                  [--solver auto] [--placement random] [--baseline FILE]
+                                  [--threshold 0.1] [-o FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from cell_type import CancerousCell, GenericCell
+from environment import OxygenLayer
+from physics import PHYSICS_SOLVERS
+from placement import PLACEMENT_STRATEGIES
+from simulation import Simulation
+
+DEFAULT_BASELINE_FILE = "bench_simulation_baseline.json"
+DEFAULT_THRESHOLD = 0.1
+
+# Named scenarios, each growing cultures from a few seed cells in an environment
+# small enough for them to reach saturation within the iterations
+SCENARIOS = {
+    "generic_growth": {
+        "description": "GenericCell culture growing from 10 seeds until contact inhibited",
+        "cell_types": (GenericCell,),
+        "initial_cell_nums": (10,),
+        "env_size": 100.0,
+        "env_layers": (),
+        "max_iteration": 96,
+        "seed": 1
+    },
+    "cancerous_growth": {
+        "description": "CancerousCell culture growing from 10 seeds, ignoring contact inhibition",
+        "cell_types": (CancerousCell,),
+        "initial_cell_nums": (10,),
+        "env_size": 100.0,
+        "env_layers": (),
+        "max_iteration": 40,
+        "seed": 2
+    },
+    "mixed": {
+        "description": "GenericCell and CancerousCell populations competing for space",
+        "cell_types": (GenericCell, CancerousCell),
+        "initial_cell_nums": (10, 10),
+        "env_size": 100.0,
+        "env_layers": (),
+        "max_iteration": 40,
+        "seed": 3
+    },
+    "hypoxic": {
+        "description": "Dense GenericCell culture made quiescent by a hypoxic oxygen layer",
+        "cell_types": (GenericCell,),
+        "initial_cell_nums": (60,),
+        "env_size": 100.0,
+        "env_layers": ((OxygenLayer, 0.4),),
+        "max_iteration": 30,
+        "seed": 4
+    }
+}
+
+def run_scenario(scenario, output_dir, physics_solver="auto", daughter_placement="random"):
+    """Runs a scenario once, timing each stage of its iterations.
+
+    Parameters
+    ----------
+    scenario : dict
+        the scenario setup from SCENARIOS
+    output_dir : string
+        the folder to write the simulation data to
+    physics_solver : string
+        the physical model used to solve cell overlap, one of PHYSICS_SOLVERS
+    daughter_placement : string
+        how the daughter cells are placed, one of PLACEMENT_STRATEGIES
+
+    Returns
+    -------
+    run : dict
+        the run's total and stage times, its total solver passes and its final
+        cell counts
+    """
+    env_size = scenario["env_size"]
+    env_layers = [env_layer(env_size, level) for env_layer, level in scenario["env_layers"]]
+
+    setup_start_time = time.perf_counter()
+    sim = Simulation(os.path.join(output_dir, "bench_sim.csv"), list(scenario["cell_types"]),
+                     list(scenario["initial_cell_nums"]), env_size, env_layers,
+                     scenario["max_iteration"], scenario["seed"], physics_solver=physics_solver,
+                     daughter_placement=daughter_placement)
+    setup_seconds = time.perf_counter() - setup_start_time
+
+    try:
+        sim.start_stage_timing()
+        start_time = time.perf_counter()
+        for _ in range(scenario["max_iteration"]):
+            sim.run_iteration()
+        seconds = time.perf_counter() - start_time
+
+        write_start_time = time.perf_counter()
+        sim.write_simulation()
+        write_seconds = time.perf_counter() - write_start_time
+    finally:
+        sim.close()
+
+    return {"seconds": seconds,
+            "iterations_per_second": scenario["max_iteration"] / seconds,
+            "stage_seconds": dict(sim.stage_times),
+            "setup_seconds": setup_seconds,
+            "write_seconds": write_seconds,
+            "solver_passes": sum(solve["passes"] for solve in sim.solver_telemetry.solves.values()),
+            "final_cells": len(sim.cells),
+            "final_alive_cells": sum(sim.get_population_counts().values())}
+
+def benchmark_scenario(name, repeats, physics_solver="auto", daughter_placement="random"):
+    """Runs a scenario the given number of times and keeps the fastest run.
+
+    The scenario is seeded, so every run simulates the same cells, and the
+    fastest run is the one least disturbed by other activity on the machine.
+
+    Returns
+    -------
+    result : dict
+        the scenario's setup and fastest run
+    """
+    scenario = SCENARIOS[name]
+    with tempfile.TemporaryDirectory() as output_dir:
+        runs = [run_scenario(scenario, output_dir, physics_solver, daughter_placement)
+                for _ in range(repeats)]
+    best_run = min(runs, key=lambda run: run["seconds"])
+
+    result = {"scenario": name,
+              "description": scenario["description"],
+              "cell_types": [cell_type.__name__ for cell_type in scenario["cell_types"]],
+              "initial_cell_nums": list(scenario["initial_cell_nums"]),
+              "env_size": scenario["env_size"],
+              "env_layers": {env_layer.__name__: level for env_layer, level in scenario["env_layers"]},
+              "iterations": scenario["max_iteration"],
+              "seed": scenario["seed"],
+              "physics_solver": physics_solver,
+              "daughter_placement": daughter_placement,
+              "repeat_seconds": [run["seconds"] for run in runs]}
+    result.update(best_run)
+    result["stage_fractions"] = {stage_name: stage_seconds / best_run["seconds"]
+                                 for stage_name, stage_seconds in best_run["stage_seconds"].items()}
+    return result
+
+def compare_with_baseline(results, baseline_results, threshold):
+    """Compares the iterations per second of each scenario with the baseline.
+
+    Parameters
+    ----------
+    results : list
+        the results of this run
+    baseline_results : list
+        the results saved in the baseline
+    threshold : float
+        the fraction the iterations per second can fall below the baseline's
+        before the scenario is flagged as a regression
+
+    Returns
+    -------
+    comparisons : list
+        a dictionary for each scenario in the baseline giving its baseline and
+        current iterations per second, their ratio, and whether it regressed
+    """
+    baseline = {result["scenario"]: result for result in baseline_results}
+    comparisons = []
+    for result in results:
+        baseline_result = baseline.get(result["scenario"])
+        if baseline_result is None:
+            continue
+        if baseline_result["iterations"] != result["iterations"]:
+            print(f"{result['scenario']}: not compared, the baseline ran "
+                  f"{baseline_result['iterations']} iterations")
+            continue
+        if baseline_result.get("physics_solver", "auto") != result["physics_solver"]:
+            print(f"{result['scenario']}: not compared, the baseline used the "
+                  f"{baseline_result.get('physics_solver', 'auto')} solver")
+            continue
+        if baseline_result.get("daughter_placement", "random") != result["daughter_placement"]:
+            print(f"{result['scenario']}: not compared, the baseline used "
+                  f"{baseline_result.get('daughter_placement', 'random')} placement")
+            continue
+
+        ratio = result["iterations_per_second"] / baseline_result["iterations_per_second"]
+        comparisons.append({
+            "scenario": result["scenario"],
+            "baseline_iterations_per_second": baseline_result["iterations_per_second"],
+            "iterations_per_second": result["iterations_per_second"],
+            "ratio": ratio,
+            "solver_pass_ratio": (result["solver_passes"] / baseline_result["solver_passes"]
+                                  if baseline_result.get("solver_passes") else None),
+            "stage_ratios": {
+                stage_name: baseline_result["stage_seconds"][stage_name] / stage_seconds
+                for stage_name, stage_seconds in result["stage_seconds"].items()
+                if stage_seconds > 0 and stage_name in baseline_result["stage_seconds"]},
+            "regression": ratio < 1 - threshold})
+    return comparisons
+
+def get_metadata(args):
+    """Gets details of the machine, software and code the benchmark was run with."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "arguments": vars(args)}
+
+def print_result(result):
+    """Prints the throughput and stage breakdown of a scenario."""
+    stages = "  ".join(f"{stage_name} {fraction:.0%}"
+                       for stage_name, fraction in result["stage_fractions"].items())
+    print(f"{result['scenario']:<17} {result['iterations_per_second']:8.2f} it/s "
+          f"({result['iterations']} iterations in {result['seconds']:.2f}s, "
+          f"{result['final_alive_cells']} alive cells, {result['solver_passes']} solver passes)  "
+          f"{stages}", flush=True)
+
+def print_comparison(comparison):
+    """Prints the change in throughput of a scenario from the baseline."""
+    stages = "  ".join(f"{stage_name} {ratio:.2f}x"
+                       for stage_name, ratio in comparison["stage_ratios"].items())
+    flag = "  REGRESSION" if comparison["regression"] else ""
+    passes = (f"  solver passes {comparison['solver_pass_ratio']:.2f}x"
+              if comparison["solver_pass_ratio"] is not None else "")
+    print(f"{comparison['scenario']:<17} {comparison['baseline_iterations_per_second']:8.2f} -> "
+          f"{comparison['iterations_per_second']:8.2f} it/s ({comparison['ratio']:.2f}x)  "
+          f"{stages}{passes}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of whole simulations.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated scenarios to run, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--repeats", type=int, default=3, help="runs of each scenario")
+    parser.add_argument("--solver", default="auto", choices=PHYSICS_SOLVERS,
+                        help="physical model used to solve cell overlap")
+    parser.add_argument("--placement", default="random", choices=PLACEMENT_STRATEGIES,
+                        help="how the daughter cells are placed")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE,
+                        help="JSON results file to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save the results as the baseline instead of comparing against it")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="fraction of the baseline's throughput that can be lost "
+                             "before a scenario is flagged")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to save the results to")
+    args = parser.parse_args()
+
+    scenario_names = [name for name in args.scenarios.split(",") if name]
+    for name in scenario_names:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    results = []
+    for name in scenario_names:
+        result = benchmark_scenario(name, args.repeats, args.solver, args.placement)
+        print_result(result)
+        results.append(result)
+
+    output = {"metadata": get_metadata(args), "results": results}
+    output_file = args.baseline if args.save_baseline else args.output
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved the results to {output_file}")
+    if args.save_baseline:
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} to compare against, "
+              f"record one with --save-baseline")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {args.baseline} (commit {baseline['metadata']['commit']}):")
+    comparisons = compare_with_baseline(results, baseline["results"], args.threshold)
+    for comparison in comparisons:
+        print_comparison(comparison)
+
+    regressions = [comparison["scenario"] for comparison in comparisons if comparison["regression"]]
+    if regressions:
+        print(f"Throughput fell by more than {args.threshold:.0%} in: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,7 +61,7 @@ class AbstractCellType(ABC, metaclass=ABCMeta):
         int
             cell cycle length in iterations (min 2 iterations)
         """
-        rand_cyc_len = np.random.normal(loc=self.MEAN_CYC_LEN, scale=self.STD_DEV_CYC_LEN, size=1)
+        rand_cyc_len = np.random.normal(loc=self.MEAN_CYC_LEN, scale=self.STD_DEV_CYC_LEN)
         return max(2, int(rand_cyc_len))
     
     def get_g1_len(self):
@@ -73,7 +73,7 @@ class AbstractCellType(ABC, metaclass=ABCMeta):
             G1 phase length in iterations (min 1 iteration)
         """
         g1_len_mean = self.cyc_len / 2.0
-        rand_g1_len = np.random.normal(loc=g1_len_mean, scale=g1_len_mean/10.0, size=1)
+        rand_g1_len = np.random.normal(loc=g1_len_mean, scale=g1_len_mean/10.0)
         return max(1, int(rand_g1_len))
     
     def get_growth_rate(self):
@@ -264,8 +264,7 @@ class GenericCell(AbstractCellType):
         start of its next cycle, generating a new cycle length.
         """
         self.cell_body.set_radius(self.SEED_RADIUS)
-        new_cell_pos = self.cell_body.pos + utils.rand_unit_vec() * self.SEED_RADIUS * 2.0
-        new_cell_pos = np.clip(new_cell_pos, self.SEED_RADIUS, self.sim.env_size - self.SEED_RADIUS)
+        new_cell_pos = self.sim.get_daughter_cell_pos(self, self.SEED_RADIUS)
         self.sim.seed_new_cell(GenericCell, new_cell_pos)
         
         self.current_age += 1
@@ -377,8 +376,7 @@ class CancerousCell(AbstractCellType):
         """
         self.cell_body.set_radius(self.SEED_RADIUS)
         
-        new_cell_pos = self.cell_body.pos + utils.rand_unit_vec() * (self.SEED_RADIUS * 2.0)
-        new_cell_pos = np.clip(new_cell_pos, self.SEED_RADIUS, self.sim.env_size - self.SEED_RADIUS)
+        new_cell_pos = self.sim.get_daughter_cell_pos(self, self.SEED_RADIUS)
         self.sim.seed_new_cell(CancerousCell, new_cell_pos)
         
         self.current_cyc_iteration = 0
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from collections import Counter, deque
 import csv
+import os
+import shutil
+import threading
+
+import numpy as np
 
 class DataWriter:
 
@@ -20,12 +26,29 @@ class DataWriter:
         self.output_file = output_file
         self.data = ""
 
-    def save_iteration(self, iteration_num, cells):
-        """Appends the cell data for the current iteration to the data string."""
+    def save_iteration(self, iteration_num, cells, population_summary=None):
+        """Appends the cell data for the current iteration to the data string.
+
+        Parameters
+        ----------
+        iteration_num : int
+            the simulation iteration being saved
+        cells : list
+            the cell agent objects in the simulation
+        population_summary : PopulationSummary
+            an optional population summary that the cells of each type and
+            phase are counted in, in the same pass over the cells
+        """
+        counts = Counter()
         for cell in cells:
+            cell_type_name = type(cell).__name__
             self.data += f"{iteration_num}\t{cell.id}\t{cell.is_dead}" \
-                + f"\t{type(cell).__name__}\t{cell.current_phase}" \
+                + f"\t{cell_type_name}\t{cell.current_phase}" \
                 + f"\t{(cell.cell_body.pos.tolist())}\t{cell.cell_body.radius}\n"
+            counts[cell_type_name, PopulationSummary.DEAD_PHASE if cell.is_dead else cell.current_phase] += 1
+
+        if population_summary is not None:
+            population_summary.record_counts(iteration_num, counts)
 
     def write_data(self):
         """Writes the data string to the output file location."""
@@ -69,6 +92,10 @@ class DataReader:
 
         file.close()
 
+    def has_iteration(self, iteration):
+        """Returns whether the data for the given iteration has been read."""
+        return iteration in self.data
+
     def get_iteration(self, iteration):
         """Gets the cell data for the given iteration.
         
@@ -77,3 +104,556 @@ class DataReader:
         dictionary entry for given simulation iteration
         """
         return self.data[iteration]
+
+    def get_iteration_arrays(self, iteration):
+        """Gets the cell data for the given iteration as arrays.
+
+        Returns
+        -------
+        dict
+            the cell data arrays in the same format as the IterationRingBuffer,
+            or None if the iteration has not been read
+        """
+        cells = self.data.get(iteration)
+        if cells is None:
+            return None
+        num_cells = len(cells)
+        return {
+            "id": np.fromiter((cell["id"] for cell in cells), dtype=np.int64, count=num_cells),
+            "is_dead": np.fromiter((cell["is_dead"] for cell in cells), dtype=bool, count=num_cells),
+            "cell_type": [cell["cell_type"] for cell in cells],
+            "current_phase": [cell["current_phase"] for cell in cells],
+            "pos": np.array([cell["pos"] for cell in cells], dtype=np.float64).reshape(-1, 3),
+            "radius": np.fromiter((cell["radius"] for cell in cells), dtype=np.float64, count=num_cells)
+        }
+
+
+class IterationRingBuffer:
+
+    def __init__(self, capacity):
+        """Constructs the necessary attributes for the IterationRingBuffer object.
+
+        The ring buffer holds the cell data of the most recent simulation iterations
+        in memory, so a running simulation can be visualised without writing and
+        reading the data file. Once it is full, the oldest iteration is dropped each
+        time a new iteration is saved.
+
+        It is written to from the simulation thread and read from the GUI thread,
+        and the lock is only held while an iteration is added or looked up, so
+        reading never blocks the simulation for longer than that.
+
+        Parameters
+        ----------
+        capacity : int
+            the maximum number of iterations to hold
+
+        Other defined attributes
+        ------------------------
+        iterations : collections.deque
+            the (iteration number, iteration arrays) pairs in the order they were saved
+        lock : threading.Lock
+            the lock guarding the iterations deque
+        """
+        self.capacity = capacity
+        self.iterations = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def save_iteration(self, iteration_num, cells):
+        """Copies the cell data for the given iteration into the ring buffer.
+
+        Parameters
+        ----------
+        iteration_num : int
+            the simulation iteration being saved
+        cells : list
+            the cell agent objects in the simulation
+        """
+        iteration_arrays = build_iteration_arrays(cells)
+
+        with self.lock:
+            self.iterations.append((iteration_num, iteration_arrays))
+
+    def get_iteration_range(self):
+        """Gets the first and last iterations held in the ring buffer.
+
+        Returns
+        -------
+        tuple
+            the first and last iteration numbers, or None if the buffer is empty
+        """
+        with self.lock:
+            if not self.iterations:
+                return None
+            return self.iterations[0][0], self.iterations[-1][0]
+
+    def holds_all_iterations(self):
+        """Returns whether no iterations have been dropped from the ring buffer."""
+        iteration_range = self.get_iteration_range()
+        return iteration_range is not None and iteration_range[0] == 0
+
+    def get_iteration_arrays(self, iteration):
+        """Gets the arrays of cell data saved for the given iteration.
+
+        Returns
+        -------
+        dict
+            the cell data arrays for the iteration, or None if it is not held
+        """
+        with self.lock:
+            if not self.iterations:
+                return None
+            index = iteration - self.iterations[0][0]
+            if 0 <= index < len(self.iterations):
+                return self.iterations[index][1]
+            return None
+
+    def has_iteration(self, iteration):
+        """Returns whether the data for the given iteration is held in the ring buffer."""
+        return self.get_iteration_arrays(iteration) is not None
+
+    def get_iteration(self, iteration):
+        """Gets the cell data for the given iteration in the same format as the DataReader.
+
+        Returns
+        -------
+        list
+            a list of cell dictionaries for the given simulation iteration
+        """
+        iteration_arrays = self.get_iteration_arrays(iteration)
+        if iteration_arrays is None:
+            raise KeyError(iteration)
+
+        return get_cell_dicts(iteration_arrays)
+
+
+class Trajectory:
+
+    def __init__(self, data_file, data_source=None, population_summary=None, spheroid_metrics=None):
+        """Constructs the necessary attributes for the Trajectory object.
+
+        The trajectory is the single handle on a simulation's saved data, shared
+        by the graphs, the visualisation playback and the data export. The cell
+        data is decoded into arrays at most once, the first time it is needed,
+        unless it is given by a data source already holding every iteration in
+        memory, e.g. the IterationRingBuffer filled while the simulation ran.
+        It can be read from several threads at once.
+
+        Parameters
+        ----------
+        data_file : string
+            the name of the simulation data file
+        data_source : IterationRingBuffer
+            an optional source holding every iteration of the simulation, used
+            instead of decoding the data file
+        population_summary : PopulationSummary
+            the optional population summary of the simulation, loaded from the
+            summary file if not given
+        spheroid_metrics : SpheroidMetrics
+            the optional spheroid metrics of the simulation, loaded from the
+            metrics file if not given
+
+        Other defined attributes
+        ------------------------
+        iterations : dict
+            the cell data arrays of each iteration decoded from the data file,
+            None until they are first needed
+        lock : threading.Lock
+            the lock guarding the decoding of the data file
+        """
+        self.data_file = data_file
+        self.data_source = data_source
+        self.population_summary = population_summary
+        self.spheroid_metrics = spheroid_metrics
+        self.iterations = None
+        self.lock = threading.Lock()
+
+    def read_data(self):
+        """Decodes the data file into cell data arrays, if it has not been decoded yet."""
+        with self.lock:
+            if self.iterations is not None:
+                return
+
+            self.iterations = dict(iterate_data_file(self.data_file))
+
+    def get_iteration_range(self):
+        """Gets the first and last iterations of the simulation.
+
+        Returns
+        -------
+        tuple
+            the first and last iteration numbers, or None if there are no iterations
+        """
+        if self.data_source is not None:
+            return self.data_source.get_iteration_range()
+        self.read_data()
+        if not self.iterations:
+            return None
+        return min(self.iterations), max(self.iterations)
+
+    def get_iteration_arrays(self, iteration):
+        """Gets the cell data for the given iteration as arrays.
+
+        Returns
+        -------
+        dict
+            the cell data arrays for the iteration, or None if the simulation does not have it
+        """
+        if self.data_source is not None:
+            return self.data_source.get_iteration_arrays(iteration)
+        self.read_data()
+        return self.iterations.get(iteration)
+
+    def has_iteration(self, iteration):
+        """Returns whether the simulation has data for the given iteration."""
+        return self.get_iteration_arrays(iteration) is not None
+
+    def get_iteration(self, iteration):
+        """Gets the cell data for the given iteration in the same format as the DataReader.
+
+        Returns
+        -------
+        list
+            a list of cell dictionaries for the given simulation iteration
+        """
+        iteration_arrays = self.get_iteration_arrays(iteration)
+        if iteration_arrays is None:
+            raise KeyError(iteration)
+
+        return get_cell_dicts(iteration_arrays)
+
+    def get_population_summary(self):
+        """Gets the population summary of the simulation, loading it on first use.
+
+        Returns
+        -------
+        PopulationSummary
+            the population counts of each iteration of the simulation
+        """
+        if self.population_summary is None:
+            self.population_summary = load_population_summary(self.data_file)
+        return self.population_summary
+
+    def get_spheroid_metrics(self):
+        """Gets the spheroid metrics of the simulation, loading them on first use.
+
+        Returns
+        -------
+        SpheroidMetrics
+            the spheroid metrics of each iteration of the simulation
+        """
+        if self.spheroid_metrics is None:
+            from analytics import load_spheroid_metrics
+
+            self.spheroid_metrics = load_spheroid_metrics(self.data_file)
+        return self.spheroid_metrics
+
+    def export(self, save_file):
+        """Copies the simulation data file and its summary, metrics and solver
+        telemetry files to a new location.
+
+        The files are copied by the operating system without being read into
+        Python, e.g. using sendfile on Linux. The metrics and solver telemetry
+        files are only copied if they have been saved.
+
+        Parameters
+        ----------
+        save_file : string
+            the name of the file to copy the simulation data to
+        """
+        shutil.copyfile(self.data_file, save_file)
+
+        summary_file = get_summary_file(self.data_file)
+        if os.path.exists(summary_file):
+            shutil.copyfile(summary_file, get_summary_file(save_file))
+        else:
+            self.get_population_summary().write(get_summary_file(save_file))
+
+        for sidecar_name in ("metrics", "solver"):
+            sidecar_file = get_sidecar_file(self.data_file, sidecar_name)
+            if os.path.exists(sidecar_file):
+                shutil.copyfile(sidecar_file, get_sidecar_file(save_file, sidecar_name))
+
+
+def build_iteration_arrays(cells):
+    """Copies the data of the cells in a running simulation into cell data arrays.
+
+    Parameters
+    ----------
+    cells : list
+        the cell agent objects in the simulation
+
+    Returns
+    -------
+    dict
+        the cell data arrays in the same format as the IterationRingBuffer
+    """
+    num_cells = len(cells)
+    return {
+        "id": np.fromiter((cell.id for cell in cells), dtype=np.int64, count=num_cells),
+        "is_dead": np.fromiter((cell.is_dead for cell in cells), dtype=bool, count=num_cells),
+        "cell_type": [type(cell).__name__ for cell in cells],
+        "current_phase": [cell.current_phase for cell in cells],
+        "pos": np.array([cell.cell_body.pos for cell in cells], dtype=np.float64).reshape(-1, 3),
+        "radius": np.fromiter((cell.cell_body.radius for cell in cells),
+                              dtype=np.float64, count=num_cells)
+    }
+
+def iterate_data_file(data_file):
+    """Streams the cell data arrays of each iteration from a simulation data file.
+
+    The rows are converted to arrays one iteration at a time, so only a single
+    iteration's rows are held as strings at once. The data file holds the rows
+    of each iteration together, as written by the DataWriter.
+
+    Parameters
+    ----------
+    data_file : string
+        the name of the simulation data file
+
+    Yields
+    ------
+    iteration : int
+        the simulation iteration
+    iteration_arrays : dict
+        the cell data arrays of the iteration in the same format as the IterationRingBuffer
+    """
+    # Share one string object between all cells with the same type or phase
+    names = {}
+    iteration_rows = []
+    with open(data_file, newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if iteration_rows and row[0] != iteration_rows[0][0]:
+                yield int(iteration_rows[0][0]), decode_rows(iteration_rows, names)
+                iteration_rows = []
+            iteration_rows.append(row)
+    if iteration_rows:
+        yield int(iteration_rows[0][0]), decode_rows(iteration_rows, names)
+
+def decode_rows(rows, names):
+    """Converts the data file rows of an iteration into cell data arrays.
+
+    Parameters
+    ----------
+    rows : list
+        the tab separated fields of each row of the iteration
+    names : dict
+        the cell type and phase strings seen so far, so that equal names share one object
+
+    Returns
+    -------
+    dict
+        the cell data arrays in the same format as the IterationRingBuffer
+    """
+    num_cells = len(rows)
+    return {
+        "id": np.fromiter((int(row[1]) for row in rows), dtype=np.int64, count=num_cells),
+        "is_dead": np.fromiter((row[2] == "True" for row in rows), dtype=bool, count=num_cells),
+        "cell_type": [names.setdefault(row[3], row[3]) for row in rows],
+        "current_phase": [names.setdefault(row[4], row[4]) for row in rows],
+        "pos": np.array([row[5].strip("[]").split(",") for row in rows],
+                        dtype=np.float64).reshape(-1, 3),
+        "radius": np.fromiter((float(row[6]) for row in rows), dtype=np.float64, count=num_cells)
+    }
+
+def get_cell_dicts(iteration_arrays):
+    """Converts the cell data arrays of an iteration into the DataReader's cell dictionaries.
+
+    Parameters
+    ----------
+    iteration_arrays : dict
+        the cell data arrays of the iteration
+
+    Returns
+    -------
+    list
+        a list of a dictionary of the data of each cell
+    """
+    return [{"id": int(iteration_arrays["id"][i]),
+             "is_dead": bool(iteration_arrays["is_dead"][i]),
+             "cell_type": iteration_arrays["cell_type"][i],
+             "current_phase": iteration_arrays["current_phase"][i],
+             "pos": iteration_arrays["pos"][i].tolist(),
+             "radius": float(iteration_arrays["radius"][i])}
+            for i in range(len(iteration_arrays["id"]))]
+
+
+def get_sidecar_file(data_file, sidecar_name):
+    """Gets the name of a file saved alongside a simulation data file.
+
+    Parameters
+    ----------
+    data_file : string
+        the name of the simulation data file
+    sidecar_name : string
+        the name identifying the kind of file, e.g. "summary"
+
+    Returns
+    -------
+    string
+        the name of the file, e.g. sim_data.summary.csv for sim_data.csv
+    """
+    root, extension = os.path.splitext(data_file)
+    return root + "." + sidecar_name + (extension or ".csv")
+
+def get_summary_file(data_file):
+    """Gets the name of the population summary file saved alongside a simulation data file."""
+    return get_sidecar_file(data_file, "summary")
+
+def load_population_summary(data_file):
+    """Loads the population summary of a simulation data file.
+
+    The summary file is read if it is at least as new as the data file. Otherwise
+    it is generated from the data file, e.g. for data files saved before summary
+    files were written, and saved so later loads are instant.
+
+    Parameters
+    ----------
+    data_file : string
+        the name of the simulation data file
+
+    Returns
+    -------
+    PopulationSummary
+        the population counts of each iteration of the simulation
+    """
+    summary_file = get_summary_file(data_file)
+    if (os.path.exists(summary_file)
+            and os.path.getmtime(summary_file) >= os.path.getmtime(data_file)):
+        return PopulationSummary.read(summary_file)
+
+    summary = PopulationSummary.from_data_file(data_file)
+    summary.write(summary_file)
+    return summary
+
+
+class PopulationSummary:
+    # Phase name that the dead cells of each type are counted under
+    DEAD_PHASE = "Dead"
+    HEADER = ("iteration", "cell_type", "phase", "count")
+
+    def __init__(self):
+        """Constructs the necessary attributes for the PopulationSummary object.
+
+        The summary holds the number of cells of each cell type in each cell cycle
+        phase at each iteration, with dead cells counted under DEAD_PHASE. It is
+        small enough to be read instantly, so graphs don't need the full
+        simulation data.
+
+        Other defined attributes
+        ------------------------
+        counts : dict
+            a dictionary relating each iteration to a dictionary of the counts
+            of each (cell type name, phase) pair
+        """
+        self.counts = {}
+
+    def record_counts(self, iteration, counts):
+        """Records the cells of each type and phase in an iteration, counted while it was saved.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        counts : dict
+            the counts of each (cell type name, phase) pair
+        """
+        self.counts[iteration] = dict(counts)
+
+    def get_iterations(self):
+        """Gets the iterations in the summary in ascending order."""
+        return sorted(self.counts)
+
+    def get_alive_counts(self, iteration, cell_type_names=()):
+        """Gets the number of alive cells of each cell type at an iteration.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        cell_type_names : list
+            names of cell types to include with a count of 0 if they have no cells
+
+        Returns
+        -------
+        alive_cell_count : dict
+            a dictionary relating each cell type name to its alive population
+        """
+        alive_cell_count = {cell_type_name: 0 for cell_type_name in cell_type_names}
+        for (cell_type_name, phase), count in self.counts[iteration].items():
+            if phase != self.DEAD_PHASE:
+                alive_cell_count[cell_type_name] = alive_cell_count.get(cell_type_name, 0) + count
+            else:
+                alive_cell_count.setdefault(cell_type_name, 0)
+        return alive_cell_count
+
+    def get_population_data(self, cell_type_names):
+        """Gets the alive population of each cell type over the simulation.
+
+        Parameters
+        ----------
+        cell_type_names : list
+            the names of the cell types to get the populations of
+
+        Returns
+        -------
+        iterations : list
+            the iterations in ascending order
+        population_data : dict
+            a dictionary relating each cell type name to a list of its alive
+            population counts at each iteration
+        """
+        iterations = self.get_iterations()
+        population_data = {cell_type_name: [] for cell_type_name in cell_type_names}
+        for iteration in iterations:
+            alive_cell_count = self.get_alive_counts(iteration, cell_type_names)
+            for cell_type_name in cell_type_names:
+                population_data[cell_type_name].append(alive_cell_count[cell_type_name])
+        return iterations, population_data
+
+    def write(self, summary_file):
+        """Writes the summary to a tab separated file with one row per iteration, type and phase."""
+        with open(summary_file, "w", newline="") as f:
+            csvwriter = csv.writer(f, delimiter="\t")
+            csvwriter.writerow(self.HEADER)
+            for iteration in self.get_iterations():
+                for (cell_type_name, phase), count in sorted(self.counts[iteration].items()):
+                    csvwriter.writerow((iteration, cell_type_name, phase, count))
+
+    @classmethod
+    def read(cls, summary_file):
+        """Reads a summary written by the write function.
+
+        Returns
+        -------
+        PopulationSummary
+            the summary read from the file
+        """
+        summary = cls()
+        with open(summary_file, newline="") as f:
+            csvreader = csv.reader(f, delimiter="\t")
+            next(csvreader, None)
+            for row in csvreader:
+                summary.counts.setdefault(int(row[0]), {})[(row[1], row[2])] = int(row[3])
+        return summary
+
+    @classmethod
+    def from_data_file(cls, data_file):
+        """Generates the summary of a simulation data file.
+
+        Only the iteration, state, cell type and phase columns are read, so the
+        cell positions are never parsed.
+
+        Returns
+        -------
+        PopulationSummary
+            the summary of the simulation data
+        """
+        summary = cls()
+        with open(data_file, newline="") as f:
+            csvreader = csv.reader(f, delimiter="\t")
+            counts = Counter(
+                (int(row[0]), row[3], cls.DEAD_PHASE if row[2] == "True" else row[4])
+                for row in csvreader)
+        for (iteration, cell_type_name, phase), count in counts.items():
+            summary.counts.setdefault(iteration, {})[(cell_type_name, phase)] = count
+        return summary
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs ensembles of simulations over parameter sweeps without the GUI.
+
+A sweep specification is a JSON file giving the base simulation setup and the
+values of each parameter to sweep over, for example:
+
+{
+    "cell_types": ["GenericCell"],
+    "initial_cell_nums": [10],
+    "env_size": 200.0,
+    "env_layers": {"OxygenLayer": 1.0},
+    "max_iteration": 50,
+    "replicates": 5,
+    "base_seed": 1,
+    "sweep": {
+        "GenericCell.MEAN_CYC_LEN": [12.0, 24.0],
+        "env_layers.OxygenLayer": [0.3, 1.0],
+        "initial_cell_nums": [[10], [50]]
+    }
+}
+
+The optional "physics_solver" parameter chooses the physical model, one of
+"auto" (the default), "base", "locals", "active_set" or "clusters", and can
+also be swept to compare them. Likewise the
+optional "daughter_placement" parameter chooses how daughter cells are placed,
+one of "random" (the default), "least_crowded" or "nearest_free", and the
+optional "seeding" parameter chooses how the initial cells are positioned, one
+of "random" (the default), "poisson_disk", "lattice" or "colony", or a list
+with a strategy for each cell type. The jobs already run in parallel, so the
+"clusters" solver uses one worker per job unless the optional
+"physics_workers" parameter says otherwise.
+
+Every combination of the swept values is run "replicates" times, each with its
+own derived random seed, on a process pool. Each job writes its trajectory to
+<job_id>.csv and its parameters and population curves to <job_id>.json in the
+output folder, along with its spheroid metrics (see analytics.py) in
+<job_id>.metrics.csv and its physics solver telemetry in <job_id>.solver.csv,
+and a summary table of all population curves is written to
+summary.csv. Jobs whose .json file already exists are skipped, so an
+interrupted ensemble can be resumed by running it again. A job that fails
+does not stop the others: its traceback is reported, it is left out of the
+summary table and it is run again when the ensemble is resumed. With --video,
+each worker also renders a video of its job to <job_id>.mp4 using an offscreen
+OpenGL context, so no display is needed. With --profile, the time spent in each
+stage of every iteration is saved to <job_id>.profile.csv, .json and .trace.json
+(see profiling.py). With --memory, the memory in use after every iteration and
+its peak are saved to <job_id>.memory.csv and .json (see memory.py).
+
+Usage: python ensemble.py sweep.json -o ensemble_output [-j WORKERS] [--video] [--profile] [--memory]
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from analytics import SpheroidMetrics, get_metrics_file
+from cell_type import *
+from environment import *
+from memory import NULL_MEMORY_TRACKER, MemoryTracker
+from profiling import NULL_PROFILER, Profiler
+from simulation import Simulation
+import utils
+
+SUMMARY_FILE = "summary.csv"
+
+def expand_sweep(spec):
+    """Expands a sweep specification into the list of jobs to run.
+
+    Parameters
+    ----------
+    spec : dict
+        the sweep specification
+
+    Returns
+    -------
+    jobs : list
+        a list of job dictionaries holding the job ID, the full parameter set,
+        the replicate number and the derived random seed of each job
+    """
+    base_params = {key: value for key, value in spec.items()
+                   if key not in ("sweep", "replicates", "base_seed")}
+    sweep = spec.get("sweep", {})
+    replicates = spec.get("replicates", 1)
+    base_seed = spec.get("base_seed", 0)
+
+    sweep_keys = sorted(sweep)
+    jobs = []
+    for values in itertools.product(*[sweep[key] for key in sweep_keys]):
+        params = dict(base_params)
+        params.update(zip(sweep_keys, values))
+
+        for replicate in range(replicates):
+            job_key = json.dumps({"params": params, "replicate": replicate}, sort_keys=True)
+            job_hash = hashlib.sha1(job_key.encode()).hexdigest()
+            jobs.append({
+                "job_id": f"job_{job_hash[:12]}",
+                "params": params,
+                "replicate": replicate,
+                "seed": derive_seed(base_seed, job_hash)
+            })
+
+    return jobs
+
+def derive_seed(base_seed, job_hash):
+    """Derives an independent random seed for a job from the ensemble base seed.
+
+    Parameters
+    ----------
+    base_seed : int
+        the random seed of the whole ensemble
+    job_hash : string
+        the hex digest identifying the job
+
+    Returns
+    -------
+    int
+        a non-zero seed that can be passed to numpy (the Simulation treats 0 as no seed)
+    """
+    seed_sequence = np.random.SeedSequence([base_seed, int(job_hash[:16], 16)])
+    seed = int(seed_sequence.generate_state(1)[0])
+    return seed % (2**32 - 1) + 1
+
+def get_class_by_name(parent_class, name):
+    """Gets the subclass of the parent class with the given name."""
+    for subclass in utils.get_all_subclasses(parent_class):
+        if subclass.__name__ == name:
+            return subclass
+    raise ValueError(f"Unknown {parent_class.__name__} subclass: {name}")
+
+def run_job(job, output_dir, render_video=False, profile=False, track_memory=False):
+    """Runs a single simulation job and saves its outputs.
+
+    This is run in a worker process. Cell type constants overridden by the job
+    (keys of the form "CellType.CONSTANT") are restored after the job has run.
+
+    Parameters
+    ----------
+    job : dict
+        the job dictionary produced by expand_sweep
+    output_dir : string
+        the folder to write the job outputs to
+    render_video : bool
+        whether to also render a video of the job in an offscreen OpenGL context
+    profile : bool
+        whether to profile the stages of the job's simulation and save the
+        profile to <job_id>.profile.csv, .json and .trace.json
+    track_memory : bool
+        whether to track the memory of the job's simulation and save the report
+        to <job_id>.memory.csv and .json
+
+    Returns
+    -------
+    job_result : dict
+        the job dictionary with the iterations, population curves and run time added
+    """
+    params = dict(job["params"])
+    env_layer_levels = dict(params.get("env_layers", {}))
+    constant_overrides = []
+
+    for key in list(params):
+        if key.startswith("env_layers."):
+            env_layer_levels[key.split(".", 1)[1]] = params.pop(key)
+        elif "." in key:
+            class_name, constant = key.split(".", 1)
+            constant_overrides.append(
+                (get_class_by_name(AbstractCellType, class_name), constant, params.pop(key)))
+
+    cell_types = [get_class_by_name(AbstractCellType, name) for name in params["cell_types"]]
+    env_size = params["env_size"]
+    env_layers = [get_class_by_name(AbstractEnvironmentLayer, name)(env_size, level)
+                  for name, level in env_layer_levels.items()]
+    max_iteration = params["max_iteration"]
+
+    original_constants = [(cell_type, constant, getattr(cell_type, constant))
+                          for cell_type, constant, _ in constant_overrides]
+    for cell_type, constant, value in constant_overrides:
+        setattr(cell_type, constant, value)
+
+    start_time = time.perf_counter()
+    sim = None
+    try:
+        trajectory_file = os.path.join(output_dir, job["job_id"] + ".csv")
+        profiler = Profiler() if profile else NULL_PROFILER
+        memory_tracker = MemoryTracker() if track_memory else NULL_MEMORY_TRACKER
+        if track_memory:
+            memory_tracker.start()
+        spheroid_metrics = SpheroidMetrics()
+        record_metrics = lambda sim: spheroid_metrics.record_iteration(sim.sim_iteration, sim.cells)
+        sim = Simulation(trajectory_file, cell_types, params["initial_cell_nums"],
+                         env_size, env_layers, max_iteration, job["seed"],
+                         iteration_hooks=[record_metrics], profiler=profiler,
+                         save_solver_telemetry=True, memory_tracker=memory_tracker,
+                         physics_solver=params.get("physics_solver", "auto"),
+                         daughter_placement=params.get("daughter_placement", "random"),
+                         seeding=params.get("seeding", "random"),
+                         physics_workers=params.get("physics_workers", 1))
+
+        population_data = {cell_type.__name__: [] for cell_type in cell_types}
+        add_population_counts(population_data, sim)
+        for _ in range(max_iteration):
+            sim.run_iteration()
+            add_population_counts(population_data, sim)
+
+        sim.write_simulation()
+        spheroid_metrics.write(get_metrics_file(trajectory_file))
+        if profile:
+            profiler.export(os.path.join(output_dir, job["job_id"] + ".profile"))
+        if track_memory:
+            memory_tracker.export(os.path.join(output_dir, job["job_id"] + ".memory"))
+    finally:
+        if sim is not None:
+            sim.close()
+        if track_memory:
+            memory_tracker.stop()
+        for cell_type, constant, value in original_constants:
+            setattr(cell_type, constant, value)
+
+    if render_video:
+        # Imported here so OpenGL is only loaded, with the offscreen platform, when needed
+        import offscreen
+        offscreen.render_video(trajectory_file, env_size,
+                               os.path.join(output_dir, job["job_id"] + ".mp4"))
+
+    job_result = dict(job)
+    job_result["iterations"] = list(range(max_iteration + 1))
+    job_result["population_data"] = population_data
+    job_result["run_time"] = time.perf_counter() - start_time
+    job_result["solver_summary"] = sim.get_solver_telemetry().get_summary()
+    job_result["placement_summary"] = sim.daughter_placement.get_summary()
+    job_result["seeding_summary"] = sim.initial_seeding.get_summary()
+
+    # The result file marks the job as complete, so write it atomically
+    result_file = os.path.join(output_dir, job["job_id"] + ".json")
+    with open(result_file + ".tmp", "w") as f:
+        json.dump(job_result, f)
+    os.replace(result_file + ".tmp", result_file)
+
+    return job_result
+
+def add_population_counts(population_data, sim):
+    """Appends the alive cell count of each cell type to the population data."""
+    for cell_type, count in sim.get_population_counts().items():
+        population_data[cell_type].append(count)
+
+def run_ensemble(spec, output_dir, workers=None, resume=True, render_video=False, profile=False,
+                 track_memory=False):
+    """Runs all of the jobs in the sweep specification on a process pool.
+
+    Parameters
+    ----------
+    spec : dict
+        the sweep specification
+    output_dir : string
+        the folder to write the job outputs and summary table to
+    workers : int
+        the number of worker processes, the number of available cores if not given
+    resume : bool
+        whether to skip jobs that have already been completed in the output folder
+    render_video : bool
+        whether each job should also render a video of its simulation
+    profile : bool
+        whether each job should save a profile of its simulation's stages
+    track_memory : bool
+        whether each job should save a report of its simulation's memory
+
+    Returns
+    -------
+    results : list
+        the job results of every job in the ensemble, where a job that raised
+        an exception has its job dictionary with the "error" traceback instead,
+        and is left out of the summary table and rerun when resuming
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = expand_sweep(spec)
+
+    results = []
+    pending_jobs = []
+    for job in jobs:
+        result_file = os.path.join(output_dir, job["job_id"] + ".json")
+        if resume and os.path.exists(result_file):
+            with open(result_file) as f:
+                results.append(json.load(f))
+        else:
+            pending_jobs.append(job)
+
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending_jobs)} already complete")
+
+    if pending_jobs:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending_jobs))) as executor:
+            futures = {executor.submit(run_job, job, output_dir, render_video, profile, track_memory): job
+                       for job in pending_jobs}
+            num_failed = 0
+            for num_done, future in enumerate(as_completed(futures), 1):
+                try:
+                    job_result = future.result()
+                except Exception as error:
+                    # Record the failed job and carry on with the rest of the sweep
+                    num_failed += 1
+                    job_result = dict(futures[future])
+                    job_result["error"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+                    results.append(job_result)
+                    print(f"[{num_done}/{len(pending_jobs)}] {job_result['job_id']} FAILED "
+                          f"({num_failed} failed): {error!r}")
+                    continue
+                results.append(job_result)
+                print(f"[{num_done}/{len(pending_jobs)}] {job_result['job_id']} "
+                      f"finished in {job_result['run_time']:.1f}s"
+                      + (f" ({num_failed} failed)" if num_failed else ""))
+
+    job_order = {job["job_id"]: i for i, job in enumerate(jobs)}
+    results.sort(key=lambda job_result: job_order[job_result["job_id"]])
+    write_summary(results, os.path.join(output_dir, SUMMARY_FILE))
+
+    return results
+
+def write_summary(results, summary_file):
+    """Writes the population curves of all jobs to a single tab separated table.
+
+    Each row holds the job ID, replicate, seed, swept parameter values,
+    iteration, cell type and alive population.
+
+    Parameters
+    ----------
+    results : list
+        the job results to summarise
+    summary_file : string
+        the file to write the summary table to
+    """
+    param_keys = sorted({key for job_result in results if "error" not in job_result
+                         for key in job_result["params"]})
+
+    with open(summary_file, "w") as f:
+        f.write("\t".join(["job_id", "replicate", "seed"] + param_keys
+                          + ["iteration", "cell_type", "alive"]) + "\n")
+        for job_result in results:
+            if "error" in job_result:
+                continue
+            job_columns = [job_result["job_id"], str(job_result["replicate"]), str(job_result["seed"])]
+            job_columns += [json.dumps(job_result["params"].get(key)) for key in param_keys]
+            for cell_type, populations in job_result["population_data"].items():
+                for iteration, alive in zip(job_result["iterations"], populations):
+                    f.write("\t".join(job_columns + [str(iteration), cell_type, str(alive)]) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an ensemble of simulations over a parameter sweep.")
+    parser.add_argument("spec", help="JSON sweep specification file")
+    parser.add_argument("-o", "--output-dir", default="ensemble_output",
+                        help="folder to write the job outputs and summary to")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="rerun jobs that have already been completed")
+    parser.add_argument("--video", action="store_true",
+                        help="render a video of each job without a display")
+    parser.add_argument("--profile", action="store_true",
+                        help="save a profile of the stages of each job's simulation")
+    parser.add_argument("--memory", action="store_true",
+                        help="save a report of the memory used by each job's simulation")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+
+    results = run_ensemble(spec, args.output_dir, args.workers, resume=not args.no_resume,
+                           render_video=args.video, profile=args.profile, track_memory=args.memory)
+
+    failed_jobs = [job_result for job_result in results if "error" in job_result]
+    for job_result in failed_jobs:
+        print(f"\n{job_result['job_id']} failed:\n{job_result['error']}", file=sys.stderr)
+    if failed_jobs:
+        sys.exit(f"{len(failed_jobs)} of {len(results)} jobs failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
 
 import matplotlib
-matplotlib.use('Qt5Agg')
+matplotlib.use('QtAgg')
 
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+import numpy as np
 
-from data import DataReader
-from visualiser import Visualiser
+from data import load_population_summary
+from render_data import CELL_COLOURS
+
+# Graphs of the spheroid metrics that can be chosen in the graph panel, relating
+# each graph title to its y axis label and the metrics plotted on it
+METRIC_GRAPHS = {
+    "Spheroid size": ("Radius", ("spheroid_radius", "radius_of_gyration",
+                                 "quiescent_core_radius", "necrotic_core_radius")),
+    "Cell radius": ("Alive cell radius", ("cell_radius_p10", "cell_radius_p50",
+                                          "cell_radius_p90", "cell_radius_mean")),
+    "Phase fractions": ("Fraction of cells", ("fraction_G0", "fraction_G1", "fraction_S",
+                                              "fraction_G2", "fraction_M", "fraction_dead")),
+    "Centre of mass": ("Position", ("centre_x", "centre_y", "centre_z"))
+}
 
 class PopulationGraphCanvas(FigureCanvas):
     def __init__(self, input_file, parent=None, width=5, height=4, dpi=100):
@@ -25,71 +38,73 @@ class PopulationGraphCanvas(FigureCanvas):
             the height of the graph canvas
         dpi : int
             the dpi of the graph canvas figure
+
+        Other defined attributes
+        ------------------------
+        live_iterations : list
+            the iterations plotted so far while a simulation is running
+        live_population_data : dict
+            a dictionary relating each cell type name to its alive population
+            counts plotted so far while a simulation is running
+        live_lines : dict
+            a dictionary relating each cell type name to its plotted line
         """
         self.input_file = input_file
         self.parent = parent
+        self.live_iterations = []
+        self.live_population_data = {}
+        self.live_lines = {}
         
         self.fig = Figure(figsize=(width, height), dpi=dpi)
         self.axes = self.fig.add_subplot(111)
         
         super(PopulationGraphCanvas, self).__init__(self.fig)
 
-    def get_population_data(self, cell_types):
+    def get_population_data(self, cell_types, population_summary=None):
         """Gets the data from the simulation to plot in the graph.
+
+        The counts are read from the population summary saved alongside the
+        simulation data, which is generated from the data file if it is missing,
+        unless the summary is given.
         
         Parameters
         ----------
         cell_types : list
             a list of the cell type classes that are present in the simulation
+        population_summary : PopulationSummary
+            the optional population summary of the simulation, e.g. from its Trajectory
         
         Returns
         -------
-        iterations : int
-            the number of iterations to plot on the x axis
+        iterations : list
+            the iterations to plot on the x axis
         population_data : dict
             a dictionary relating each cell type name to a list of their alive
             population counts at each iteration to plot on the y axis
         """
-        data_reader = DataReader(self.input_file)
-        data_reader.read_data()
-
-        iterations = []
-        
-        population_data = {}
-        for cell_type in cell_types:
-            population_data[cell_type.__name__] = []
-
-        for iteration, cell_dict_list in data_reader.data.items():
-            iterations.append(iteration)
-            
-            alive_cell_count = {}
-            for cell_type in cell_types:
-                alive_cell_count[cell_type.__name__] = 0
-
-            for cell_dict in cell_dict_list:
-                if not cell_dict["is_dead"]:
-                    cell_type = cell_dict["cell_type"]
-                    alive_cell_count[cell_type] += 1
-            
-            for cell_type in alive_cell_count:
-                population_data[cell_type].append(alive_cell_count[cell_type])
+        if population_summary is None:
+            population_summary = load_population_summary(self.input_file)
+        iterations, population_data = population_summary.get_population_data(
+            [cell_type.__name__ for cell_type in cell_types])
         
         return iterations, population_data
 
-    def plot_data(self, cell_types):
+    def plot_data(self, cell_types, population_summary=None):
         """Plots the cell population data from the simulation on the graph canvas.
         
         Parameters
         ----------
         cell_types : list
             a list of the cell type classes that are present in the simulation
+        population_summary : PopulationSummary
+            the optional population summary of the simulation, e.g. from its Trajectory
         """
         self.clear()
         
-        iterations, population_data = self.get_population_data(cell_types)
+        iterations, population_data = self.get_population_data(cell_types, population_summary)
         for cell_type in population_data:
             self.axes.plot(iterations, population_data[cell_type], 
-                           color=Visualiser.cell_colours[cell_type]["Normal"], label=cell_type)
+                           color=CELL_COLOURS[cell_type]["Normal"], label=cell_type)
         
         self.axes.set_axis_on()
         self.axes.set_xlabel("Iteration")
@@ -102,6 +117,92 @@ class PopulationGraphCanvas(FigureCanvas):
         
         self.fig.tight_layout()
 
+    def plot_metrics(self, spheroid_metrics, graph_title):
+        """Plots one of the METRIC_GRAPHS of the simulation's spheroid metrics on the graph canvas.
+
+        Metrics that are undefined at every iteration, e.g. the necrotic core
+        radius when no cells have died, are left out.
+
+        Parameters
+        ----------
+        spheroid_metrics : SpheroidMetrics
+            the spheroid metrics of the simulation
+        graph_title : string
+            the title of the graph in METRIC_GRAPHS to plot
+        """
+        self.clear()
+
+        y_label, metric_names = METRIC_GRAPHS[graph_title]
+        num_lines = 0
+        for metric_name in metric_names:
+            iterations, values = spheroid_metrics.get_metric(metric_name)
+            if np.isnan(values).all():
+                continue
+            self.axes.plot(iterations, values, label=metric_name.replace("_", " ").capitalize())
+            num_lines += 1
+
+        self.axes.set_axis_on()
+        self.axes.set_xlabel("Iteration")
+        self.axes.set_ylabel(y_label)
+        self.axes.set_title(graph_title + " over time")
+        self.axes.grid()
+
+        if num_lines > 1:
+            self.axes.legend()
+
+        self.fig.tight_layout()
+
+    def start_live_plot(self, cell_types):
+        """Sets up the graph canvas to plot population counts as they arrive
+        from a running simulation.
+
+        Parameters
+        ----------
+        cell_types : list
+            a list of the cell type classes that are present in the simulation
+        """
+        self.clear()
+
+        self.live_iterations = []
+        self.live_population_data = {}
+        self.live_lines = {}
+        for cell_type in cell_types:
+            cell_type_name = cell_type.__name__
+            self.live_population_data[cell_type_name] = []
+            self.live_lines[cell_type_name], = self.axes.plot(
+                [], [], color=CELL_COLOURS[cell_type_name]["Normal"], label=cell_type_name)
+
+        self.axes.set_axis_on()
+        self.axes.set_xlabel("Iteration")
+        self.axes.set_ylabel("Alive cell population")
+        self.axes.set_title("Cell population over time")
+        self.axes.grid()
+
+        if len(cell_types) > 1:
+            self.axes.legend()
+
+        self.fig.tight_layout()
+
+    def add_population_counts(self, iteration, population_counts):
+        """Adds the population counts of a newly simulated iteration to the live plot.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration the counts are from
+        population_counts : dict
+            a dictionary relating each cell type name to its alive population
+        """
+        self.live_iterations.append(iteration)
+        for cell_type, count in population_counts.items():
+            self.live_population_data[cell_type].append(count)
+            self.live_lines[cell_type].set_data(
+                self.live_iterations, self.live_population_data[cell_type])
+
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.draw_idle()
+
     def clear(self):
         """Clears the graph canvas."""
         self.axes.cla()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tracks the memory used by simulations.
+
+A MemoryTracker passed to the Simulation records, after every iteration, the
+process's resident set size (RSS) and how many bytes are held by:
+- the cell list (the cell objects, their attribute dictionaries and arrays)
+- the DataWriter buffer (the formatted data string that grows every iteration)
+- any data sources registered with track_data_source, e.g. the GUI's live
+  IterationRingBuffer or a Trajectory
+and, when it traces allocations with tracemalloc, the total traced memory and
+the peak memory allocated above the start of each iteration stage, e.g. the
+temporary pair matrix and force dictionaries of the physics stage. Every
+SNAPSHOT_INTERVAL iterations a tracemalloc snapshot is compared with the last
+one to find the source lines whose allocations grew the most.
+
+The per-iteration report can be written as CSV, and as JSON with a peak
+summary, which estimates the bytes held per cell and per saved cell row, to
+choose population caps and how often to flush the data. Tracing allocations
+slows the simulation down considerably, so it can be turned off to only
+sample the RSS and structure sizes.
+
+In the GUI, memory tracking is enabled by setting the CELL_ABM_MEMORY environment
+variable to the prefix of the report files, e.g. CELL_ABM_MEMORY=memory writes
+memory.csv and memory.json when the simulation finishes.
+
+The memory held by the readers of a saved simulation can be measured with:
+
+Usage: python memory.py sim_data.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tracemalloc
+
+from data import DataReader, Trajectory
+from profiling import NULL_TIMER
+
+# Setting this environment variable to a file prefix enables memory tracking in the GUI
+MEMORY_ENV_VAR = "CELL_ABM_MEMORY"
+
+def get_rss_bytes():
+    """Gets the current resident set size of the process from /proc, or None if it is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def get_peak_rss_bytes():
+    """Gets the peak resident set size of the process from /proc, or None if it is unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def get_object_bytes(obj):
+    """Gets the bytes held by an object, its attribute dictionary and the attribute values.
+
+    Numpy arrays that own their data include it in their size. Objects shared
+    between several cells, e.g. interned strings, are counted for each of them.
+    """
+    num_bytes = sys.getsizeof(obj)
+    attributes = getattr(obj, "__dict__", None)
+    if attributes is not None:
+        num_bytes += sys.getsizeof(attributes)
+        num_bytes += sum(sys.getsizeof(value) for value in attributes.values())
+    return num_bytes
+
+def get_cells_bytes(cells):
+    """Gets the bytes held by a list of cells and the cell objects in it."""
+    return sys.getsizeof(cells) + sum(get_object_bytes(cell) for cell in cells)
+
+def get_iteration_arrays_bytes(iteration_arrays):
+    """Gets the bytes held by the cell data arrays of an iteration."""
+    num_bytes = sys.getsizeof(iteration_arrays)
+    for array in iteration_arrays.values():
+        num_bytes += getattr(array, "nbytes", None) or sys.getsizeof(array)
+    return num_bytes
+
+def get_data_source_bytes(data_source):
+    """Gets the bytes held by the cell data of a DataReader, IterationRingBuffer or Trajectory.
+
+    Parameters
+    ----------
+    data_source : DataReader / IterationRingBuffer / Trajectory
+        the object holding the cell data of the iterations
+
+    Returns
+    -------
+    int
+        the bytes held by the iterations' cell data, or 0 if none is held
+    """
+    if isinstance(data_source, Trajectory):
+        num_bytes = 0
+        iterations = data_source.iterations
+        if iterations is not None:
+            num_bytes += sys.getsizeof(iterations) + sum(
+                get_iteration_arrays_bytes(iteration_arrays) for iteration_arrays in iterations.values())
+        if data_source.data_source is not None:
+            num_bytes += get_data_source_bytes(data_source.data_source)
+        return num_bytes
+
+    if isinstance(data_source, DataReader):
+        num_bytes = sys.getsizeof(data_source.data)
+        for cell_dicts in data_source.data.values():
+            num_bytes += sys.getsizeof(cell_dicts)
+            for cell_dict in cell_dicts:
+                num_bytes += sys.getsizeof(cell_dict) + sys.getsizeof(cell_dict["pos"])
+        return num_bytes
+
+    iterations = getattr(data_source, "iterations", None)
+    if iterations is None:
+        return 0
+    with data_source.lock:
+        iterations = list(iterations)
+    return sys.getsizeof(iterations) + sum(
+        get_iteration_arrays_bytes(iteration_arrays) for _, iteration_arrays in iterations)
+
+
+class NullMemoryTracker:
+    # Whether the tracker records anything
+    enabled = False
+
+    def measure(self, stage_name):
+        """Returns a context manager that does nothing, in place of measuring a stage."""
+        return NULL_TIMER
+
+    def record_iteration(self, sim):
+        """Does nothing, in place of recording an iteration's memory."""
+        pass
+
+
+NULL_MEMORY_TRACKER = NullMemoryTracker()
+
+
+class MemoryStage:
+    __slots__ = ("tracker", "stage_name", "start_bytes")
+
+    def __init__(self, tracker, stage_name):
+        """Constructs the necessary attributes for the MemoryStage object.
+
+        The stage is a context manager that records the peak traced memory
+        allocated above the memory in use when the code inside it started.
+
+        Parameters
+        ----------
+        tracker : MemoryTracker
+            the tracker to record the peak in
+        stage_name : string
+            the name of the iteration stage
+        """
+        self.tracker = tracker
+        self.stage_name = stage_name
+        self.start_bytes = 0
+
+    def __enter__(self):
+        """Resets the traced peak so it only covers the stage."""
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        """Records the stage's peak, letting any exception propagate."""
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        self.tracker.add_stage_peak(self.stage_name, peak_bytes - self.start_bytes, peak_bytes)
+        return False
+
+
+class MemoryTracker:
+    # Iterations between the tracemalloc snapshots compared to find growing allocations
+    SNAPSHOT_INTERVAL = 10
+    # Number of growing source lines kept from each snapshot comparison
+    TOP_GROWTH_SITES = 10
+
+    enabled = True
+
+    def __init__(self, trace_allocations=True):
+        """Constructs the necessary attributes for the MemoryTracker object.
+
+        Parameters
+        ----------
+        trace_allocations : bool
+            whether to trace allocations with tracemalloc, which is needed for
+            the traced totals, stage peaks and growth sites
+
+        Other defined attributes
+        ------------------------
+        records : list
+            a dictionary for each recorded iteration relating "iteration",
+            "cells", "rss_bytes", "cells_bytes", "data_writer_bytes", the bytes
+            of each tracked data source ("<name>_bytes") and, when tracing,
+            "traced_bytes", "traced_peak_bytes" and the peak bytes of each stage
+            ("<stage>_peak_bytes") to their values
+        growth_sites : list
+            the iteration, source line and bytes grown since the last snapshot of
+            the source lines whose allocations grew the most
+        data_sources : dict
+            a dictionary relating the names of tracked data sources to them
+        stage_peaks : dict
+            the peak bytes of each stage in the current iteration
+        traced_peak_bytes : int
+            the peak traced memory in the current iteration
+        last_snapshot : tracemalloc.Snapshot
+            the snapshot taken at the last snapshot interval, or None
+        started_tracing : bool
+            whether the tracker started tracemalloc, so it should stop it
+        """
+        self.trace_allocations = trace_allocations
+        self.records = []
+        self.growth_sites = []
+        self.data_sources = {}
+        self.stage_peaks = {}
+        self.traced_peak_bytes = 0
+        self.last_snapshot = None
+        self.started_tracing = False
+
+    def start(self):
+        """Starts tracing allocations, if they are traced and are not already being traced."""
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        """Stops tracing allocations if the tracker started tracing them."""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.last_snapshot = None
+
+    def track_data_source(self, name, data_source):
+        """Adds a data source whose cell data is measured in each iteration's record.
+
+        Parameters
+        ----------
+        name : string
+            the name of the record column, without "_bytes"
+        data_source : DataReader / IterationRingBuffer / Trajectory
+            the object holding the cell data of the iterations
+        """
+        self.data_sources[name] = data_source
+
+    def measure(self, stage_name):
+        """Returns a context manager that records the peak memory allocated by an iteration stage.
+
+        Parameters
+        ----------
+        stage_name : string
+            the name of the stage, e.g. one of Simulation.ITERATION_STAGES
+        """
+        if not tracemalloc.is_tracing():
+            return NULL_TIMER
+        return MemoryStage(self, stage_name)
+
+    def add_stage_peak(self, stage_name, stage_peak_bytes, peak_bytes):
+        """Records the peak memory of a stage in the current iteration.
+
+        Parameters
+        ----------
+        stage_name : string
+            the name of the stage
+        stage_peak_bytes : int
+            the peak bytes allocated above the memory in use when the stage started
+        peak_bytes : int
+            the peak traced memory during the stage
+        """
+        self.stage_peaks[stage_name] = max(self.stage_peaks.get(stage_name, 0), stage_peak_bytes)
+        self.traced_peak_bytes = max(self.traced_peak_bytes, peak_bytes)
+
+    def record_iteration(self, sim):
+        """Records the memory in use at the end of a simulation iteration.
+
+        Parameters
+        ----------
+        sim : Simulation
+            the simulation, whose current iteration has just been saved
+        """
+        record = {"iteration": sim.sim_iteration,
+                  "cells": len(sim.cells),
+                  "rss_bytes": get_rss_bytes(),
+                  "cells_bytes": get_cells_bytes(sim.cells),
+                  "data_writer_bytes": sys.getsizeof(sim.data_writer.data)}
+        for name, data_source in self.data_sources.items():
+            record[name + "_bytes"] = get_data_source_bytes(data_source)
+
+        if tracemalloc.is_tracing():
+            traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            record["traced_bytes"] = traced_bytes
+            record["traced_peak_bytes"] = max(self.traced_peak_bytes, peak_bytes)
+            for stage_name, stage_peak_bytes in self.stage_peaks.items():
+                record[stage_name + "_peak_bytes"] = stage_peak_bytes
+            tracemalloc.reset_peak()
+
+            if sim.sim_iteration % self.SNAPSHOT_INTERVAL == 0:
+                self.compare_snapshot(sim.sim_iteration)
+
+        self.records.append(record)
+        self.stage_peaks = {}
+        self.traced_peak_bytes = 0
+
+    def compare_snapshot(self, iteration):
+        """Takes a tracemalloc snapshot and records the source lines that grew the most since the last."""
+        # Leave out the tracker's own records and tracemalloc's allocations
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)))
+        if self.last_snapshot is not None:
+            differences = snapshot.compare_to(self.last_snapshot, "lineno")
+            for difference in differences[:self.TOP_GROWTH_SITES]:
+                if difference.size_diff <= 0:
+                    break
+                frame = difference.traceback[0]
+                self.growth_sites.append({"iteration": iteration,
+                                          "site": f"{frame.filename}:{frame.lineno}",
+                                          "size_diff_bytes": difference.size_diff,
+                                          "size_bytes": difference.size})
+        self.last_snapshot = snapshot
+
+    def get_columns(self):
+        """Gets the names of the columns in the iteration records, in the order they first appear."""
+        columns = {}
+        for record in self.records:
+            columns.update(dict.fromkeys(record))
+        return list(columns)
+
+    def get_peak_summary(self):
+        """Summarises the peak memory use over the recorded iterations.
+
+        Returns
+        -------
+        dict
+            the maximum of each bytes column and the iteration it was reached at,
+            the process's peak RSS, and the bytes per cell of the cell list and
+            per saved cell row of the DataWriter buffer at the last iteration
+        """
+        summary = {"iterations": len(self.records), "peak_rss_bytes": get_peak_rss_bytes(), "peaks": {}}
+        for column in self.get_columns():
+            if not column.endswith("_bytes"):
+                continue
+            values = [(record[column], record["iteration"]) for record in self.records
+                      if record.get(column) is not None]
+            if values:
+                value, iteration = max(values)
+                summary["peaks"][column] = {"bytes": value, "iteration": iteration}
+
+        if self.records:
+            last_record = self.records[-1]
+            saved_rows = sum(record["cells"] for record in self.records)
+            summary["cells_bytes_per_cell"] = last_record["cells_bytes"] / max(last_record["cells"], 1)
+            summary["data_writer_bytes_per_row"] = last_record["data_writer_bytes"] / max(saved_rows, 1)
+        return summary
+
+    def write_csv(self, csv_file):
+        """Writes the iteration records to a CSV file, with empty cells for values not recorded."""
+        with open(csv_file, "w", newline="") as f:
+            csvwriter = csv.DictWriter(f, fieldnames=self.get_columns(), restval="")
+            csvwriter.writeheader()
+            csvwriter.writerows(self.records)
+
+    def write_json(self, json_file):
+        """Writes the peak summary, iteration records and growth sites to a JSON file."""
+        with open(json_file, "w") as f:
+            json.dump({"summary": self.get_peak_summary(), "records": self.records,
+                       "growth_sites": self.growth_sites}, f, indent=1)
+
+    def export(self, prefix):
+        """Writes the iteration records as CSV, and with the peak summary as JSON.
+
+        Parameters
+        ----------
+        prefix : string
+            the file name prefix, which .csv and .json are added to
+
+        Returns
+        -------
+        list
+            the names of the written files
+        """
+        files = [prefix + ".csv", prefix + ".json"]
+        self.write_csv(files[0])
+        self.write_json(files[1])
+        return files
+
+def get_memory_tracker_from_env():
+    """Gets a started MemoryTracker if the MEMORY_ENV_VAR environment variable is set,
+    otherwise NULL_MEMORY_TRACKER.
+
+    Returns
+    -------
+    memory_tracker : MemoryTracker / NullMemoryTracker
+        the memory tracker to pass to the Simulation
+    prefix : string
+        the prefix of the report files, or None if memory tracking is disabled
+    """
+    prefix = os.environ.get(MEMORY_ENV_VAR)
+    if not prefix:
+        return NULL_MEMORY_TRACKER, None
+    memory_tracker = MemoryTracker()
+    memory_tracker.start()
+    return memory_tracker, prefix
+
+def measure_reader(read_data_source):
+    """Measures the memory used to read a saved simulation.
+
+    Parameters
+    ----------
+    read_data_source : function
+        a function that reads the cell data into a data source and returns it
+
+    Returns
+    -------
+    dict
+        the bytes held by the data source's cell data, and the traced memory
+        it holds and peaked at while it was read
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    try:
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        data_source = read_data_source()
+        traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        return {"structure_bytes": get_data_source_bytes(data_source),
+                "traced_bytes": traced_bytes - start_bytes,
+                "traced_peak_bytes": peak_bytes - start_bytes}
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+
+def read_with_data_reader(data_file):
+    """Reads a data file with a DataReader and returns the reader."""
+    data_reader = DataReader(data_file)
+    data_reader.read_data()
+    return data_reader
+
+def read_with_trajectory(data_file):
+    """Decodes a data file into a Trajectory and returns the trajectory."""
+    trajectory = Trajectory(data_file)
+    trajectory.read_data()
+    return trajectory
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the memory used by the readers of a saved simulation.")
+    parser.add_argument("input_file", help="simulation data file")
+    args = parser.parse_args()
+
+    print(f"{os.path.getsize(args.input_file) / 2**20:.1f} MiB data file")
+    for name, read_data_source in (("DataReader", read_with_data_reader),
+                                   ("Trajectory", read_with_trajectory)):
+        result = measure_reader(lambda: read_data_source(args.input_file))
+        print(f"{name:<10} {result['structure_bytes'] / 2**20:8.1f} MiB of cell data, "
+              f"{result['traced_bytes'] / 2**20:8.1f} MiB held, "
+              f"{result['traced_peak_bytes'] / 2**20:8.1f} MiB peak while reading")
+
+
+if __name__ == "__main__":
+    main()
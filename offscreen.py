@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Renders videos of saved simulations without a display.
+
+The frames are drawn in an offscreen OpenGL context, created with EGL, or with
+OSMesa if PYOPENGL_PLATFORM is set to "osmesa", so this works on display-less
+servers using Mesa's software rasteriser. Each call creates its own context,
+so videos of many runs can be rendered in parallel worker processes.
+
+Usage: python offscreen.py sim_data.csv video.mp4 --env-size 200 [--fps 10]
+"""
+
+import os
+
+# PyOpenGL chooses its platform when it is first imported, so this must come
+# before any OpenGL imports. Mesa's EGL renders without a display on the
+# surfaceless platform.
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import argparse
+import ctypes
+
+from OpenGL.GL import *
+
+from data import Trajectory
+from render_data import RenderArrayCache, get_empty_render_arrays
+from scene import Scene
+
+class OffscreenContext:
+    def __init__(self, width, height):
+        """Constructs the necessary attributes for the OffscreenContext object.
+
+        Creates an OpenGL context that renders into an offscreen buffer of the
+        given size, and makes it current in the calling thread.
+
+        Parameters
+        ----------
+        width : int
+            the width in pixels of the offscreen buffer
+        height : int
+            the height in pixels of the offscreen buffer
+
+        Other defined attributes
+        ------------------------
+        platform : string
+            the PyOpenGL platform the context was created with, "egl" or "osmesa"
+        """
+        self.width = width
+        self.height = height
+        self.platform = os.environ["PYOPENGL_PLATFORM"]
+
+        if self.platform == "osmesa":
+            self.create_osmesa_context()
+        elif self.platform == "egl":
+            self.create_egl_context()
+        else:
+            raise RuntimeError(
+                f"Offscreen rendering needs PYOPENGL_PLATFORM to be egl or osmesa, not {self.platform}")
+
+        glViewport(0, 0, width, height)
+
+    def create_egl_context(self):
+        """Creates an EGL context rendering into a pixel buffer surface."""
+        from OpenGL import EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("Could not initialise an EGL display")
+
+        config_attributes = [
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE
+        ]
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, (EGL.EGLint * len(config_attributes))(*config_attributes),
+                            ctypes.pointer(config), 1, ctypes.pointer(num_configs))
+        if num_configs.value == 0:
+            raise RuntimeError("No EGL configuration supports offscreen OpenGL rendering")
+
+        surface_attributes = [EGL.EGL_WIDTH, self.width, EGL.EGL_HEIGHT, self.height, EGL.EGL_NONE]
+        self.surface = EGL.eglCreatePbufferSurface(
+            self.display, config, (EGL.EGLint * len(surface_attributes))(*surface_attributes))
+
+        # The scene uses desktop OpenGL, not OpenGL ES
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context):
+            raise RuntimeError("Could not make the EGL context current")
+
+    def create_osmesa_context(self):
+        """Creates an OSMesa context rendering into a buffer in main memory."""
+        from OpenGL import arrays, osmesa
+
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        if not self.context:
+            raise RuntimeError("Could not create an OSMesa context")
+
+        self.buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE,
+                                        self.width, self.height):
+            raise RuntimeError("Could not make the OSMesa context current")
+
+    def release(self):
+        """Destroys the context and its offscreen buffer."""
+        if self.platform == "osmesa":
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
+        else:
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroySurface(self.display, self.surface)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+
+def render_video(input_file, env_size, file_path, frame_rate=10, width=800, height=800,
+                 max_iteration=None, progress_callback=None, use_impostors=False,
+                 cull_hidden_cells=False, clip_depth=None):
+    """Renders a video of a saved simulation in an offscreen OpenGL context.
+
+    Parameters
+    ----------
+    input_file : string
+        the name of the data file of the simulation to render
+    env_size : float
+        the width of the simulation environment
+    file_path : string
+        name of the file location to save the video in
+    frame_rate : int
+        the frame rate to save the video with
+    width : int
+        the width in pixels of the video
+    height : int
+        the height in pixels of the video
+    max_iteration : int
+        the last iteration to render, the last iteration in the data file if not given
+    progress_callback : function
+        optional function called with the number of frames drawn and the total
+        number of frames, which can return False to cancel the export
+    use_impostors : bool
+        whether cells covering only a few pixels are drawn as point sprite impostors
+    cull_hidden_cells : bool
+        whether cells hidden behind densely packed cells are left out of the drawing
+    clip_depth : float
+        the depth into the environment of a cross-section plane, in front of which
+        cells are not drawn
+
+    Returns
+    -------
+    stats : dict
+        the export statistics returned by VideoExportPipeline.run
+    """
+    from video_export import VideoExportPipeline
+
+    trajectory = Trajectory(input_file)
+    if max_iteration is None:
+        iteration_range = trajectory.get_iteration_range()
+        max_iteration = iteration_range[1] if iteration_range is not None else 0
+    render_cache = RenderArrayCache(trajectory)
+
+    def get_render_arrays(iteration):
+        render_arrays = render_cache.get_iteration(iteration)
+        return render_arrays if render_arrays is not None else get_empty_render_arrays()
+
+    context = OffscreenContext(width, height)
+    scene = Scene(env_size)
+    scene.cull_hidden_cells = cull_hidden_cells
+    scene.clip_depth = clip_depth
+    try:
+        scene.initialise_gl()
+        scene.sphere_renderer.use_impostors = use_impostors
+        scene.resize(width, height)
+        pipeline = VideoExportPipeline(file_path, frame_rate, width, height)
+        return pipeline.run(range(max_iteration + 1), get_render_arrays, scene.draw,
+                            progress_callback)
+    finally:
+        scene.release_gl()
+        context.release()
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a video of a saved simulation without a display.")
+    parser.add_argument("input_file", help="simulation data file")
+    parser.add_argument("output_file", help="video file to write")
+    parser.add_argument("--env-size", type=float, required=True,
+                        help="width of the simulation environment")
+    parser.add_argument("--fps", type=int, default=10, help="frame rate of the video")
+    parser.add_argument("--width", type=int, default=800, help="width of the video in pixels")
+    parser.add_argument("--height", type=int, default=800, help="height of the video in pixels")
+    parser.add_argument("--max-iteration", type=int, default=None,
+                        help="last iteration to render (default: the last in the file)")
+    parser.add_argument("--impostors", action="store_true",
+                        help="draw cells covering only a few pixels as point sprite impostors")
+    parser.add_argument("--cull", action="store_true",
+                        help="skip drawing cells hidden inside dense clusters")
+    parser.add_argument("--clip-depth", type=float, default=None,
+                        help="depth into the environment of a cross-section plane")
+    args = parser.parse_args()
+
+    stats = render_video(args.input_file, args.env_size, args.output_file, args.fps,
+                         args.width, args.height, args.max_iteration,
+                         use_impostors=args.impostors, cull_hidden_cells=args.cull,
+                         clip_depth=args.clip_depth)
+    print(f"Exported {stats['frames']} frames in {stats['seconds']:.2f}s "
+          f"({stats['fps']:.1f} frames per second)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,45 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+import os
+
 import numpy as np
 
+from profiling import NULL_PROFILER
+from spatial import NeighbourList, SpatialGrid, find_close_pairs
 import utils
 
+# Names of the solvers that create_physical_model can create
+PHYSICS_SOLVERS = ("auto", "base", "locals", "active_set", "clusters")
+# Distance between the surfaces of two cells within which they are held in a
+# cluster solve's neighbour list
+NEIGHBOUR_LIST_SKIN = 1.0
+# Largest step size, as a multiple of the search direction, of a conjugate gradient pass
+CG_MAX_STEP_SIZE = 1.0
+# Largest distance a cell can move in a conjugate gradient pass, as a multiple of
+# the distance the explicit force step (FORCE_MULTIPLIER times its forces) would move it
+CG_MAX_CELL_STEP_SCALE = 2.0
+# Number of times a conjugate gradient step can be halved before the solve is stabilised
+CG_MAX_BACKTRACKS = 20
+# Fraction of the decrease in energy predicted by the gradient that a step must achieve
+CG_SUFFICIENT_DECREASE = 1e-4
+# Relative decrease in energy below which the conjugate gradient solve is stabilised
+CG_ENERGY_TOLERANCE = 1e-6
+# Maximum number of merge rounds when the clusters are relaxed with conjugate gradient,
+# and the factor the cluster contact margin grows by each round, as a fully relaxed
+# cluster expands further into the cells around it than the explicit steps push it
+CG_MAX_MERGE_ROUNDS = 10
+CG_MERGE_MARGIN_GROWTH = 2.0
+
+
 class PhysicalModel:
+    # Reasons that a solve can stop, recorded in its telemetry
+    EXIT_NO_OVERLAP = "no_overlap"
+    EXIT_STABILISED = "stabilised"
+    EXIT_MAX_ITERATIONS = "max_iterations"
+    EXIT_CANCELLED = "cancelled"
+
     MAX_ITERATIONS = 100
     FORCE_MULTIPLIER = 0.125
     TARGET_SEPARATION = 0.125
@@ -20,12 +55,43 @@ class PhysicalModel:
         ----------
         env_size : float
             the width of the environment
+
+        Other defined attributes
+        ------------------------
+        cancel_event : threading.Event
+            an optional event that stops the solver early when it is set
+        solve_passes : int
+            the number of times the overlap was computed while solving in the
+            last call to solve_overlap
+        pair_checks : int
+            the number of cell pairs checked for overlap in the last call to
+            solve_overlap, including the contact inhibition check
+        profiler : Profiler / NullProfiler
+            the profiler that each solver pass is timed in
+        last_solve : dict
+            the telemetry of the last call to solve_overlap, as returned by
+            get_solve_telemetry, or None before the first solve
+        measure_final_overlap : bool
+            whether a solve stopped at MAX_ITERATIONS makes an extra pass to
+            measure the overlap left after its last forces were applied, which
+            is not counted in its passes or pair checks; otherwise the overlap
+            of its last pass is reported
         """
         self.env_size = env_size
+        self.cancel_event = None
+        self.solve_passes = 0
+        self.pair_checks = 0
+        self.profiler = NULL_PROFILER
+        self.last_solve = None
+        self.measure_final_overlap = False
 
     
     def solve_overlap(self, sim_iteration, cells):
         """Minimises the cell overlap between the given cells.
+
+        The solve stops when there is no overlap, when the overlap has stabilised,
+        after MAX_ITERATIONS passes or when the simulation is cancelled, and its
+        telemetry is saved in last_solve.
         
         Parameters
         ----------
@@ -37,38 +103,135 @@ class PhysicalModel:
         solve_iteration = 0
         previous_overlap = self.MIN_STABLE_OVERLAP_DIFF + 1
         current_overlap = 0
+        initial_overlap = None
+        exit_reason = self.EXIT_MAX_ITERATIONS
+        self.solve_passes = 0
+        self.pair_checks = 0
+        self.start_solve(cells)
 
         # Attempt to solve the overlap within MAX_ITERATIONS
         while solve_iteration < self.MAX_ITERATIONS:
 
+            # Stop solving if the simulation has been cancelled
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                self.last_solve = self.get_solve_telemetry(self.EXIT_CANCELLED, initial_overlap, None)
+                return
+
             previous_overlap = current_overlap
             
-            # Get the total overlap and the forces to apply to each cell
-            current_overlap, cell_forces_dict = self.get_total_overlap_and_forces(cells)
+            with self.profiler.measure("solve_pass"):
+                # Get the total overlap and the forces to apply to each cell
+                current_overlap, cell_forces_dict = self.get_pass_overlap_and_forces(cells)
+                self.solve_passes += 1
+                if initial_overlap is None:
+                    initial_overlap = current_overlap
 
-            # Stop solver if there is no overlap or it has stabilised
-            if not current_overlap or self.overlap_stabilised(previous_overlap, current_overlap):
-                break
-            else:
-                # Apply the sum of each cell's forces to their positions
-                for i, force_list in cell_forces_dict.items():
-                    sum_forces = np.sum(force_list, axis=0)
-                    cells[i].cell_body.apply_vel(self.FORCE_MULTIPLIER * sum_forces)
+                # Stop solver if there is no overlap or it has stabilised
+                if not current_overlap:
+                    exit_reason = self.EXIT_NO_OVERLAP
+                    break
+                elif self.overlap_stabilised(previous_overlap, current_overlap):
+                    exit_reason = self.EXIT_STABILISED
+                    break
+                else:
+                    self.apply_forces(cells, cell_forces_dict)
 
             solve_iteration += 1
 
+        final_overlap = current_overlap
+        if self.measure_final_overlap and exit_reason == self.EXIT_MAX_ITERATIONS and self.solve_passes > 0:
+            # The cells have been moved by the forces of the last pass since its overlap was computed
+            solver_pair_checks = self.pair_checks
+            with self.profiler.measure("final_overlap_pass"):
+                final_overlap, _ = self.get_pass_overlap_and_forces(cells)
+            self.pair_checks = solver_pair_checks
+
+        with self.profiler.measure("contact_inhibition_pass"):
+            self.update_contact_inhibition(cells)
+
+        self.profiler.count("solve_passes", self.solve_passes)
+        self.profiler.count("pair_checks", self.pair_checks)
+        self.last_solve = self.get_solve_telemetry(exit_reason, initial_overlap, final_overlap)
+
+    def start_solve(self, cells):
+        """Prepares for a solve before its first pass, which the base model does not need to do."""
+        pass
+
+    def close(self):
+        """Releases the resources held by the model, which the base model does not have."""
+        pass
+
+    def get_pass_overlap_and_forces(self, cells):
+        """Gets the overlap and forces of a solver pass, which are those of every cell pair.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+
+        Returns
+        -------
+        total_overlap : float
+            the sum of the overlap between the cell pairs checked in the pass
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        return self.get_total_overlap_and_forces(cells)
+
+    def apply_forces(self, cells, cell_forces_dict):
+        """Applies the sum of each cell's forces to their positions.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        for i, force_list in cell_forces_dict.items():
+            sum_forces = np.sum(force_list, axis=0)
+            cells[i].cell_body.apply_vel(self.FORCE_MULTIPLIER * sum_forces)
+
+    def update_contact_inhibition(self, cells):
+        """Sets whether each cell is contact inhibited after a solve.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
         # Get the cell forces that apply to the cells within the contact inhibition radius
         total_overlap, cell_forces_dict = self.get_total_overlap_and_forces(
             cells, extra_overlap_radius=self.CONTACT_INHIBITION_RADIUS)
-        
+
         # Set whether the cells are contact inhibited or not
         self.set_contact_inhibited_flags(cells, cell_forces_dict)
 
-        # ================= Uncomment to track overlap =====================
-        #total_overlap, _ = self.get_total_overlap_and_forces(cells)
-        #if total_overlap > 0:
-        #    print("Iteration:", sim_iteration, "  Overlap:", total_overlap)
-        # ==================================================================
+    def get_solve_telemetry(self, exit_reason, initial_overlap, final_overlap):
+        """Gets the telemetry of the current solve.
+
+        Parameters
+        ----------
+        exit_reason : string
+            why the solve stopped, one of the EXIT constants
+        initial_overlap : float
+            the total overlap before the solve, or None if no pass was made
+        final_overlap : float
+            the total overlap after the solve, or None if it was cancelled
+
+        Returns
+        -------
+        dict
+            the "passes", "exit_reason", "initial_overlap", "final_overlap"
+            and "pair_checks" of the solve
+        """
+        return {"passes": self.solve_passes,
+                "exit_reason": exit_reason,
+                "initial_overlap": float(initial_overlap) if initial_overlap is not None else None,
+                "final_overlap": float(final_overlap) if final_overlap is not None else None,
+                "pair_checks": self.pair_checks}
 
     def overlap_stabilised(self, previous_overlap, current_overlap):
         """Returns whether the current overlap has stabilised.
@@ -160,6 +323,10 @@ class PhysicalModel:
         """
         total_overlap = 0.0
         cell_forces_dict = {}
+
+        # Every pair of live cells is checked
+        num_live_cells = sum(not cell.is_dead for cell in cells)
+        self.pair_checks += num_live_cells * (num_live_cells - 1) // 2
         
         for i in range(len(cells) - 1):
             if not cells[i].is_dead:
@@ -194,7 +361,7 @@ class PhysicalModel:
         
         return total_overlap, cell_forces_dict
     
-    def set_contact_inhibited_flags(self, cells, cell_forces_dict):
+    def set_contact_inhibited_flags(self, cells, cell_forces_dict, cell_indices=None):
         """Sets the contact inhibited flags for all cells in the simulation.
         
         The number of contacts a cell has is given by the number of environment
@@ -209,8 +376,14 @@ class PhysicalModel:
         cell_forces_dict : dict
             the dictionary relating cell ids to the list of forces being applied
             to them
+        cell_indices : iterable
+            optional indices of the only cells to set the flags of, whose forces
+            must all be in cell_forces_dict
         """
-        for i in range(len(cells)):
+        if cell_indices is None:
+            cell_indices = range(len(cells))
+
+        for i in cell_indices:
             cell_body = cells[i].cell_body
             if i in cell_forces_dict:
                 contacts = len(cell_forces_dict[i]) + cell_body.get_num_border_contacts() 
@@ -317,16 +490,19 @@ class PhysicalModelWithLocals(PhysicalModel):
             a dictionary relating the cell ids to a list of the forces
             that are exerted on them
         """
-        local_envs = self.add_cells_to_local_environments(cells)
+        with self.profiler.measure("neighbour_search"):
+            local_envs = self.add_cells_to_local_environments(cells)
 
         total_overlap = 0
         cell_forces_dict = {}
+        pair_checks = 0
         
         # Used so that cell pairs that fall into multiple positions of the marching
         # window are not checked more than once
-        cell_pairs_checked_matrix = np.array(
-            [[False for _ in range(len(cells))] for _ in range(len(cells))]
-        )
+        with self.profiler.measure("pair_matrix"):
+            cell_pairs_checked_matrix = np.array(
+                [[False for _ in range(len(cells))] for _ in range(len(cells))]
+            )
         
         for i in range(self.num_window_positions):
             # Collect cells within current window
@@ -376,6 +552,1385 @@ class PhysicalModelWithLocals(PhysicalModel):
                                 # Track that the cell pair has been checked
                                 cell_pairs_checked_matrix[cell_j_id, cell_k_id] = True
                                 cell_pairs_checked_matrix[cell_k_id, cell_j_id] = True
+                                pair_checks += 1
         
+        self.pair_checks += pair_checks
+        return total_overlap, cell_forces_dict
+    
+
+
+class PhysicalModelWithActiveSet(PhysicalModel):
+
+    def __init__(self, env_size, max_cell_radius):
+        """Constructs the necessary attributes for the PhysicalModelWithActiveSet object.
+
+        This class extends the PhysicalModel to only revisit the regions of the
+        environment that have been disturbed since the last solve. Each solve
+        starts from an active set of the cells that have been seeded, moved or
+        grown since then, e.g. by mitosis, migration or growth, and the live
+        neighbours of cells that have died. Each pass only checks the pairs
+        involving an active cell, found using a SpatialGrid, and the cells moved
+        by the pass become the active set of the next, so the set grows as the
+        forces push into neighbouring cells and shrinks as regions settle. The
+        overlap that the stop criteria are applied to is the overlap of the
+        pairs checked in the pass. Contact inhibition is only updated for cells
+        within reach of a disturbed cell, as no other cell's contacts can have
+        changed, so the cost of a solve scales with the disturbance rather than
+        the population, apart from one vectorised scan for changes.
+
+        Parameters
+        ----------
+        env_size : float
+            the width of the environment
+        max_cell_radius: float
+            the maximum radius that a cell in the simulation can have
+
+        Other defined attributes
+        ------------------------
+        grid : SpatialGrid
+            the spatial index of the live cells, kept between solves, or None
+            before the first solve
+        positions : numpy.ndarray(N, 3)
+            the position of each cell at the end of the last solve, kept up to
+            date as the cells are moved during a solve
+        radii : numpy.ndarray(N)
+            the radius of each cell at the start of the last solve
+        dead : numpy.ndarray(N)
+            whether each cell was dead at the start of the last solve
+        max_radius : float
+            the largest cell radius in the current solve
+        active_cells : set
+            the indices of the cells whose pairs are checked in the next pass
+        disturbed_cells : dict
+            a dictionary relating the index of each cell that has changed in the
+            current solve to its position at the end of the last solve
+        """
+        super().__init__(env_size)
+        self.max_cell_radius = max_cell_radius
+        self.grid = None
+        self.positions = np.empty((0, 3))
+        self.radii = np.empty(0)
+        self.dead = np.empty(0, dtype=bool)
+        self.max_radius = max_cell_radius
+        self.active_cells = set()
+        self.disturbed_cells = {}
+
+    def get_bucket_size(self, max_radius):
+        """Gets the width of the grid buckets, the furthest apart two cells can be in contact."""
+        return 2 * max_radius + self.CONTACT_INHIBITION_RADIUS
+
+    def start_solve(self, cells):
+        """Finds the cells that have changed since the last solve to start the active set from,
+        and updates the grid with them.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
+        with self.profiler.measure("active_set"):
+            num_cells = len(cells)
+            positions = np.array([cell.cell_body.pos for cell in cells], dtype=np.float64).reshape(-1, 3)
+            radii = np.fromiter((cell.cell_body.radius for cell in cells), dtype=np.float64, count=num_cells)
+            dead = np.fromiter((cell.is_dead for cell in cells), dtype=bool, count=num_cells)
+            self.max_radius = max(self.max_cell_radius, radii.max(initial=0.0))
+
+            num_old_cells = len(self.positions)
+            if self.grid is None or num_cells < num_old_cells:
+                # Every cell is disturbed in the first solve
+                changed = np.ones(num_cells, dtype=bool)
+                newly_dead = np.flatnonzero(dead)
+                old_positions = positions.copy()
+            else:
+                changed = np.ones(num_cells, dtype=bool)
+                changed[:num_old_cells] = (np.any(positions[:num_old_cells] != self.positions, axis=1)
+                                           | (radii[:num_old_cells] != self.radii))
+                newly_dead = np.flatnonzero(dead[:num_old_cells] & ~self.dead)
+                old_positions = np.concatenate((self.positions, positions[num_old_cells:]))
+
+            live_changed = np.flatnonzero(changed & ~dead)
+            bucket_size = self.get_bucket_size(self.max_radius)
+            if self.grid is None or self.grid.bucket_size < bucket_size or num_cells < num_old_cells:
+                self.grid = SpatialGrid.from_positions(bucket_size, positions, np.flatnonzero(~dead))
+            else:
+                for i in newly_dead.tolist():
+                    self.grid.remove(i)
+                for i in live_changed.tolist():
+                    self.grid.insert(i, positions[i])
+
+            self.positions = positions
+            self.radii = radii
+            self.dead = dead
+            self.active_cells = set(live_changed.tolist())
+            self.disturbed_cells = {i: old_positions[i] for i in live_changed.tolist()}
+
+            # Wake the live neighbours of cells that have died, which may now be able to relax
+            for i in newly_dead.tolist():
+                self.disturbed_cells[i] = old_positions[i]
+                self.active_cells.update(self.grid.query(positions[i], radii[i] + self.max_radius))
+
+        self.profiler.count("active_cells", len(self.active_cells))
+
+    def get_pass_overlap_and_forces(self, cells):
+        """Overrides the PhysicalModel behaviour to only get the overlap and forces
+        of the pairs involving the active cells.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+
+        Returns
+        -------
+        total_overlap : float
+            the sum of the overlap between the cell pairs involving an active cell
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        return self.get_active_overlap_and_forces(cells, self.active_cells)
+
+    def apply_forces(self, cells, cell_forces_dict):
+        """Overrides the PhysicalModel behaviour to also move the cells in the grid,
+        and make the cells that moved the next active set.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        super().apply_forces(cells, cell_forces_dict)
+
+        moved_cells = set()
+        for i in cell_forces_dict:
+            pos = cells[i].cell_body.pos
+            if np.any(pos != self.positions[i]):
+                if i not in self.disturbed_cells:
+                    self.disturbed_cells[i] = self.positions[i].copy()
+                self.positions[i] = pos
+                self.grid.insert(i, pos)
+                moved_cells.add(i)
+        self.active_cells = moved_cells
+
+    def update_contact_inhibition(self, cells):
+        """Overrides the PhysicalModel behaviour to only set whether the cells
+        within reach of a disturbed cell are contact inhibited.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
+        contact_distance = 2 * self.max_radius + self.CONTACT_INHIBITION_RADIUS
+        contact_cells = set()
+        for i, old_pos in self.disturbed_cells.items():
+            # Reach the cells in contact with the cell where it was before it moved
+            pos = self.positions[i]
+            distance = contact_distance + np.linalg.norm(pos - old_pos)
+            contact_cells.update(self.grid.query(pos, distance))
+            contact_cells.add(i)
+
+        live_contact_cells = {i for i in contact_cells if not self.dead[i]}
+        _, cell_forces_dict = self.get_active_overlap_and_forces(
+            cells, live_contact_cells, extra_overlap_radius=self.CONTACT_INHIBITION_RADIUS)
+        self.set_contact_inhibited_flags(cells, cell_forces_dict, sorted(contact_cells))
+        self.disturbed_cells = {}
+
+    def get_active_overlap_and_forces(self, cells, active_cells, extra_overlap_radius=0,
+                                      grid=None, max_radius=None):
+        """Gets the total overlap between the pairs of cells involving an active cell,
+        and gets the forces exerted on the cells by them.
+
+        Every force on an active cell is found, but the other cells only get the
+        forces from the active cells.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        active_cells : set
+            the indices of the live cells whose pairs are checked
+        extra_overlap_radius : float = 0
+            optional extra distance between cells where they can be considered
+            overlapping
+        grid : SpatialGrid
+            the grid of the live cells, the model's grid if not given
+        max_radius : float
+            the largest cell radius, the current solve's if not given
+
+        Returns
+        -------
+        total_overlap : float
+            the sum of the overlap between the checked cell pairs
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        if grid is None:
+            grid = self.grid
+        if max_radius is None:
+            max_radius = self.max_radius
+
+        total_overlap = 0.0
+        cell_forces_dict = {}
+        pair_checks = 0
+
+        for i in active_cells:
+            cell_i_body = cells[i].cell_body
+            cell_i_pos = cell_i_body.pos
+            cell_i_radius = cell_i_body.radius
+
+            for j in grid.query(cell_i_pos, cell_i_radius + max_radius + extra_overlap_radius):
+                # Pairs of active cells are only checked from the cell with the lower index
+                if j == i or (j < i and j in active_cells):
+                    continue
+
+                cell_j_body = cells[j].cell_body
+                pair_checks += 1
+
+                # Get overlap between cells i and j and force that j exerts on i
+                overlap, force = self.get_overlap_and_force(
+                    cell_i_pos, cell_i_radius,
+                    cell_j_body.pos, cell_j_body.radius, extra_overlap_radius)
+
+                if overlap > 0:
+                    total_overlap += overlap
+
+                    # Add force that cell j exerts on cell i to cell i's force list
+                    if i in cell_forces_dict:
+                        cell_forces_dict[i].append(force)
+                    else:
+                        cell_forces_dict[i] = [force]
+
+                    # Add equal and opposite force that cell i exerts on cell j
+                    # to cell j's force list
+                    if j in cell_forces_dict:
+                        cell_forces_dict[j].append(-force)
+                    else:
+                        cell_forces_dict[j] = [-force]
+
+        self.pair_checks += pair_checks
         return total_overlap, cell_forces_dict
-    
\ No newline at end of file
+
+    def get_total_overlap_and_forces(self, cells, extra_overlap_radius=0):
+        """Overrides the PhysicalModel behaviour to get the total overlap between
+        all cell pairs using a new grid of the cells, and gets the forces
+        exerted on each cell.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        extra_overlap_radius : float = 0
+            optional extra distance between cells where they can be considered
+            overlapping
+
+        Returns
+        -------
+        total_overlap : float
+            the sum of all overlap between cell pairs in the simulation
+        cell_forces_dict : dict
+            a dictionary relating the cell ids to a list of the forces
+            that are exerted on them
+        """
+        live_cells = [i for i in range(len(cells)) if not cells[i].is_dead]
+        max_radius = max((cells[i].cell_body.radius for i in live_cells), default=0.0)
+        grid = SpatialGrid(self.get_bucket_size(max(max_radius, self.max_cell_radius)))
+        for i in live_cells:
+            grid.insert(i, cells[i].cell_body.pos)
+        return self.get_active_overlap_and_forces(
+            cells, set(live_cells), extra_overlap_radius, grid, max_radius)
+
+
+class PhysicalModelWithClusters(PhysicalModelWithActiveSet):
+    # Distance between the surfaces of two cells within which they are in the same cluster
+    CLUSTER_CONTACT_MARGIN = 0.5
+    # Clusters with at least this many cells are solved on the worker pool
+    PARALLEL_MIN_CELLS = 200
+    # Maximum number of times clusters pushed into each other are solved again together
+    MAX_MERGE_ROUNDS = 3
+    # Fraction of the live cells above which the warm neighbour pairs are all found again
+    WARM_START_REBUILD_FRACTION = 0.125
+
+    def __init__(self, env_size, max_cell_radius, workers=None, use_processes=False,
+                 relaxation="explicit", warm_start=True):
+        """Constructs the necessary attributes for the PhysicalModelWithClusters object.
+
+        This class extends the PhysicalModelWithActiveSet to split the disturbed
+        cells into clusters, the connected components of the graph of cells
+        whose surfaces are within CLUSTER_CONTACT_MARGIN of each other. Each
+        cluster is solved independently with its own stop criteria, so
+        separate colonies do not wait for the slowest one, and clusters of
+        PARALLEL_MIN_CELLS or more cells are solved in parallel on a thread or
+        process pool. Clusters without a disturbed cell have
+        already converged and are skipped entirely. If solved clusters are
+        pushed into each other, the cells they now overlap are solved again
+        together, up to MAX_MERGE_ROUNDS times (CG_MAX_MERGE_ROUNDS with
+        conjugate gradient, which also widens the contact margin of the
+        clusters by CG_MERGE_MARGIN_GROWTH each round).
+
+        The clusters are relaxed with the explicit force steps of the
+        PhysicalModel (solve_cluster_overlap), or by minimising a penalty energy
+        of the overlap with conjugate gradient (minimise_cluster_overlap_energy).
+        Conjugate gradient is experimental and not one of the PHYSICS_SOLVERS:
+        it reaches zero overlap in dense clusters, but it takes longer than the
+        explicit steps and leaves fewer cells in contact, so fewer are contact
+        inhibited.
+
+        With warm starts, the solves keep the neighbour pairs of the cells and
+        the displacement field of the last solve, alongside the grid kept by the
+        PhysicalModelWithActiveSet. Each cluster's solve reuses the pairs of its
+        cells rather than finding them again, and starts from the last
+        displacements if that lowers its overlap, and the final overlap and
+        contact inhibition are vectorised over the pairs. Only the state of
+        cells that have divided, died or migrated since the last solve is
+        dropped, along with the pairs of cells that have moved or grown too far
+        to be sure of them, which are found again from the grid.
+
+        Parameters
+        ----------
+        env_size : float
+            the width of the environment
+        max_cell_radius: float
+            the maximum radius that a cell in the simulation can have
+        workers : int
+            the number of workers in the pool, the number of available cores
+            if not given
+        use_processes : bool
+            whether to solve the large clusters on a process pool instead of a
+            thread pool, which avoids the interpreter lock but copies the
+            clusters' arrays between processes and cannot be cancelled part way
+        relaxation : string
+            how the clusters are relaxed, one of RELAXATION_MODES
+        warm_start : bool
+            whether to keep state between solves to start each solve from
+
+        Other defined attributes
+        ------------------------
+        max_merge_rounds : int
+            the maximum number of merge rounds for the relaxation mode
+        merge_margin_growth : float
+            the factor the contact margin of the clusters grows by each merge
+            round for the relaxation mode
+        executor : concurrent.futures.Executor
+            the worker pool, None until a large cluster is first solved
+        neighbour_pairs : tuple
+            the (i, j) index arrays of the pairs of live cells whose surfaces
+            were within NEIGHBOUR_LIST_SKIN + CONTACT_INHIBITION_RADIUS of each
+            other, or None before the first warm solve
+        neighbour_positions : numpy.ndarray(N, 3)
+            the position of each cell when its neighbour pairs were found
+        neighbour_radii : numpy.ndarray(N)
+            the radius of each cell when its neighbour pairs were found
+        displacements : numpy.ndarray(N, 3)
+            how far each cell was moved by the last solve
+        solve_start_positions : numpy.ndarray(N, 3)
+            the position of each cell at the start of the current solve
+        """
+        super().__init__(env_size, max_cell_radius)
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        if relaxation not in RELAXATION_MODES:
+            raise ValueError(f"Unknown relaxation mode: {relaxation}")
+        self.relaxation = relaxation
+        if relaxation == "conjugate_gradient":
+            self.max_merge_rounds = CG_MAX_MERGE_ROUNDS
+            self.merge_margin_growth = CG_MERGE_MARGIN_GROWTH
+        else:
+            self.max_merge_rounds = self.MAX_MERGE_ROUNDS
+            self.merge_margin_growth = 1.0
+        self.executor = None
+        self.warm_start = warm_start
+        self.neighbour_pairs = None
+        self.neighbour_positions = np.empty((0, 3))
+        self.neighbour_radii = np.empty(0)
+        self.displacements = np.empty((0, 3))
+        self.solve_start_positions = np.empty((0, 3))
+
+    def get_solver_constants(self):
+        """Gets the constants used by the relaxation functions to solve a cluster like this model."""
+        return {"env_size": self.env_size,
+                "max_iterations": self.MAX_ITERATIONS,
+                "force_multiplier": self.FORCE_MULTIPLIER,
+                "target_separation": self.TARGET_SEPARATION,
+                "min_stable_overlap_cutoff": self.MIN_STABLE_OVERLAP_CUTOFF,
+                "min_stable_overlap_diff": self.MIN_STABLE_OVERLAP_DIFF}
+
+    def get_executor(self):
+        """Gets the worker pool, creating it the first time it is needed."""
+        if self.executor is None:
+            if self.use_processes:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def close(self):
+        """Shuts down the worker pool, if it has been created."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def start_solve(self, cells):
+        """Extends the PhysicalModelWithActiveSet behaviour to also update the warm
+        start state with the cells that have changed since the last solve.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
+        old_positions = self.positions
+        old_radii = self.radii
+        super().start_solve(cells)
+        if self.warm_start:
+            with self.profiler.measure("warm_start"):
+                self.update_warm_start(old_positions, old_radii)
+
+    def update_warm_start(self, old_positions, old_radii):
+        """Drops the warm start state of the cells that have divided, died or
+        migrated since the last solve, and refreshes the neighbour pairs.
+
+        Parameters
+        ----------
+        old_positions : numpy.ndarray(N, 3)
+            the position of each cell at the end of the last solve
+        old_radii : numpy.ndarray(N)
+            the radius of each cell at the start of the last solve
+        """
+        num_cells = len(self.positions)
+        num_old_cells = len(old_positions)
+        if num_old_cells > num_cells or len(self.neighbour_positions) != num_old_cells:
+            # The cells have been replaced, so none of the state applies to them
+            num_old_cells = 0
+            self.neighbour_pairs = None
+
+        # The cells seeded since the last solve have no state
+        changed = np.ones(num_cells, dtype=bool)
+        displacements = np.zeros((num_cells, 3))
+        if num_old_cells:
+            divided = self.radii[:num_old_cells] < old_radii
+            migrated = np.any(self.positions[:num_old_cells] != old_positions, axis=1)
+            changed[:num_old_cells] = divided | migrated | self.dead[:num_old_cells]
+            displacements[:num_old_cells] = np.where(changed[:num_old_cells, None], 0.0, self.displacements)
+        self.displacements = displacements
+        self.solve_start_positions = self.positions.copy()
+        self.refresh_neighbour_pairs(changed)
+
+    def refresh_neighbour_pairs(self, out_of_date=None):
+        """Finds the neighbour pairs of the cells whose pairs are out of date.
+
+        A cell's pairs are out of date if it has changed, or has moved or grown
+        more than half of NEIGHBOUR_LIST_SKIN since they were found, and the
+        pairs of the other cells are kept. The pairs are of the cells within
+        NEIGHBOUR_LIST_SKIN + CONTACT_INHIBITION_RADIUS of each other, so once
+        refreshed they hold every pair in contact for contact inhibition. If
+        too many cells are out of date, the pairs of every cell are found again
+        at once.
+
+        Parameters
+        ----------
+        out_of_date : numpy.ndarray(N)
+            optional flags of the cells whose pairs are out of date because
+            they have changed
+        """
+        num_cells = len(self.positions)
+        num_old_cells = len(self.neighbour_positions)
+        if out_of_date is None:
+            out_of_date = np.zeros(num_cells, dtype=bool)
+        out_of_date[num_old_cells:] = True
+        self.neighbour_positions = np.concatenate((self.neighbour_positions, self.positions[num_old_cells:]))
+        self.neighbour_radii = np.concatenate((self.neighbour_radii, self.radii[num_old_cells:]))
+        out_of_date |= self.get_neighbour_drifts() > NEIGHBOUR_LIST_SKIN / 2
+
+        margin = NEIGHBOUR_LIST_SKIN + self.CONTACT_INHIBITION_RADIUS
+        live_cells = np.flatnonzero(~self.dead)
+        out_of_date_cells = np.flatnonzero(out_of_date & ~self.dead)
+        if (self.neighbour_pairs is None
+                or len(out_of_date_cells) > self.WARM_START_REBUILD_FRACTION * len(live_cells)):
+            i, j = find_close_pairs(self.positions[live_cells], self.radii[live_cells], margin)
+            self.neighbour_pairs = (live_cells[i], live_cells[j])
+            self.neighbour_positions = self.positions.copy()
+            self.neighbour_radii = self.radii.copy()
+            return
+        if not out_of_date.any():
+            return
+
+        # The kept cells may have drifted up to half of the skin closer to the out of date
+        # cells since their pairs were found, so those pairs are found within a wider margin
+        margin += NEIGHBOUR_LIST_SKIN / 2
+        out_of_date_set = set(out_of_date_cells.tolist())
+        new_pairs_i = []
+        new_pairs_j = []
+        for i in out_of_date_cells.tolist():
+            pos = self.positions[i]
+            radius = self.radii[i]
+            for j in self.grid.query(pos, radius + self.max_radius + margin):
+                if j == i or (j < i and j in out_of_date_set):
+                    continue
+                diff = pos - self.positions[j]
+                reach = radius + self.radii[j] + margin
+                if diff @ diff <= reach * reach:
+                    new_pairs_i.append(i)
+                    new_pairs_j.append(j)
+
+        pairs_i, pairs_j = self.neighbour_pairs
+        kept = ~out_of_date[pairs_i] & ~out_of_date[pairs_j]
+        self.neighbour_pairs = (np.concatenate((pairs_i[kept], np.array(new_pairs_i, dtype=np.int64))),
+                                np.concatenate((pairs_j[kept], np.array(new_pairs_j, dtype=np.int64))))
+        self.neighbour_positions[out_of_date] = self.positions[out_of_date]
+        self.neighbour_radii[out_of_date] = self.radii[out_of_date]
+
+    def get_neighbour_overlaps(self, extra_overlap_radius=0):
+        """Gets the overlapping pairs of cells from the kept neighbour pairs,
+        which must have been refreshed since the cells last moved.
+
+        Parameters
+        ----------
+        extra_overlap_radius : float = 0
+            optional extra distance between cells where they can be considered
+            overlapping, up to CONTACT_INHIBITION_RADIUS
+
+        Returns
+        -------
+        i : numpy.ndarray
+            the index of the first cell of each overlapping pair
+        j : numpy.ndarray
+            the index of the second cell of each overlapping pair
+        overlaps : numpy.ndarray
+            the overlap of each overlapping pair
+        """
+        pairs_i, pairs_j = self.neighbour_pairs
+        self.pair_checks += len(pairs_i)
+        diff = self.positions[pairs_i] - self.positions[pairs_j]
+        overlaps = (self.radii[pairs_i] + self.radii[pairs_j] + extra_overlap_radius
+                    - np.sqrt(np.einsum("ij,ij->i", diff, diff)))
+        overlapping = overlaps > 0
+        return pairs_i[overlapping], pairs_j[overlapping], overlaps[overlapping]
+
+    def update_contact_inhibition(self, cells):
+        """Overrides the PhysicalModelWithActiveSet behaviour to set whether every
+        cell is contact inhibited at once from the kept neighbour pairs, when
+        warm starting.
+
+        The flags are set exactly as by set_contact_inhibited_flags.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
+        if not self.warm_start:
+            super().update_contact_inhibition(cells)
+            return
+
+        num_cells = len(cells)
+        i, j, _ = self.get_neighbour_overlaps(self.CONTACT_INHIBITION_RADIUS)
+        num_forces = np.bincount(i, minlength=num_cells) + np.bincount(j, minlength=num_cells)
+        border_reach = self.radii[:, None] + self.CONTACT_INHIBITION_RADIUS
+        border_contacts = ((self.positions <= border_reach).sum(axis=1)
+                           + (self.positions >= self.env_size - border_reach).sum(axis=1))
+        inhibited = num_forces + border_contacts >= self.MIN_CONTACTS_FOR_INHIBITION
+
+        # A cell with too few contacts to be inhibited only becomes uninhibited if no cell touches it
+        for index in np.flatnonzero(inhibited).tolist():
+            cells[index].cell_body.contact_inhibited = True
+        for index in np.flatnonzero(~inhibited & (num_forces == 0)).tolist():
+            cells[index].cell_body.contact_inhibited = False
+        self.disturbed_cells = {}
+
+    def get_neighbour_drifts(self, num_cells=None):
+        """Gets how far each cell has moved and grown since its neighbour pairs were found.
+
+        Parameters
+        ----------
+        num_cells : int
+            the number of cells to get the drift of, all of them if not given
+
+        Returns
+        -------
+        numpy.ndarray
+            the distance each cell has moved plus how much its radius has grown
+        """
+        if num_cells is None:
+            num_cells = len(self.neighbour_positions)
+        moved = self.positions[:num_cells] - self.neighbour_positions[:num_cells]
+        growth = np.maximum(self.radii[:num_cells] - self.neighbour_radii[:num_cells], 0.0)
+        return np.sqrt(np.einsum("ij,ij->i", moved, moved)) + growth
+
+    def get_cluster_neighbour_lists(self, clusters):
+        """Gets warm neighbour lists of the clusters from the kept neighbour pairs.
+
+        Parameters
+        ----------
+        clusters : list
+            the cell indices of each cluster
+
+        Returns
+        -------
+        list
+            the NeighbourList of each cluster, indexed within the cluster, or None
+            for a cluster with a cell that has drifted too far for its pairs
+        """
+        num_cells = len(self.positions)
+        cluster_ids = np.full(num_cells, -1, dtype=np.int64)
+        cluster_positions = np.zeros(num_cells, dtype=np.int64)
+        for cluster_id, cluster in enumerate(clusters):
+            cluster_ids[cluster] = cluster_id
+            cluster_positions[cluster] = np.arange(len(cluster))
+
+        # Group the kept pairs with both cells in the same cluster by their cluster
+        pairs_i, pairs_j = self.neighbour_pairs
+        in_cluster = (cluster_ids[pairs_i] == cluster_ids[pairs_j]) & (cluster_ids[pairs_i] >= 0)
+        pairs_i = pairs_i[in_cluster]
+        pairs_j = pairs_j[in_cluster]
+        order = np.argsort(cluster_ids[pairs_i], kind="stable")
+        pairs_i = pairs_i[order]
+        pairs_j = pairs_j[order]
+        bounds = np.searchsorted(cluster_ids[pairs_i], np.arange(len(clusters) + 1))
+
+        margin = self.TARGET_SEPARATION if self.relaxation == "conjugate_gradient" else 0.0
+        allowances = NEIGHBOUR_LIST_SKIN / 2 - self.get_neighbour_drifts()
+        neighbour_lists = []
+        for cluster_id, cluster in enumerate(clusters):
+            cluster_allowances = allowances[cluster]
+            if cluster_allowances.min() < 0:
+                neighbour_lists.append(None)
+                continue
+            start, end = bounds[cluster_id], bounds[cluster_id + 1]
+            neighbour_lists.append(NeighbourList(
+                self.radii[cluster], NEIGHBOUR_LIST_SKIN, margin,
+                (cluster_positions[pairs_i[start:end]], cluster_positions[pairs_j[start:end]]),
+                self.positions[cluster], cluster_allowances))
+        return neighbour_lists
+
+    def find_clusters(self, start_cells, margin=None):
+        """Finds the clusters containing the given cells.
+
+        Parameters
+        ----------
+        start_cells : set
+            the indices of the live cells to find the clusters of
+        margin : float
+            the distance between the surfaces of two cells within which they
+            are in the same cluster, CLUSTER_CONTACT_MARGIN if not given
+
+        Returns
+        -------
+        list
+            a sorted list of the cell indices in each cluster
+        """
+        clusters = []
+        visited = set()
+        if margin is None:
+            margin = self.CLUSTER_CONTACT_MARGIN
+        for start_cell in start_cells:
+            if start_cell in visited:
+                continue
+
+            # Search the graph of cells in contact outwards from the cell
+            visited.add(start_cell)
+            cluster = [start_cell]
+            to_visit = [start_cell]
+            while to_visit:
+                i = to_visit.pop()
+                pos = self.positions[i]
+                radius = self.radii[i]
+                for j in self.grid.query(pos, radius + self.max_radius + margin):
+                    if j in visited:
+                        continue
+                    diff = pos - self.positions[j]
+                    reach = radius + self.radii[j] + margin
+                    if diff @ diff <= reach * reach:
+                        visited.add(j)
+                        cluster.append(j)
+                        to_visit.append(j)
+
+            clusters.append(sorted(cluster))
+        return clusters
+
+    def solve_clusters(self, cells, clusters, max_iterations=None):
+        """Solves the overlap of each cluster independently and moves their cells.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        clusters : list
+            the cell indices of each cluster
+        max_iterations : int
+            the most passes each cluster can be solved with, MAX_ITERATIONS if
+            not given
+
+        Returns
+        -------
+        list
+            the cell indices of each cluster that was solved and the telemetry
+            of its solve, as returned by the relaxation function
+        """
+        relax = RELAXATION_MODES[self.relaxation]
+        constants = self.get_solver_constants()
+        if max_iterations is not None:
+            constants["max_iterations"] = max_iterations
+        if self.warm_start:
+            with self.profiler.measure("warm_start"):
+                neighbour_lists = self.get_cluster_neighbour_lists(clusters)
+        else:
+            neighbour_lists = [None] * len(clusters)
+
+        futures = []
+        solves = []
+        for cluster, neighbour_list in zip(clusters, neighbour_lists):
+            if len(cluster) < 2:
+                continue
+            cluster_indices = np.array(cluster)
+            positions = self.positions[cluster_indices]
+            radii = self.radii[cluster_indices]
+            displacements = self.displacements[cluster_indices] if self.warm_start else None
+            if len(cluster) >= self.PARALLEL_MIN_CELLS and self.workers > 1:
+                cancel_event = None if self.use_processes else self.cancel_event
+                futures.append((cluster_indices, self.get_executor().submit(
+                    relax, positions, radii, constants, cancel_event, neighbour_list, displacements)))
+            else:
+                solves.append((cluster_indices, relax(positions, radii, constants, self.cancel_event,
+                                                      neighbour_list, displacements)))
+
+        solves += [(cluster_indices, future.result()) for cluster_indices, future in futures]
+
+        cluster_telemetry = []
+        for cluster_indices, (new_positions, telemetry) in solves:
+            self.move_cells(cells, cluster_indices, new_positions)
+            cluster_telemetry.append((cluster_indices, telemetry))
+        return cluster_telemetry
+
+    def move_cells(self, cells, cell_indices, new_positions):
+        """Moves cells to new positions, updating the grid and the disturbed cells.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        cell_indices : numpy.ndarray
+            the indices of the cells to move
+        new_positions : numpy.ndarray(N, 3)
+            the new position of each cell
+        """
+        moved = np.any(new_positions != self.positions[cell_indices], axis=1)
+        for i, pos in zip(cell_indices[moved].tolist(), new_positions[moved]):
+            if i not in self.disturbed_cells:
+                self.disturbed_cells[i] = self.positions[i].copy()
+            cells[i].cell_body.pos = pos.copy()
+            self.positions[i] = pos
+            self.grid.insert(i, pos)
+
+    def find_overlaps_between_clusters(self, clusters):
+        """Finds the cells that overlap a cell in a different cluster, or in none.
+
+        Parameters
+        ----------
+        clusters : list
+            the cell indices of each cluster that has been solved
+
+        Returns
+        -------
+        set
+            the indices of the cells overlapping a cell outside their cluster
+        """
+        cluster_of_cell = {}
+        for cluster_id, cluster in enumerate(clusters):
+            for i in cluster:
+                cluster_of_cell[i] = cluster_id
+
+        overlapping_cells = set()
+        for i, cluster_id in cluster_of_cell.items():
+            pos = self.positions[i]
+            radius = self.radii[i]
+            for j in self.grid.query(pos, radius + self.max_radius):
+                if j == i or cluster_of_cell.get(j) == cluster_id:
+                    continue
+                diff = pos - self.positions[j]
+                if diff @ diff < (radius + self.radii[j]) ** 2:
+                    overlapping_cells.add(i)
+                    overlapping_cells.add(j)
+        return overlapping_cells
+
+    def solve_overlap(self, sim_iteration, cells):
+        """Overrides the PhysicalModel behaviour to solve the overlap of each
+        disturbed cluster of cells independently.
+
+        The merge rounds share the MAX_ITERATIONS budget of the base model:
+        each round solves its clusters with the passes left by the rounds
+        before it. The telemetry's passes are the most passes used by a
+        cluster, summed over the merge rounds, its exit reason is the worst of
+        the last round's clusters (or max_iterations if the budget or merge
+        rounds run out with clusters still overlapping), and its overlaps are
+        those of the solved clusters. Without measure_final_overlap, the final
+        overlap is the sum of the final overlaps reported by the clusters last
+        solved, which leaves out any overlap between the clusters.
+
+        Parameters
+        ----------
+        sim_iteration : int
+            the current simulation iteration being solved
+        cells : list
+            the cell agent objects in the simulation
+        """
+        self.solve_passes = 0
+        self.pair_checks = 0
+        self.start_solve(cells)
+
+        exit_order = (self.EXIT_NO_OVERLAP, self.EXIT_STABILISED,
+                      self.EXIT_MAX_ITERATIONS, self.EXIT_CANCELLED)
+        exit_reason = self.EXIT_NO_OVERLAP
+        initial_overlap = None
+        cluster_overlaps = []
+        start_cells = self.active_cells
+        solved_cells = set()
+        merge_round = 0
+        while start_cells and merge_round < self.max_merge_rounds and self.solve_passes < self.MAX_ITERATIONS:
+            with self.profiler.measure("find_clusters"):
+                clusters = self.find_clusters(
+                    start_cells, self.CLUSTER_CONTACT_MARGIN * self.merge_margin_growth ** merge_round)
+            self.profiler.count("clusters", len(clusters))
+
+            with self.profiler.measure("solve_clusters"):
+                cluster_telemetry = self.solve_clusters(cells, clusters, self.MAX_ITERATIONS - self.solve_passes)
+
+            if cluster_telemetry:
+                self.solve_passes += max(telemetry["passes"] for _, telemetry in cluster_telemetry)
+                self.pair_checks += sum(telemetry["pair_checks"] for _, telemetry in cluster_telemetry)
+                exit_reason = max([telemetry["exit_reason"] for _, telemetry in cluster_telemetry],
+                                  key=exit_order.index)
+                if initial_overlap is None:
+                    initial_overlap = sum(telemetry["initial_overlap"] for _, telemetry in cluster_telemetry)
+
+                # A cluster solved again in a merge round replaces the earlier clusters it took cells from
+                resolved = set()
+                for cluster_indices, _ in cluster_telemetry:
+                    resolved.update(cluster_indices.tolist())
+                cluster_overlaps = [(cluster, overlap) for cluster, overlap in cluster_overlaps
+                                    if resolved.isdisjoint(cluster)]
+                cluster_overlaps += [(set(cluster_indices.tolist()), telemetry["final_overlap"])
+                                     for cluster_indices, telemetry in cluster_telemetry]
+
+            if exit_reason == self.EXIT_CANCELLED or (
+                    self.cancel_event is not None and self.cancel_event.is_set()):
+                self.last_solve = self.get_solve_telemetry(self.EXIT_CANCELLED, initial_overlap, None)
+                return
+
+            for cluster in clusters:
+                solved_cells.update(cluster)
+            start_cells = self.find_overlaps_between_clusters(clusters)
+            merge_round += 1
+
+        if self.warm_start:
+            with self.profiler.measure("warm_start"):
+                self.refresh_neighbour_pairs()
+        final_overlap = sum(overlap for _, overlap in cluster_overlaps)
+        if self.measure_final_overlap and solved_cells:
+            # The solved clusters may have been pushed into each other since their overlap was computed
+            solver_pair_checks = self.pair_checks
+            with self.profiler.measure("final_overlap_pass"):
+                if self.warm_start:
+                    i, j, overlaps = self.get_neighbour_overlaps()
+                    solved = np.zeros(len(cells), dtype=bool)
+                    solved[list(solved_cells)] = True
+                    final_overlap = float(overlaps[solved[i] | solved[j]].sum())
+                else:
+                    final_overlap, _ = self.get_active_overlap_and_forces(cells, solved_cells)
+            self.pair_checks = solver_pair_checks
+        if start_cells:
+            # The budget or merge rounds ran out with clusters still pushed into each other
+            exit_reason = max(exit_reason, self.EXIT_MAX_ITERATIONS, key=exit_order.index)
+        if self.warm_start:
+            self.displacements = self.positions - self.solve_start_positions
+
+        with self.profiler.measure("contact_inhibition_pass"):
+            self.update_contact_inhibition(cells)
+
+        self.profiler.count("solve_passes", self.solve_passes)
+        self.profiler.count("pair_checks", self.pair_checks)
+        self.last_solve = self.get_solve_telemetry(
+            exit_reason, initial_overlap if initial_overlap is not None else 0.0, final_overlap)
+
+
+class SolverTelemetry:
+    HEADER = ("iteration", "passes", "exit_reason", "initial_overlap", "final_overlap", "pair_checks")
+
+    def __init__(self):
+        """Constructs the necessary attributes for the SolverTelemetry object.
+
+        The telemetry holds how the overlap solve of each simulation iteration
+        went, so the solver constants can be tuned for speed using evidence.
+
+        Other defined attributes
+        ------------------------
+        solves : dict
+            a dictionary relating each iteration to the telemetry of its solve,
+            as returned by PhysicalModel.get_solve_telemetry
+        """
+        self.solves = {}
+
+    def record_solve(self, iteration, solve_telemetry):
+        """Records the telemetry of an iteration's solve.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        solve_telemetry : dict
+            the telemetry of the solve, e.g. the physical model's last_solve
+        """
+        self.solves[iteration] = solve_telemetry
+
+    def get_iterations(self):
+        """Gets the iterations with recorded solves in ascending order."""
+        return sorted(self.solves)
+
+    def get_summary(self):
+        """Summarises the solves of all iterations.
+
+        Returns
+        -------
+        dict
+            the number of "solves", the number of solves stopping for each
+            reason ("exit_reasons"), the "mean_passes", "max_passes" and
+            "total_pair_checks", and the number of solves that left overlap
+            ("unresolved_solves")
+        """
+        solves = list(self.solves.values())
+        exit_reasons = {}
+        for solve in solves:
+            exit_reasons[solve["exit_reason"]] = exit_reasons.get(solve["exit_reason"], 0) + 1
+        return {"solves": len(solves),
+                "exit_reasons": exit_reasons,
+                "mean_passes": sum(solve["passes"] for solve in solves) / len(solves) if solves else 0,
+                "max_passes": max((solve["passes"] for solve in solves), default=0),
+                "total_pair_checks": sum(solve["pair_checks"] for solve in solves),
+                "unresolved_solves": sum(1 for solve in solves if solve["final_overlap"])}
+
+    def write(self, telemetry_file):
+        """Writes the telemetry to a tab separated file with one row per iteration.
+
+        Overlaps that are unknown, e.g. for cancelled solves, are written as empty fields.
+        """
+        with open(telemetry_file, "w", newline="") as f:
+            csvwriter = csv.writer(f, delimiter="\t")
+            csvwriter.writerow(self.HEADER)
+            for iteration in self.get_iterations():
+                solve = self.solves[iteration]
+                csvwriter.writerow([iteration] + [
+                    "" if solve[column] is None else solve[column] for column in self.HEADER[1:]])
+
+    @classmethod
+    def read(cls, telemetry_file):
+        """Reads telemetry written by the write function.
+
+        Returns
+        -------
+        SolverTelemetry
+            the telemetry read from the file
+        """
+        telemetry = cls()
+        with open(telemetry_file, newline="") as f:
+            csvreader = csv.reader(f, delimiter="\t")
+            next(csvreader, None)
+            for row in csvreader:
+                telemetry.solves[int(row[0])] = {
+                    "passes": int(row[1]),
+                    "exit_reason": row[2],
+                    "initial_overlap": float(row[3]) if row[3] else None,
+                    "final_overlap": float(row[4]) if row[4] else None,
+                    "pair_checks": int(row[5])}
+        return telemetry
+
+
+def solve_cluster_overlap(positions, radii, constants, cancel_event=None,
+                          neighbour_list=None, displacements=None):
+    """Minimises the overlap within a cluster of cells, as the PhysicalModel would.
+
+    The passes are vectorised over a NeighbourList of the pairs of cells within
+    NEIGHBOUR_LIST_SKIN of each other, which is rebuilt once a cell has moved
+    more than half of the skin since it was built. This is a module function of
+    arrays so clusters can be solved on a thread or process pool.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the positions of the cells in the cluster
+    radii : numpy.ndarray(N)
+        the radii of the cells in the cluster
+    constants : dict
+        the solver constants, as returned by PhysicalModelWithClusters.get_solver_constants
+    cancel_event : threading.Event
+        an optional event that stops the solve when it is set
+    neighbour_list : NeighbourList
+        an optional warm neighbour list of the cluster from an earlier solve
+    displacements : numpy.ndarray(N, 3)
+        optional displacements of the cells in an earlier solve to start from,
+        see seed_cluster_positions
+
+    Returns
+    -------
+    positions : numpy.ndarray(N, 3)
+        the new positions of the cells
+    telemetry : dict
+        the "passes", "exit_reason", "initial_overlap", "final_overlap" and
+        "pair_checks" of the solve
+    """
+    positions = np.array(positions, dtype=np.float64)
+    num_cells = len(positions)
+    env_size = constants["env_size"]
+    lower_bounds = radii[:, None]
+    upper_bounds = env_size - radii[:, None]
+    if neighbour_list is None:
+        neighbour_list = NeighbourList(radii, NEIGHBOUR_LIST_SKIN)
+
+    passes = 0
+    pair_checks = 0
+    if displacements is not None:
+        positions, pair_checks = seed_cluster_positions(positions, radii, constants,
+                                                        neighbour_list, displacements)
+    previous_overlap = 0.0
+    current_overlap = 0.0
+    initial_overlap = None
+    exit_reason = PhysicalModel.EXIT_MAX_ITERATIONS
+
+    while passes < constants["max_iterations"]:
+        if cancel_event is not None and cancel_event.is_set():
+            exit_reason = PhysicalModel.EXIT_CANCELLED
+            break
+
+        pairs_i, pairs_j = neighbour_list.get_pairs(positions)
+        diff = positions[pairs_i] - positions[pairs_j]
+        dists = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        overlaps = radii[pairs_i] + radii[pairs_j] - dists
+        overlapping = overlaps > 0
+        pair_checks += len(pairs_i)
+        passes += 1
+
+        previous_overlap = current_overlap
+        current_overlap = float(overlaps[overlapping].sum())
+        if initial_overlap is None:
+            initial_overlap = current_overlap
+
+        # Stop solver if there is no overlap or it has stabilised
+        if not current_overlap:
+            exit_reason = PhysicalModel.EXIT_NO_OVERLAP
+            break
+        elif (abs(previous_overlap - current_overlap) < constants["min_stable_overlap_diff"]
+              and current_overlap > constants["min_stable_overlap_cutoff"]):
+            exit_reason = PhysicalModel.EXIT_STABILISED
+            break
+
+        # Get the force that cell j exerts on cell i in each overlapping pair
+        i = pairs_i[overlapping]
+        j = pairs_j[overlapping]
+        diff = diff[overlapping]
+        dists = dists[overlapping]
+        unit_vectors = np.empty_like(diff)
+        separated = dists > 0
+        unit_vectors[separated] = diff[separated] / dists[separated, None]
+        for k in np.flatnonzero(~separated):
+            # If cells directly on top of each other, separate in random direction
+            unit_vectors[k] = utils.rand_unit_vec()
+        forces = unit_vectors * (overlaps[overlapping] + constants["target_separation"])[:, None]
+
+        # Apply the sum of each cell's forces to their positions
+        sum_forces = np.zeros((num_cells, 3))
+        for axis in range(3):
+            sum_forces[:, axis] = (np.bincount(i, forces[:, axis], num_cells)
+                                   - np.bincount(j, forces[:, axis], num_cells))
+        forced = np.zeros(num_cells, dtype=bool)
+        forced[i] = True
+        forced[j] = True
+        positions[forced] = np.clip(positions[forced] + constants["force_multiplier"] * sum_forces[forced],
+                                    lower_bounds[forced], upper_bounds[forced])
+
+    return positions, {"passes": passes,
+                       "exit_reason": exit_reason,
+                       "initial_overlap": initial_overlap if initial_overlap is not None else 0.0,
+                       "final_overlap": current_overlap,
+                       "pair_checks": pair_checks}
+
+
+def get_overlap_energy_and_gradient(positions, radii, pairs_i, pairs_j, target_separation):
+    """Gets the penalty energy of the overlap within a cluster of cells and its gradient.
+
+    The energy of each pair is half the square of how far the cells are from
+    being TARGET_SEPARATION apart, if they are closer than that.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the positions of the cells
+    radii : numpy.ndarray(N)
+        the radii of the cells
+    pairs_i, pairs_j : numpy.ndarray
+        the indices of the cells in each pair that could be in contact
+    target_separation : float
+        the gap left between cells at zero energy
+
+    Returns
+    -------
+    energy : float
+        the total penalty energy
+    gradient : numpy.ndarray(N, 3)
+        the gradient of the energy with respect to each cell's position
+    overlap : float
+        the total overlap between the cells, without the target separation
+    """
+    diff = positions[pairs_i] - positions[pairs_j]
+    dists = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    contact_dists = radii[pairs_i] + radii[pairs_j]
+    penetrations = contact_dists + target_separation - dists
+    in_contact = penetrations > 0
+    gradient = np.zeros_like(positions)
+    if not in_contact.any():
+        return 0.0, gradient, 0.0
+
+    i = pairs_i[in_contact]
+    j = pairs_j[in_contact]
+    diff = diff[in_contact]
+    dists = dists[in_contact]
+    penetrations = penetrations[in_contact]
+    overlaps = contact_dists[in_contact] - dists
+
+    unit_vectors = np.empty_like(diff)
+    separated = dists > 0
+    unit_vectors[separated] = diff[separated] / dists[separated, None]
+    for k in np.flatnonzero(~separated):
+        # If cells directly on top of each other, separate in random direction
+        unit_vectors[k] = utils.rand_unit_vec()
+
+    pair_gradients = unit_vectors * penetrations[:, None]
+    num_cells = len(positions)
+    for axis in range(3):
+        gradient[:, axis] = (np.bincount(j, pair_gradients[:, axis], num_cells)
+                             - np.bincount(i, pair_gradients[:, axis], num_cells))
+    return 0.5 * float(penetrations @ penetrations), gradient, float(overlaps[overlaps > 0].sum())
+
+def seed_cluster_positions(positions, radii, constants, neighbour_list, displacements):
+    """Starts the solve of a cluster from the displacements of its cells in an
+    earlier solve, if that lowers the penalty energy of their overlap.
+
+    Where the cells are pushed the same way in each iteration, e.g. by a colony
+    growing outwards, the last displacements are a prediction of the next.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the positions of the cells in the cluster
+    radii : numpy.ndarray(N)
+        the radii of the cells in the cluster
+    constants : dict
+        the solver constants, as returned by PhysicalModelWithClusters.get_solver_constants
+    neighbour_list : NeighbourList
+        the neighbour list of the cluster
+    displacements : numpy.ndarray(N, 3)
+        the displacements of the cells in the earlier solve
+
+    Returns
+    -------
+    positions : numpy.ndarray(N, 3)
+        the positions to start the solve from
+    pair_checks : int
+        the number of cell pairs checked
+    """
+    if not np.any(displacements):
+        return positions, 0
+
+    seeded_positions = np.clip(positions + displacements, radii[:, None], constants["env_size"] - radii[:, None])
+    pairs_i, pairs_j = neighbour_list.get_pairs(positions)
+    energy, _, _ = get_overlap_energy_and_gradient(
+        positions, radii, pairs_i, pairs_j, constants["target_separation"])
+    pair_checks = len(pairs_i)
+    pairs_i, pairs_j = neighbour_list.get_pairs(seeded_positions)
+    seeded_energy, _, _ = get_overlap_energy_and_gradient(
+        seeded_positions, radii, pairs_i, pairs_j, constants["target_separation"])
+    pair_checks += len(pairs_i)
+    return (seeded_positions if seeded_energy < energy else positions), pair_checks
+
+def minimise_cluster_overlap_energy(positions, radii, constants, cancel_event=None,
+                                    neighbour_list=None, displacements=None):
+    """Minimises the overlap within a cluster of cells as a penalty energy with
+    projected nonlinear conjugate gradient.
+
+    The energy (see get_overlap_energy_and_gradient) is minimised over all the
+    cells' positions at once, which are kept within the environment walls by
+    projecting them onto the box of allowed positions. Each pass takes a
+    Polak-Ribiere conjugate gradient step, with the direction reset to steepest
+    descent when it stops going downhill, and a backtracking line search. No
+    cell moves more than CG_MAX_CELL_STEP_SCALE times as far in a pass as the
+    explicit force step would move it, so the cells end up packed, and contact
+    inhibited, as the explicit steps leave them. The
+    gradient's components pushing cells into the walls they touch are dropped,
+    so the directions stay within the box. The solve stops when there is no
+    overlap, when the energy stops falling, after MAX_ITERATIONS passes or when
+    it is cancelled. The pairs come from a NeighbourList, as in
+    solve_cluster_overlap, which also holds the pairs within TARGET_SEPARATION.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the positions of the cells in the cluster
+    radii : numpy.ndarray(N)
+        the radii of the cells in the cluster
+    constants : dict
+        the solver constants, as returned by PhysicalModelWithClusters.get_solver_constants
+    cancel_event : threading.Event
+        an optional event that stops the solve when it is set
+    neighbour_list : NeighbourList
+        an optional warm neighbour list of the cluster from an earlier solve,
+        holding the pairs within TARGET_SEPARATION
+    displacements : numpy.ndarray(N, 3)
+        optional displacements of the cells in an earlier solve to start from,
+        see seed_cluster_positions
+
+    Returns
+    -------
+    positions : numpy.ndarray(N, 3)
+        the new positions of the cells
+    telemetry : dict
+        the "passes", "exit_reason", "initial_overlap", "final_overlap" and
+        "pair_checks" of the solve
+    """
+    positions = np.array(positions, dtype=np.float64)
+    lower_bounds = np.broadcast_to(radii[:, None], positions.shape)
+    upper_bounds = constants["env_size"] - lower_bounds
+    target_separation = constants["target_separation"]
+    if neighbour_list is None:
+        neighbour_list = NeighbourList(radii, NEIGHBOUR_LIST_SKIN, target_separation)
+
+    pair_checks = 0
+    if displacements is not None:
+        positions, pair_checks = seed_cluster_positions(positions, radii, constants,
+                                                        neighbour_list, displacements)
+
+    def evaluate(trial_positions):
+        nonlocal pair_checks
+        pairs_i, pairs_j = neighbour_list.get_pairs(trial_positions)
+        pair_checks += len(pairs_i)
+        return get_overlap_energy_and_gradient(trial_positions, radii, pairs_i, pairs_j, target_separation)
+
+    def project_gradient(gradient, at_positions):
+        # Drop the components that would push cells further into the walls they touch
+        blocked = (((at_positions <= lower_bounds) & (gradient > 0))
+                   | ((at_positions >= upper_bounds) & (gradient < 0)))
+        return np.where(blocked, 0.0, gradient)
+
+    energy, gradient, current_overlap = evaluate(positions)
+    initial_overlap = current_overlap
+    projected_gradient = project_gradient(gradient, positions)
+    direction = -projected_gradient
+    step_size = 1.0
+    passes = 0
+    exit_reason = PhysicalModel.EXIT_MAX_ITERATIONS
+
+    while passes < constants["max_iterations"]:
+        if cancel_event is not None and cancel_event.is_set():
+            exit_reason = PhysicalModel.EXIT_CANCELLED
+            break
+        if not current_overlap:
+            exit_reason = PhysicalModel.EXIT_NO_OVERLAP
+            break
+
+        passes += 1
+        slope = float(np.vdot(projected_gradient, direction))
+        if slope >= 0:
+            # Restart from steepest descent if the direction is not downhill
+            direction = -projected_gradient
+            slope = -float(np.vdot(projected_gradient, projected_gradient))
+            if slope == 0:
+                exit_reason = PhysicalModel.EXIT_STABILISED
+                break
+
+        # Limit how far each cell moves in a pass relative to the explicit force step,
+        # so the cells are not scattered from the packing the explicit steps would leave
+        cell_steps = np.linalg.norm(direction, axis=1)
+        max_cell_steps = CG_MAX_CELL_STEP_SCALE * constants["force_multiplier"] * np.linalg.norm(gradient, axis=1)
+
+        # Backtrack until the projected step lowers the energy enough (the Armijo condition)
+        step_size = min(step_size * 2, CG_MAX_STEP_SIZE)
+        for _ in range(CG_MAX_BACKTRACKS):
+            step_scales = np.minimum(step_size, max_cell_steps / np.maximum(cell_steps, 1e-300))
+            new_positions = np.clip(positions + step_scales[:, None] * direction, lower_bounds, upper_bounds)
+            new_energy, new_gradient, new_overlap = evaluate(new_positions)
+            if new_energy <= energy + CG_SUFFICIENT_DECREASE * float(np.vdot(gradient, new_positions - positions)):
+                break
+            step_size /= 2
+        else:
+            exit_reason = PhysicalModel.EXIT_STABILISED
+            break
+
+        energy_decrease = energy - new_energy
+        positions = new_positions
+        energy = new_energy
+        gradient = new_gradient
+        current_overlap = new_overlap
+        new_projected_gradient = project_gradient(gradient, positions)
+
+        if energy_decrease <= CG_ENERGY_TOLERANCE * max(energy, 1.0):
+            exit_reason = (PhysicalModel.EXIT_NO_OVERLAP if not current_overlap
+                           else PhysicalModel.EXIT_STABILISED)
+            break
+
+        # Polak-Ribiere update of the search direction, reset when it would be negative
+        beta = max(0.0, float(np.vdot(new_projected_gradient, new_projected_gradient - projected_gradient))
+                   / max(float(np.vdot(projected_gradient, projected_gradient)), 1e-300))
+        direction = -new_projected_gradient + beta * project_gradient(direction, positions)
+        projected_gradient = new_projected_gradient
+    else:
+        if not current_overlap:
+            exit_reason = PhysicalModel.EXIT_NO_OVERLAP
+
+    return positions, {"passes": passes,
+                       "exit_reason": exit_reason,
+                       "initial_overlap": initial_overlap,
+                       "final_overlap": current_overlap,
+                       "pair_checks": pair_checks}
+
+
+# Functions that relax the clusters of a PhysicalModelWithClusters, by relaxation mode
+RELAXATION_MODES = {"explicit": solve_cluster_overlap,
+                    "conjugate_gradient": minimise_cluster_overlap_energy}
+
+def create_physical_model(env_size, max_cell_radius, solver="auto", workers=None):
+    """Creates the physical model implementation of the chosen solver.
+
+    The "auto" solver chooses the implementation suited to the environment size,
+    only using the local environments if at least 4 of them, each wider than
+    two cell diameters, fit along a side of the environment.
+
+    Parameters
+    ----------
+    env_size : float
+        the width of the environment
+    max_cell_radius : float
+        the maximum radius that a cell in the simulation can have
+    solver : string
+        the name of the solver, one of PHYSICS_SOLVERS
+    workers : int
+        the number of workers that solve the clusters of the "clusters"
+        solver, one per CPU if not given
+
+    Returns
+    -------
+    PhysicalModel / PhysicalModelWithLocals / PhysicalModelWithActiveSet / PhysicalModelWithClusters
+        the physical model used to solve cell overlap
+    """
+    if solver == "auto":
+        solver = "base" if int(env_size / (max_cell_radius * 4)) < 4 else "locals"
+
+    if solver == "base":
+        return PhysicalModel(env_size)
+    elif solver == "locals":
+        return PhysicalModelWithLocals(env_size, max_cell_radius)
+    elif solver == "active_set":
+        return PhysicalModelWithActiveSet(env_size, max_cell_radius)
+    elif solver == "clusters":
+        return PhysicalModelWithClusters(env_size, max_cell_radius, workers)
+    raise ValueError(f"Unknown physics solver: {solver}")
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Places the daughter cells seeded by mitosis.
+
+By default a daughter cell is placed at a random direction from its parent,
+offset by the daughter's diameter, as the cell types always have. Inside dense
+tissue this often lands on top of neighbouring cells, and the overlap solver
+then spends many passes pushing them apart. The other strategies use a
+SpatialGrid of the cells to avoid this:
+- "least_crowded" tries NUM_CANDIDATES random directions and places the
+  daughter in the one it overlaps least, stopping early at a free one
+- "nearest_free" searches outwards from the parent in steps of the daughter's
+  radius for the nearest position that overlaps no cell, falling back to the
+  least crowded position found
+
+The placement distribution is set by the strategy, the number of candidate
+directions and the offset of the daughter from its parent, and is chosen with
+Simulation(..., daughter_placement=...), either as a strategy name or as a
+DaughterPlacement object.
+
+The reduction in solver passes can be measured by running the same seeded
+simulation with each strategy:
+
+Usage: python placement.py [--cells 20] [--iterations 80] [--env-size 100]
+                           [--solver auto] [--strategies random,least_crowded,nearest_free]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from spatial import SpatialGrid
+import utils
+
+# Strategies for placing daughter cells
+PLACEMENT_STRATEGIES = ("random", "least_crowded", "nearest_free")
+
+
+class DaughterPlacement:
+    # Default number of candidate directions tried for each daughter cell
+    NUM_CANDIDATES = 8
+    # Default number of steps outwards that nearest_free searches for a free position
+    MAX_SEARCH_STEPS = 3
+
+    def __init__(self, strategy="random", num_candidates=None, offset_scale=2.0, max_search_steps=None):
+        """Constructs the necessary attributes for the DaughterPlacement object.
+
+        Parameters
+        ----------
+        strategy : string
+            how the daughter cells are placed, one of PLACEMENT_STRATEGIES
+        num_candidates : int
+            the number of candidate directions tried for each daughter cell,
+            NUM_CANDIDATES if not given
+        offset_scale : float
+            the distance of the daughter cell from its parent, in daughter radii
+        max_search_steps : int
+            the number of steps outwards that nearest_free searches for a free
+            position, MAX_SEARCH_STEPS if not given
+
+        Other defined attributes
+        ------------------------
+        grid : SpatialGrid
+            the grid of the live cells at the start of the current iteration's
+            cell behaviours, or None for the random strategy
+        daughter_grid : SpatialGrid
+            the grid of the daughter cells placed in the current iteration
+        cells : list
+            the cells in the simulation, indexed by the grid
+        daughters : list
+            the (position, radius) of each daughter cell placed in the current
+            iteration, indexed by the daughter grid
+        max_radius : float
+            the largest radius of a cell in the grids
+        placements : int
+            the number of daughter cells placed
+        crowded_placements : int
+            the number of daughter cells placed overlapping another cell
+        total_overlap : float
+            the total overlap of the daughter cells when they were placed
+        """
+        if strategy not in PLACEMENT_STRATEGIES:
+            raise ValueError(f"Unknown placement strategy: {strategy}")
+        self.strategy = strategy
+        self.num_candidates = num_candidates if num_candidates is not None else self.NUM_CANDIDATES
+        self.offset_scale = offset_scale
+        self.max_search_steps = max_search_steps if max_search_steps is not None else self.MAX_SEARCH_STEPS
+        self.grid = None
+        self.daughter_grid = None
+        self.cells = []
+        self.daughters = []
+        self.max_radius = 0.0
+        self.placements = 0
+        self.crowded_placements = 0
+        self.total_overlap = 0.0
+
+    def start_iteration(self, cells):
+        """Indexes the live cells at the start of an iteration's cell behaviours.
+
+        The cells that migrate during the behaviours stay in the buckets they
+        started in, so the grid is searched a migration step further than the
+        cells can reach.
+
+        Parameters
+        ----------
+        cells : list
+            the cell agent objects in the simulation
+        """
+        if self.strategy == "random":
+            return
+
+        self.cells = cells
+        self.daughters = []
+        live_cells = [i for i, cell in enumerate(cells) if not cell.is_dead]
+        self.max_radius = max((cells[i].cell_body.radius for i in live_cells), default=0.0)
+        bucket_size = max(2 * self.max_radius, 1.0)
+        self.grid = SpatialGrid(bucket_size)
+        for i in live_cells:
+            self.grid.insert(i, cells[i].cell_body.pos)
+        self.daughter_grid = SpatialGrid(bucket_size)
+
+    def place(self, parent, daughter_radius):
+        """Chooses the position of a daughter cell seeded by a parent cell.
+
+        Parameters
+        ----------
+        parent : AbstractCellType
+            the cell dividing
+        daughter_radius : float
+            the radius of the daughter cell
+
+        Returns
+        -------
+        numpy.ndarray(3)
+            the position of the daughter cell
+        """
+        parent_pos = parent.cell_body.pos
+        env_size = parent.sim.env_size
+        offset = daughter_radius * self.offset_scale
+
+        if self.strategy == "random" or self.grid is None:
+            pos = parent_pos + utils.rand_unit_vec() * offset
+            return np.clip(pos, daughter_radius, env_size - daughter_radius)
+
+        best_pos = None
+        best_overlap = None
+        search_steps = self.max_search_steps if self.strategy == "nearest_free" else 1
+        for step in range(search_steps):
+            distance = offset + step * daughter_radius
+            for _ in range(self.num_candidates):
+                pos = np.clip(parent_pos + utils.rand_unit_vec() * distance,
+                              daughter_radius, env_size - daughter_radius)
+                overlap = self.get_overlap(pos, daughter_radius)
+                if best_overlap is None or overlap < best_overlap:
+                    best_pos = pos
+                    best_overlap = overlap
+                if not overlap:
+                    break
+            if not best_overlap:
+                break
+
+        self.record_placement(best_pos, daughter_radius, best_overlap)
+        return best_pos
+
+    def get_overlap(self, pos, radius):
+        """Gets the total overlap of a cell placed at a position with the other cells.
+
+        The current positions of the indexed cells are used, which are searched
+        for up to half a radius (a migration step) beyond their buckets.
+
+        Parameters
+        ----------
+        pos : numpy.ndarray(3)
+            the position of the cell
+        radius : float
+            the radius of the cell
+
+        Returns
+        -------
+        float
+            the sum of the overlap with the indexed cells and daughters
+        """
+        max_radius = max(self.max_radius, radius)
+        total_overlap = 0.0
+        for i in self.grid.query(pos, radius + max_radius + max_radius / 2):
+            cell = self.cells[i]
+            if cell.is_dead:
+                continue
+            diff = pos - cell.cell_body.pos
+            reach = radius + cell.cell_body.radius
+            dist_squared = diff @ diff
+            if dist_squared < reach * reach:
+                total_overlap += reach - np.sqrt(dist_squared)
+
+        for i in self.daughter_grid.query(pos, radius + max_radius):
+            daughter_pos, daughter_radius = self.daughters[i]
+            diff = pos - daughter_pos
+            reach = radius + daughter_radius
+            dist_squared = diff @ diff
+            if dist_squared < reach * reach:
+                total_overlap += reach - np.sqrt(dist_squared)
+        return total_overlap
+
+    def record_placement(self, pos, radius, overlap):
+        """Indexes a placed daughter cell and adds it to the placement counts."""
+        self.daughter_grid.insert(len(self.daughters), pos)
+        self.daughters.append((pos, radius))
+        self.max_radius = max(self.max_radius, radius)
+        self.placements += 1
+        if overlap:
+            self.crowded_placements += 1
+            self.total_overlap += overlap
+
+    def get_summary(self):
+        """Summarises the daughter cells placed.
+
+        Returns
+        -------
+        dict
+            the "strategy", the number of "placements", the number of
+            "crowded_placements" overlapping another cell and their
+            "mean_overlap" per placement, which are not counted for the
+            random strategy
+        """
+        return {"strategy": self.strategy,
+                "placements": self.placements,
+                "crowded_placements": self.crowded_placements,
+                "mean_overlap": self.total_overlap / self.placements if self.placements else 0.0}
+
+
+def create_daughter_placement(daughter_placement="random"):
+    """Creates the daughter placement service of a simulation.
+
+    Parameters
+    ----------
+    daughter_placement : string / DaughterPlacement
+        a strategy from PLACEMENT_STRATEGIES, or a DaughterPlacement object
+        configured with its placement distribution
+
+    Returns
+    -------
+    DaughterPlacement
+        the daughter placement service
+    """
+    if isinstance(daughter_placement, DaughterPlacement):
+        return daughter_placement
+    return DaughterPlacement(daughter_placement)
+
+def compare_strategies(strategies, num_cells, iterations, env_size, seed, physics_solver="auto"):
+    """Runs the same seeded GenericCell simulation with each placement strategy.
+
+    Parameters
+    ----------
+    strategies : list
+        the placement strategies to compare
+    num_cells : int
+        the number of cells to seed
+    iterations : int
+        the number of iterations to run
+    env_size : float
+        the width of the environment
+    seed : int
+        the random seed of each simulation
+    physics_solver : string
+        the physical model used to solve cell overlap
+
+    Returns
+    -------
+    list
+        the strategy, seconds, solver passes, solver summary and placement
+        summary of each simulation
+    """
+    # Imported here as the simulation imports this module
+    from cell_type import GenericCell
+    from simulation import Simulation
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for strategy in strategies:
+            start_time = time.perf_counter()
+            sim = Simulation(os.path.join(output_dir, "placement.csv"), [GenericCell], [num_cells],
+                             env_size, [], iterations, seed, physics_solver=physics_solver,
+                             daughter_placement=strategy)
+            try:
+                for _ in range(iterations):
+                    sim.run_iteration()
+            finally:
+                sim.close()
+            solver_summary = sim.get_solver_telemetry().get_summary()
+            solver_passes = sum(solve["passes"] for solve in sim.solver_telemetry.solves.values())
+            results.append({"strategy": strategy,
+                            "seconds": time.perf_counter() - start_time,
+                            "solver_passes": solver_passes,
+                            "solver_summary": solver_summary,
+                            "placement_summary": sim.daughter_placement.get_summary(),
+                            "final_cells": len(sim.cells)})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the solver passes of simulations with each daughter placement strategy.")
+    parser.add_argument("--cells", type=int, default=20, help="cells seeded")
+    parser.add_argument("--iterations", type=int, default=80, help="iterations simulated")
+    parser.add_argument("--env-size", type=float, default=100.0, help="width of the environment")
+    parser.add_argument("--solver", default="auto", help="physical model used to solve cell overlap")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the simulations")
+    parser.add_argument("--strategies", default=",".join(PLACEMENT_STRATEGIES),
+                        help="comma separated strategies from: " + ", ".join(PLACEMENT_STRATEGIES))
+    args = parser.parse_args()
+
+    strategies = [strategy for strategy in args.strategies.split(",") if strategy]
+    for strategy in strategies:
+        if strategy not in PLACEMENT_STRATEGIES:
+            parser.error(f"unknown strategy {strategy}")
+
+    results = compare_strategies(strategies, args.cells, args.iterations, args.env_size, args.seed,
+                                 args.solver)
+    baseline_passes = results[0]["solver_passes"]
+    for result in results:
+        change = (result["solver_passes"] / baseline_passes - 1) if baseline_passes else 0.0
+        placement_summary = result["placement_summary"]
+        crowded = (f"{placement_summary['crowded_placements']}/{placement_summary['placements']} "
+                   f"crowded placements, " if placement_summary["placements"] else "")
+        print(f"{result['strategy']:<14} {result['solver_passes']:7d} solver passes ({change:+.0%}), "
+              f"{result['solver_summary']['mean_passes']:6.1f} per iteration, {crowded}"
+              f"{result['final_cells']} cells, {result['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
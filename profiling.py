@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""Named timers and counters for profiling simulations.
+
+The Simulation and physical models time their stages with profiler.measure(name)
+and count work with profiler.count(name, amount). By default they use
+NULL_PROFILER, whose methods do nothing, so the instrumentation costs almost
+nothing unless a Profiler is passed in. A Profiler keeps a record of the time
+spent in each timer and the counter totals for every iteration, which can be
+exported as CSV or JSON, and the individual timings as a Chrome trace event
+file, which can be opened in chrome://tracing or https://ui.perfetto.dev to
+see which stage made an iteration slow.
+
+In the GUI, profiling is enabled by setting the CELL_ABM_PROFILE environment
+variable to the prefix of the files to export, e.g. CELL_ABM_PROFILE=profile
+writes profile.csv, profile.json and profile.trace.json when the simulation
+finishes.
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+
+# Setting this environment variable to a file prefix enables profiling in the GUI
+PROFILE_ENV_VAR = "CELL_ABM_PROFILE"
+
+
+class NullProfiler:
+    # Whether the profiler records anything
+    enabled = False
+
+    def measure(self, name):
+        """Returns a context manager that does nothing, in place of a timer."""
+        return NULL_TIMER
+
+    def count(self, name, amount=1):
+        """Does nothing, in place of adding to a counter."""
+        pass
+
+    def start_iteration(self, iteration):
+        """Does nothing, in place of starting an iteration's record."""
+        pass
+
+    def end_iteration(self):
+        """Does nothing, in place of finishing an iteration's record."""
+        pass
+
+
+class NullTimer:
+
+    def __enter__(self):
+        """Does nothing when the timed code starts."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        """Does nothing when the timed code ends, letting any exception propagate."""
+        return False
+
+
+NULL_TIMER = NullTimer()
+NULL_PROFILER = NullProfiler()
+
+
+class ProfilerTimer:
+    __slots__ = ("profiler", "name", "start_time")
+
+    def __init__(self, profiler, name):
+        """Constructs the necessary attributes for the ProfilerTimer object.
+
+        The timer is a context manager that adds the time the code inside it
+        takes to run to the profiler's timer with the given name.
+
+        Parameters
+        ----------
+        profiler : Profiler
+            the profiler to record the time in
+        name : string
+            the name of the timer
+        """
+        self.profiler = profiler
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        """Starts the timer."""
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        """Stops the timer and records the time, letting any exception propagate."""
+        self.profiler.add_time(self.name, self.start_time, time.perf_counter())
+        return False
+
+
+class Profiler:
+    # Whether the profiler records anything
+    enabled = True
+
+    def __init__(self):
+        """Constructs the necessary attributes for the Profiler object.
+
+        Other defined attributes
+        ------------------------
+        start_time : float
+            the performance counter time the profiler was created at, which the
+            trace event times are relative to
+        records : list
+            a dictionary for each finished iteration relating "iteration",
+            "seconds" and the total seconds ("<timer>_seconds") and number of
+            calls ("<timer>_calls") of each timer and each counter's total to
+            their values
+        trace_events : list
+            the Chrome trace events of each timing
+        iteration : int
+            the iteration being recorded, or None between iterations
+        iteration_start_time : float
+            the performance counter time the current iteration started at
+        timers : dict
+            a dictionary relating each timer name to its total seconds and calls
+            in the current iteration
+        counters : dict
+            a dictionary relating each counter name to its total in the current iteration
+        """
+        self.start_time = time.perf_counter()
+        self.records = []
+        self.trace_events = []
+        self.iteration = None
+        self.iteration_start_time = 0.0
+        self.timers = {}
+        self.counters = {}
+
+    def measure(self, name):
+        """Returns a context manager that times the code inside it.
+
+        Parameters
+        ----------
+        name : string
+            the name of the timer, e.g. the stage being timed
+        """
+        return ProfilerTimer(self, name)
+
+    def add_time(self, name, start_time, end_time):
+        """Adds a timing to the timer with the given name and to the trace events.
+
+        Parameters
+        ----------
+        name : string
+            the name of the timer
+        start_time : float
+            the performance counter time the timing started at
+        end_time : float
+            the performance counter time the timing ended at
+        """
+        seconds = end_time - start_time
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [seconds, 1]
+        else:
+            timer[0] += seconds
+            timer[1] += 1
+
+        self.trace_events.append({
+            "name": name, "cat": "simulation", "ph": "X",
+            "ts": (start_time - self.start_time) * 1e6, "dur": seconds * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "args": {"iteration": self.iteration}})
+
+    def count(self, name, amount=1):
+        """Adds an amount to the counter with the given name.
+
+        Parameters
+        ----------
+        name : string
+            the name of the counter, e.g. the work being counted
+        amount : int
+            the amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def start_iteration(self, iteration):
+        """Starts recording the timers and counters of a simulation iteration.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration
+        """
+        self.iteration = iteration
+        self.iteration_start_time = time.perf_counter()
+        self.timers = {}
+        self.counters = {}
+
+    def end_iteration(self):
+        """Finishes the record of the current iteration."""
+        if self.iteration is None:
+            return
+
+        end_time = time.perf_counter()
+        record = {"iteration": self.iteration, "seconds": end_time - self.iteration_start_time}
+        for name, (seconds, calls) in self.timers.items():
+            record[name + "_seconds"] = seconds
+            record[name + "_calls"] = calls
+        record.update(self.counters)
+        self.records.append(record)
+
+        self.trace_events.append({
+            "name": f"iteration {self.iteration}", "cat": "iteration", "ph": "X",
+            "ts": (self.iteration_start_time - self.start_time) * 1e6,
+            "dur": record["seconds"] * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident(),
+            "args": {"iteration": self.iteration}})
+        if self.counters:
+            self.trace_events.append({
+                "name": "counters", "ph": "C", "ts": (end_time - self.start_time) * 1e6,
+                "pid": os.getpid(), "args": dict(self.counters)})
+
+        self.iteration = None
+
+    def get_columns(self):
+        """Gets the names of the columns in the iteration records, in the order they first appear."""
+        columns = {}
+        for record in self.records:
+            columns.update(dict.fromkeys(record))
+        return list(columns)
+
+    def write_csv(self, csv_file):
+        """Writes the iteration records to a CSV file, with empty cells for timers not used in an iteration."""
+        with open(csv_file, "w", newline="") as f:
+            csvwriter = csv.DictWriter(f, fieldnames=self.get_columns(), restval="")
+            csvwriter.writeheader()
+            csvwriter.writerows(self.records)
+
+    def write_json(self, json_file):
+        """Writes the iteration records to a JSON file as a list of objects."""
+        with open(json_file, "w") as f:
+            json.dump(self.records, f, indent=1)
+
+    def write_chrome_trace(self, trace_file):
+        """Writes the timings as a Chrome trace event file."""
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, f)
+
+    def export(self, prefix):
+        """Writes the iteration records as CSV and JSON, and the timings as a Chrome trace.
+
+        Parameters
+        ----------
+        prefix : string
+            the file name prefix, which .csv, .json and .trace.json are added to
+
+        Returns
+        -------
+        list
+            the names of the written files
+        """
+        files = [prefix + ".csv", prefix + ".json", prefix + ".trace.json"]
+        self.write_csv(files[0])
+        self.write_json(files[1])
+        self.write_chrome_trace(files[2])
+        return files
+
+def get_profiler_from_env():
+    """Gets a Profiler if the PROFILE_ENV_VAR environment variable is set, otherwise NULL_PROFILER.
+
+    Returns
+    -------
+    profiler : Profiler / NullProfiler
+        the profiler to pass to the Simulation
+    prefix : string
+        the prefix of the files to export the profile to, or None if profiling is disabled
+    """
+    prefix = os.environ.get(PROFILE_ENV_VAR)
+    if not prefix:
+        return NULL_PROFILER, None
+    return Profiler(), prefix
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+# Add colours for normal and quiescent states of each implemented cell type class
+CELL_COLOURS = {"GenericCell": {"Normal": (0.6, 0.2, 0.2), "Quiescent": (0.7, 0.5, 0.5)},
+                "CancerousCell": {"Normal": (0.2, 0.4, 0.7), "Quiescent": (0.4, 0.6, 0.8)}}
+
+# Fraction of an occupancy grid voxel that must be filled with cell volume
+# for it to be treated as hiding the cells behind it
+OCCLUDER_FILL_FRACTION = 0.5
+# Maximum number of occupancy grid voxels along each side of the environment
+MAX_OCCUPANCY_GRID_SIZE = 128
+
+def build_render_arrays(iteration_arrays):
+    """Converts the cell data of an iteration into the arrays needed to draw it.
+
+    The colours are looked up for all cells at once from the cell type and
+    phase codes, rather than cell by cell.
+
+    Parameters
+    ----------
+    iteration_arrays : dict
+        the cell data arrays of the iteration, as returned by the get_iteration_arrays
+        function of the DataReader and IterationRingBuffer
+
+    Returns
+    -------
+    render_arrays : dict
+        "positions" (float32 Nx3), "radii" (float32 N) and "colours" (float32 Nx3)
+        of the N live cells, and the "live" mask over all cells in the iteration
+    """
+    live = ~np.asarray(iteration_arrays["is_dead"], dtype=bool)
+
+    # Look the colours up in a (cell type, quiescent) table using the type and phase codes
+    cell_type_names, type_codes = np.unique(
+        np.asarray(iteration_arrays["cell_type"], dtype=str), return_inverse=True)
+    quiescent_codes = (np.asarray(iteration_arrays["current_phase"], dtype=str) == "G0").astype(np.intp)
+    colour_table = np.array([[CELL_COLOURS[name]["Normal"], CELL_COLOURS[name]["Quiescent"]]
+                             for name in cell_type_names], dtype=np.float32).reshape(-1, 2, 3)
+
+    return {
+        "positions": np.ascontiguousarray(iteration_arrays["pos"][live], dtype=np.float32).reshape(-1, 3),
+        "radii": np.ascontiguousarray(iteration_arrays["radius"][live], dtype=np.float32),
+        "colours": colour_table[type_codes.ravel()[live], quiescent_codes[live]],
+        "live": live
+    }
+
+def get_unoccluded_cells(positions, radii, env_size):
+    """Finds the cells that may be visible from the camera in front of the environment.
+
+    The cells are binned into an occupancy grid with voxels about one cell across,
+    and a voxel is treated as opaque if its cells fill at least
+    OCCLUDER_FILL_FRACTION of it. The camera looks along the environment's z axis
+    with a narrow field of view, so a cell is hidden if the voxel in front of its
+    own, that voxel's four neighbours across the view and the next voxel towards
+    the camera are all opaque. The second layer covers the gaps that can be seen
+    between the cells of a single layer. Cells in the front two layers or at the
+    sides of the grid are always kept.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the environment coordinates of the cells, where z increases away from the camera
+    radii : numpy.ndarray(N)
+        the radius of each cell
+    env_size : float
+        the width of the environment
+
+    Returns
+    -------
+    numpy.ndarray(N)
+        a boolean mask of the cells that are not hidden behind other cells
+    """
+    if len(radii) == 0:
+        return np.ones(0, dtype=bool)
+
+    voxel_size = max(2 * float(np.median(radii)), env_size / MAX_OCCUPANCY_GRID_SIZE)
+    grid_size = int(np.ceil(env_size / voxel_size))
+    voxels = np.clip((positions / voxel_size).astype(np.intp), 0, grid_size - 1)
+    flat_voxels = np.ravel_multi_index(voxels.T, (grid_size,) * 3)
+
+    cell_volumes = (4 / 3) * np.pi * radii.astype(np.float64) ** 3
+    fill = np.bincount(flat_voxels, weights=cell_volumes, minlength=grid_size ** 3) / voxel_size ** 3
+    opaque = (fill >= OCCLUDER_FILL_FRACTION).reshape((grid_size,) * 3)
+
+    # Pad the sides and front of the grid with transparent voxels, so that index
+    # [x + 1, y + 1, z + 1] of the padded grid is the voxel in front of voxel [x, y, z]
+    opaque = np.pad(opaque, ((1, 1), (1, 1), (2, 0)), constant_values=False)
+    x, y, z = voxels[:, 0] + 1, voxels[:, 1] + 1, voxels[:, 2] + 1
+    hidden = (opaque[x, y, z] & opaque[x - 1, y, z] & opaque[x + 1, y, z]
+              & opaque[x, y - 1, z] & opaque[x, y + 1, z] & opaque[x, y, z - 1])
+
+    return ~hidden
+
+def get_empty_render_arrays():
+    """Gets render arrays with no cells, e.g. for an iteration that is not available."""
+    return {"positions": np.empty((0, 3), dtype=np.float32),
+            "radii": np.empty(0, dtype=np.float32),
+            "colours": np.empty((0, 3), dtype=np.float32),
+            "live": np.empty(0, dtype=bool)}
+
+def get_render_arrays_size(render_arrays):
+    """Gets the memory in bytes used by the arrays of an iteration."""
+    return sum(array.nbytes for array in render_arrays.values())
+
+
+class RenderArrayCache:
+    # Default limit on the memory held by the cached render arrays
+    DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+    def __init__(self, data_source, max_bytes=None, max_iterations=None):
+        """Constructs the necessary attributes for the RenderArrayCache object.
+
+        The cache converts each iteration's cell data into render arrays once,
+        and keeps the most recently used iterations so they can be redrawn
+        without being converted again. The least recently used iterations are
+        dropped when either limit is exceeded. It can be used from several
+        threads at once.
+
+        Parameters
+        ----------
+        data_source : DataReader / IterationRingBuffer
+            the object that the simulation data is read from
+        max_bytes : int
+            the maximum memory in bytes for the cached arrays, DEFAULT_MAX_BYTES if not given
+        max_iterations : int
+            an optional maximum number of iterations to cache
+
+        Other defined attributes
+        ------------------------
+        cache : collections.OrderedDict
+            the render arrays of each cached iteration, from least to most recently used
+        cached_bytes : int
+            the memory in bytes currently used by the cached arrays
+        lock : threading.Lock
+            the lock guarding the cache
+        """
+        self.data_source = data_source
+        self.max_bytes = max_bytes if max_bytes is not None else self.DEFAULT_MAX_BYTES
+        self.max_iterations = max_iterations
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+
+    def get_iteration(self, iteration):
+        """Gets the render arrays of the given iteration, converting them if they are not cached.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration to get the render arrays of
+
+        Returns
+        -------
+        dict
+            the render arrays of the iteration, or None if the data source does not hold it
+        """
+        with self.lock:
+            if iteration in self.cache:
+                self.cache.move_to_end(iteration)
+                return self.cache[iteration]
+
+        # The arrays are fetched once, as a live ring buffer can drop the iteration at any time
+        iteration_arrays = self.data_source.get_iteration_arrays(iteration)
+        if iteration_arrays is None:
+            return None
+
+        render_arrays = build_render_arrays(iteration_arrays)
+
+        with self.lock:
+            if iteration not in self.cache:
+                self.cache[iteration] = render_arrays
+                self.cached_bytes += get_render_arrays_size(render_arrays)
+                self.evict()
+        return render_arrays
+
+    def evict(self):
+        """Drops the least recently used iterations until the cache is within its limits.
+
+        The most recently used iteration is always kept. The lock must be held.
+        """
+        while len(self.cache) > 1 and (
+                self.cached_bytes > self.max_bytes
+                or (self.max_iterations is not None and len(self.cache) > self.max_iterations)):
+            _, render_arrays = self.cache.popitem(last=False)
+            self.cached_bytes -= get_render_arrays_size(render_arrays)
+
+    def clear(self):
+        """Drops all of the cached iterations."""
+        with self.lock:
+            self.cache.clear()
+            self.cached_bytes = 0
@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import numpy as np
+
+from OpenGL.GL import *
+
+# Per-vertex lighting matching the fixed function pipeline set up by the visualiser
+# (global ambient light, one positional diffuse light and colour material)
+VERTEX_SHADER = """
+#version 120
+
+attribute vec3 vertex;
+attribute vec4 instance_sphere;
+attribute vec3 instance_colour;
+
+uniform vec3 light_position;
+uniform float light_diffuse;
+uniform float ambient;
+
+varying vec3 colour;
+
+void main()
+{
+    vec4 eye_position = gl_ModelViewMatrix * vec4(instance_sphere.xyz + vertex * instance_sphere.w, 1.0);
+    vec3 normal = normalize(gl_NormalMatrix * vertex);
+    vec3 light_direction = normalize(light_position - eye_position.xyz);
+    float diffuse = max(dot(normal, light_direction), 0.0);
+
+    colour = min(instance_colour * (ambient + light_diffuse * diffuse), 1.0);
+    gl_Position = gl_ProjectionMatrix * eye_position;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 120
+
+varying vec3 colour;
+
+void main()
+{
+    gl_FragColor = vec4(colour, 1.0);
+}
+"""
+
+# Shades each point sprite as a sphere, so distant cells covering only a few
+# pixels can be drawn as a single point rather than a tessellated mesh
+IMPOSTOR_VERTEX_SHADER = """
+#version 120
+
+attribute vec4 instance_sphere;
+attribute vec3 instance_colour;
+
+uniform float pixels_per_unit;
+
+varying vec3 colour;
+varying vec3 eye_centre;
+varying float radius;
+
+void main()
+{
+    vec4 eye_position = gl_ModelViewMatrix * vec4(instance_sphere.xyz, 1.0);
+    eye_centre = eye_position.xyz;
+    radius = instance_sphere.w;
+    colour = instance_colour;
+
+    gl_PointSize = max(2.0 * pixels_per_unit * radius / -eye_position.z, 1.0);
+    gl_Position = gl_ProjectionMatrix * eye_position;
+}
+"""
+
+IMPOSTOR_FRAGMENT_SHADER = """
+#version 120
+
+uniform vec3 light_position;
+uniform float light_diffuse;
+uniform float ambient;
+
+varying vec3 colour;
+varying vec3 eye_centre;
+varying float radius;
+
+void main()
+{
+    // Point coordinates run from the top left of the sprite
+    vec2 offset = vec2(gl_PointCoord.x * 2.0 - 1.0, 1.0 - gl_PointCoord.y * 2.0);
+    float distance_squared = dot(offset, offset);
+    if (distance_squared > 1.0)
+        discard;
+
+    vec3 normal = vec3(offset, sqrt(1.0 - distance_squared));
+    vec3 eye_position = eye_centre + normal * radius;
+    vec3 light_direction = normalize(light_position - eye_position);
+    float diffuse = max(dot(normal, light_direction), 0.0);
+
+    // Write the depth of the sphere's surface so impostors intersect meshes correctly
+    vec4 clip_position = gl_ProjectionMatrix * vec4(eye_position, 1.0);
+    gl_FragDepth = 0.5 * clip_position.z / clip_position.w + 0.5;
+    gl_FragColor = vec4(min(colour * (ambient + light_diffuse * diffuse), 1.0), 1.0);
+}
+"""
+
+def build_sphere_mesh(slices, stacks):
+    """Tessellates a unit sphere centred on the origin.
+
+    As the sphere has unit radius, each vertex position is also its normal.
+
+    Parameters
+    ----------
+    slices : int
+        the number of subdivisions around the z axis (like lines of longitude)
+    stacks : int
+        the number of subdivisions along the z axis (like lines of latitude)
+
+    Returns
+    -------
+    vertices : numpy.ndarray((stacks+1) * (slices+1), 3)
+        the float32 vertex positions of the sphere
+    indices : numpy.ndarray(slices * stacks * 6)
+        the uint32 vertex indices of the sphere's triangles
+    """
+    theta = np.linspace(0, np.pi, stacks + 1, dtype=np.float32)
+    phi = np.linspace(0, 2 * np.pi, slices + 1, dtype=np.float32)
+    theta, phi = np.meshgrid(theta, phi, indexing="ij")
+
+    vertices = np.stack([np.sin(theta) * np.cos(phi),
+                         np.sin(theta) * np.sin(phi),
+                         np.cos(theta)], axis=-1).reshape(-1, 3).astype(np.float32)
+
+    # Two triangles for each quad between neighbouring stacks and slices
+    stack_indices, slice_indices = np.meshgrid(np.arange(stacks), np.arange(slices), indexing="ij")
+    top_left = (stack_indices * (slices + 1) + slice_indices).ravel()
+    top_right = top_left + 1
+    bottom_left = top_left + slices + 1
+    bottom_right = bottom_left + 1
+    indices = np.stack([top_left, bottom_left, top_right,
+                        top_right, bottom_left, bottom_right], axis=-1).ravel().astype(np.uint32)
+
+    return vertices, indices
+
+def compile_shader_program(vertex_source, fragment_source, attribute_locations):
+    """Compiles and links a shader program.
+
+    Parameters
+    ----------
+    vertex_source : string
+        the GLSL source of the vertex shader
+    fragment_source : string
+        the GLSL source of the fragment shader
+    attribute_locations : dict
+        a dictionary relating the vertex attribute names to the locations to bind them to
+
+    Returns
+    -------
+    int
+        the name of the linked shader program
+    """
+    program = glCreateProgram()
+    shader_list = []
+    for shader_type, source in ((GL_VERTEX_SHADER, vertex_source),
+                                (GL_FRAGMENT_SHADER, fragment_source)):
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError(glGetShaderInfoLog(shader))
+        glAttachShader(program, shader)
+        shader_list.append(shader)
+
+    for name, location in attribute_locations.items():
+        glBindAttribLocation(program, location, name)
+
+    glLinkProgram(program)
+    for shader in shader_list:
+        glDeleteShader(shader)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError(glGetProgramInfoLog(program))
+
+    return program
+
+
+class SphereRenderer:
+    # Sphere tessellations from finest to coarsest as (slices, stacks)
+    MESH_RESOLUTIONS = ((32, 16), (16, 8), (8, 4))
+    # The smallest projected radius in pixels that each mesh resolution is used for
+    LOD_PIXEL_RADII = (16.0, 6.0, 0.0)
+    # Cells with a smaller projected radius in pixels are drawn as impostors, if enabled
+    IMPOSTOR_PIXEL_RADIUS = 3.0
+    # Meshes are made coarser until the total triangles for all cells fit within this budget
+    TRIANGLE_BUDGET = 1500000
+    # Limits and step size of the detail scale when adjusting it to a target frame time
+    MIN_DETAIL_SCALE = 0.125
+    DETAIL_ADJUST_RATE = 1.25
+    # Weight of the latest frame time in the smoothed frame time
+    FRAME_TIME_SMOOTHING = 0.3
+    AMBIENT = 0.8
+    LIGHT_DIFFUSE = 0.7
+
+    VERTEX_LOCATION = 0
+    INSTANCE_SPHERE_LOCATION = 1
+    INSTANCE_COLOUR_LOCATION = 2
+
+    def __init__(self):
+        """Constructs the necessary attributes for the SphereRenderer object.
+
+        The renderer tessellates the unit sphere meshes once, and draws the cells
+        with one instanced draw call per mesh resolution, using the cell positions,
+        radii and colours as per-instance attributes. Each cell is drawn with the
+        mesh resolution for its projected size on screen, and if impostors are
+        enabled, the smallest cells are drawn as shaded point sprites. It only needs
+        OpenGL 2.1 with instanced arrays, which software rasterisers such as Mesa
+        llvmpipe support. If instancing is not available, the cached meshes are
+        drawn once per cell with the fixed function pipeline instead.
+
+        The initialise method must be called with the OpenGL context current
+        before anything is drawn, and set_projection whenever the view is resized.
+
+        Other defined attributes
+        ------------------------
+        meshes : list
+            a list of (vertices, indices) array pairs for each mesh resolution
+        mesh_buffers : list
+            a list of (vertex buffer, index buffer, index count) for each mesh
+        instance_buffer : int
+            the buffer that the per-instance attributes are streamed into
+        program : int
+            the instancing shader program, or None if instancing is not available
+        impostor_program : int
+            the impostor shader program, or None if it is not available
+        initialised : bool
+            whether the OpenGL objects have been created
+        pixels_per_unit : float
+            the projected size in pixels of a unit length at unit distance from the camera
+        use_impostors : bool
+            whether cells smaller than IMPOSTOR_PIXEL_RADIUS are drawn as impostors
+        detail_scale : float
+            the factor applied to the projected sizes when choosing the level of
+            detail, lowered to draw coarser meshes when frames take too long
+        smoothed_frame_time : float
+            the exponentially smoothed time taken to draw recent frames
+        """
+        self.meshes = [build_sphere_mesh(slices, stacks) for slices, stacks in self.MESH_RESOLUTIONS]
+        self.mesh_buffers = []
+        self.instance_buffer = None
+        self.program = None
+        self.impostor_program = None
+        self.initialised = False
+
+        self.pixels_per_unit = 1000.0
+        self.use_impostors = False
+        self.detail_scale = 1.0
+        self.smoothed_frame_time = None
+
+    def initialise(self, light_position):
+        """Creates the buffers and shader program in the current OpenGL context.
+
+        Parameters
+        ----------
+        light_position : list
+            the xyz position of the light in eye coordinates
+        """
+        for vertices, indices in self.meshes:
+            vertex_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+            glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+
+            index_buffer = glGenBuffers(1)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+
+            self.mesh_buffers.append((vertex_buffer, index_buffer, len(indices)))
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+        self.instance_buffer = glGenBuffers(1)
+
+        if bool(glDrawElementsInstanced) and bool(glVertexAttribDivisor):
+            try:
+                self.program = compile_shader_program(VERTEX_SHADER, FRAGMENT_SHADER, {
+                    "vertex": self.VERTEX_LOCATION,
+                    "instance_sphere": self.INSTANCE_SPHERE_LOCATION,
+                    "instance_colour": self.INSTANCE_COLOUR_LOCATION
+                })
+            except RuntimeError:
+                self.program = None
+
+            # The impostors' sphere attributes take location 0, which must always be in use
+            try:
+                self.impostor_program = compile_shader_program(
+                    IMPOSTOR_VERTEX_SHADER, IMPOSTOR_FRAGMENT_SHADER, {
+                        "instance_sphere": self.VERTEX_LOCATION,
+                        "instance_colour": self.INSTANCE_COLOUR_LOCATION
+                    })
+            except RuntimeError:
+                self.impostor_program = None
+
+        for program in (self.program, self.impostor_program):
+            if program is not None:
+                glUseProgram(program)
+                glUniform3f(glGetUniformLocation(program, "light_position"), *light_position[:3])
+                glUniform1f(glGetUniformLocation(program, "light_diffuse"), self.LIGHT_DIFFUSE)
+                glUniform1f(glGetUniformLocation(program, "ambient"), self.AMBIENT)
+                glUseProgram(0)
+
+        self.initialised = True
+
+    def release(self):
+        """Deletes the OpenGL objects. The renderer's context must be current."""
+        if not self.initialised:
+            return
+        for vertex_buffer, index_buffer, _ in self.mesh_buffers:
+            glDeleteBuffers(2, [vertex_buffer, index_buffer])
+        glDeleteBuffers(1, [self.instance_buffer])
+        for program in (self.program, self.impostor_program):
+            if program is not None:
+                glDeleteProgram(program)
+
+        self.mesh_buffers = []
+        self.instance_buffer = None
+        self.program = None
+        self.impostor_program = None
+        self.initialised = False
+
+    def set_projection(self, viewport_height, field_of_view):
+        """Sets the camera projection used to estimate the cells' sizes on screen.
+
+        Parameters
+        ----------
+        viewport_height : float
+            the height of the view in pixels
+        field_of_view : float
+            the vertical field of view of the camera in degrees
+        """
+        self.pixels_per_unit = viewport_height / (2 * np.tan(np.radians(field_of_view) / 2))
+
+    def adjust_detail(self, frame_time, target_frame_time):
+        """Adjusts the level of detail to bring the frame time towards a target.
+
+        The detail is lowered while the smoothed frame time is over the target,
+        and raised again while it is well under the target.
+
+        Parameters
+        ----------
+        frame_time : float
+            the time in seconds taken to draw the latest frame
+        target_frame_time : float
+            the time in seconds that each frame should take at most
+
+        Returns
+        -------
+        float
+            the new detail scale
+        """
+        if self.smoothed_frame_time is None:
+            self.smoothed_frame_time = frame_time
+        else:
+            self.smoothed_frame_time += self.FRAME_TIME_SMOOTHING * (frame_time - self.smoothed_frame_time)
+
+        if self.smoothed_frame_time > target_frame_time:
+            self.detail_scale = max(self.detail_scale / self.DETAIL_ADJUST_RATE, self.MIN_DETAIL_SCALE)
+        elif self.smoothed_frame_time < 0.5 * target_frame_time:
+            self.detail_scale = min(self.detail_scale * self.DETAIL_ADJUST_RATE, 1.0)
+
+        return self.detail_scale
+
+    def reset_detail(self):
+        """Returns to the full level of detail, e.g. when playback is paused."""
+        self.detail_scale = 1.0
+        self.smoothed_frame_time = None
+
+    def get_detail_levels(self, centres, radii):
+        """Chooses how to draw each sphere from its projected radius in pixels.
+
+        Parameters
+        ----------
+        centres : numpy.ndarray(N, 3)
+            the centre of each sphere in world space
+        radii : numpy.ndarray(N)
+            the radius of each sphere
+
+        Returns
+        -------
+        levels : numpy.ndarray(N)
+            the index of the mesh resolution to draw each sphere with, or
+            len(MESH_RESOLUTIONS) for spheres to draw as impostors
+        """
+        # OpenGL matrices are column major, so the third column gives the eye space z coordinates
+        modelview = np.asarray(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float32).reshape(4, 4)
+        depths = np.maximum(-(centres @ modelview[:3, 2] + modelview[3, 2]), 1e-6)
+        pixel_radii = radii * (self.pixels_per_unit * self.detail_scale) / depths
+
+        num_meshes = len(self.meshes)
+        levels = np.full(len(radii), num_meshes - 1, dtype=np.intp)
+        for i in reversed(range(num_meshes - 1)):
+            levels[pixel_radii >= self.LOD_PIXEL_RADII[i]] = i
+
+        # Coarsen the meshes until the frame fits within the triangle budget
+        triangles_per_mesh = np.array([len(indices) // 3 for _, indices in self.meshes])
+        while levels.min() < num_meshes - 1 and triangles_per_mesh[levels].sum() > self.TRIANGLE_BUDGET:
+            levels = np.minimum(levels + 1, num_meshes - 1)
+
+        if self.use_impostors and self.impostor_program is not None:
+            levels[pixel_radii < self.IMPOSTOR_PIXEL_RADIUS] = num_meshes
+
+        return levels
+
+    def draw(self, centres, radii, colours):
+        """Draws spheres with the given world space centres, radii and colours.
+
+        Parameters
+        ----------
+        centres : numpy.ndarray(N, 3)
+            the centre of each sphere in world space
+        radii : numpy.ndarray(N)
+            the radius of each sphere
+        colours : numpy.ndarray(N, 3)
+            the RGB colour of each sphere
+        """
+        num_spheres = len(radii)
+        if num_spheres == 0:
+            return
+
+        levels = self.get_detail_levels(centres, radii)
+
+        if self.program is None:
+            for level, (vertex_buffer, index_buffer, index_count) in enumerate(self.mesh_buffers):
+                at_level = levels == level
+                if at_level.any():
+                    self.draw_per_sphere(vertex_buffer, index_buffer, index_count,
+                                         centres[at_level], radii[at_level], colours[at_level])
+            return
+
+        # Sort the spheres by level so each level is a contiguous range of the instance buffer
+        order = np.argsort(levels, kind="stable")
+        level_counts = np.bincount(levels, minlength=len(self.meshes) + 1)
+        self.upload_instance_data(centres[order], radii[order], colours[order])
+
+        first = 0
+        for level, count in enumerate(level_counts.tolist()):
+            if count == 0:
+                continue
+            if level < len(self.mesh_buffers):
+                self.draw_instanced(*self.mesh_buffers[level], first, count)
+            else:
+                self.draw_impostors(first, count)
+            first += count
+
+    def upload_instance_data(self, centres, radii, colours):
+        """Streams the per-instance attributes of the spheres into the instance buffer."""
+        # Interleave the per-instance attributes as [x, y, z, radius, r, g, b]
+        instance_data = np.empty((len(radii), 7), dtype=np.float32)
+        instance_data[:, :3] = centres
+        instance_data[:, 3] = radii
+        instance_data[:, 4:] = colours
+
+        # Orphan the previous instance data so the driver does not have to wait for it
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glBufferData(GL_ARRAY_BUFFER, instance_data.nbytes, instance_data, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw_instanced(self, vertex_buffer, index_buffer, index_count, first, count):
+        """Draws a range of the spheres in the instance buffer in one instanced draw call."""
+        instance_stride = 7 * 4
+        instance_offset = first * instance_stride
+
+        glUseProgram(self.program)
+
+        glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+        glEnableVertexAttribArray(self.VERTEX_LOCATION)
+        glVertexAttribPointer(self.VERTEX_LOCATION, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glEnableVertexAttribArray(self.INSTANCE_SPHERE_LOCATION)
+        glVertexAttribPointer(self.INSTANCE_SPHERE_LOCATION, 4, GL_FLOAT, GL_FALSE,
+                              instance_stride, ctypes.c_void_p(instance_offset))
+        glVertexAttribDivisor(self.INSTANCE_SPHERE_LOCATION, 1)
+        glEnableVertexAttribArray(self.INSTANCE_COLOUR_LOCATION)
+        glVertexAttribPointer(self.INSTANCE_COLOUR_LOCATION, 3, GL_FLOAT, GL_FALSE,
+                              instance_stride, ctypes.c_void_p(instance_offset + 16))
+        glVertexAttribDivisor(self.INSTANCE_COLOUR_LOCATION, 1)
+
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+        glDrawElementsInstanced(GL_TRIANGLES, index_count, GL_UNSIGNED_INT,
+                                ctypes.c_void_p(0), count)
+
+        # Restore the state used by the fixed function drawing
+        glVertexAttribDivisor(self.INSTANCE_SPHERE_LOCATION, 0)
+        glVertexAttribDivisor(self.INSTANCE_COLOUR_LOCATION, 0)
+        glDisableVertexAttribArray(self.VERTEX_LOCATION)
+        glDisableVertexAttribArray(self.INSTANCE_SPHERE_LOCATION)
+        glDisableVertexAttribArray(self.INSTANCE_COLOUR_LOCATION)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+
+    def draw_impostors(self, first, count):
+        """Draws a range of the spheres in the instance buffer as shaded point sprites."""
+        instance_stride = 7 * 4
+
+        glUseProgram(self.impostor_program)
+        glUniform1f(glGetUniformLocation(self.impostor_program, "pixels_per_unit"), self.pixels_per_unit)
+        glEnable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        glEnable(GL_POINT_SPRITE)
+
+        # Each sphere is one point, so the instance attributes are used as vertex attributes
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glEnableVertexAttribArray(self.VERTEX_LOCATION)
+        glVertexAttribPointer(self.VERTEX_LOCATION, 4, GL_FLOAT, GL_FALSE,
+                              instance_stride, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(self.INSTANCE_COLOUR_LOCATION)
+        glVertexAttribPointer(self.INSTANCE_COLOUR_LOCATION, 3, GL_FLOAT, GL_FALSE,
+                              instance_stride, ctypes.c_void_p(16))
+
+        glDrawArrays(GL_POINTS, first, count)
+
+        glDisableVertexAttribArray(self.VERTEX_LOCATION)
+        glDisableVertexAttribArray(self.INSTANCE_COLOUR_LOCATION)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisable(GL_POINT_SPRITE)
+        glDisable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        glUseProgram(0)
+
+    def draw_per_sphere(self, vertex_buffer, index_buffer, index_count, centres, radii, colours):
+        """Draws the cached mesh once per sphere with the fixed function pipeline."""
+        glEnable(GL_NORMALIZE)
+        glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, 0, ctypes.c_void_p(0))
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+
+        for centre, radius, colour in zip(centres.tolist(), radii.tolist(), colours.tolist()):
+            glPushMatrix()
+            glTranslatef(*centre)
+            glScalef(radius, radius, radius)
+            glColor4f(colour[0], colour[1], colour[2], 1)
+            glDrawElements(GL_TRIANGLES, index_count, GL_UNSIGNED_INT, ctypes.c_void_p(0))
+            glPopMatrix()
+
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glDisable(GL_NORMALIZE)
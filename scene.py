@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from OpenGL.GL import *
+from OpenGL.GLU import *
+
+from render_data import get_unoccluded_cells
+from renderer import SphereRenderer
+import utils
+
+class Scene:
+    # Vertical field of view of the camera in degrees
+    FIELD_OF_VIEW = 20
+    BACKGROUND_COLOUR = (1, 1, 1, 1)
+    BORDER_COLOUR = (0.4, 0.4, 0.4, 1)
+    AMBIENT = [0.8, 0.8, 0.8, 1.0]
+    LIGHT_DIFFUSE = [0.7, 0.7, 0.7, 1.0]
+
+    # Define 12 edges for the environment borders
+    env_edges = (
+        (0,1), (1,2), (2,3), (3,0),
+        (4,5), (5,6), (6,7), (7,4),
+        (0,4), (1,5), (2,6), (3,7)
+    )
+
+    def __init__(self, env_size):
+        """Constructs the necessary attributes for the Scene object.
+
+        The scene holds the OpenGL state, camera and drawing code shared by the
+        Visualiser widget and the video exports, and does not depend on Qt, so
+        it can be drawn in any OpenGL context, including offscreen ones.
+
+        Parameters
+        ----------
+        env_size : float
+            the width of the environment to be visualised
+
+        Other defined attributes
+        ------------------------
+        env_origin : list
+            the x, y and z coordinates of the environment origin
+        z_near : float
+            the z coordinate of the near side of the environment in the world space
+        z_far : float
+            the z coordinate of the far side of the environment in the world space
+        env_vertices : tuple
+            a tuple of 8 xyz coordinate tuples of the environment corners
+        sphere_renderer : SphereRenderer
+            the renderer that draws the cells, created by initialise_gl
+        cull_hidden_cells : bool
+            whether cells hidden behind densely packed cells are left out of the drawing
+        clip_depth : float
+            the depth into the environment of the cross-section plane, in front of
+            which cells are not drawn, or None to draw the whole environment
+        drawn_cells : tuple
+            the render arrays, culling options and mask of the cells drawn in the
+            last frame, reused while they are unchanged
+        """
+        self.env_size = env_size
+        self.env_origin, self.z_near, self.z_far, self.env_vertices = self.get_env_coords()
+        self.sphere_renderer = None
+
+        self.cull_hidden_cells = False
+        self.clip_depth = None
+        self.drawn_cells = None
+
+    def get_env_coords(self):
+        """Gets coordinates relating to the environment position in the world space.
+
+        Returns
+        -------
+        env_origin : list
+            the x, y and z coordinates of the environment origin
+        z_near : float
+            the z coordinate of the near side of the environment in the world space
+        z_far : float
+            the z coordinate of the far side of the environment in the world space
+        env_vertices : tuple
+            a tuple of 8 xyz coordinate tuples of the environment corners
+        """
+
+        half_env_size = self.env_size / 2.0
+
+        # Gets z coordinates to place environment in world space needed
+        # for it to be in full view of the camera
+        z_near = -(half_env_size * 1.05) / utils.TAN_10_DEGREES
+        z_far = z_near - self.env_size
+
+        env_origin = [-half_env_size, -half_env_size, z_near]
+        env_vertices = (
+            (-half_env_size, -half_env_size, z_near),
+            (half_env_size, -half_env_size, z_near),
+            (half_env_size, half_env_size, z_near),
+            (-half_env_size, half_env_size, z_near),
+            (-half_env_size, -half_env_size, z_far),
+            (half_env_size, -half_env_size, z_far),
+            (half_env_size, half_env_size, z_far),
+            (-half_env_size, half_env_size, z_far),
+        )
+
+        return env_origin, z_near, z_far, env_vertices
+
+    def get_light_position(self):
+        """Gets the position of the scene's light in eye coordinates.
+
+        Returns
+        -------
+        list
+            the homogeneous xyzw position of the light
+        """
+        light_z_pos = self.z_near + 2 * self.env_size
+        return [self.env_size, self.env_size, light_z_pos, 1.0]
+
+    def initialise_gl(self):
+        """Sets the OpenGL options, lighting and materials, and uploads the sphere meshes.
+
+        This must be called once in each OpenGL context the scene is drawn in,
+        while that context is current.
+        """
+        glEnable(GL_DEPTH_TEST)
+        glDepthFunc(GL_LEQUAL)
+
+        glEnable(GL_LIGHTING)
+        glLightModelfv(GL_LIGHT_MODEL_AMBIENT, self.AMBIENT)
+
+        # Enable light number 0
+        glEnable(GL_LIGHT0)
+
+        # Set position and intensity of light
+        glLightfv(GL_LIGHT0, GL_POSITION, self.get_light_position())
+        glLightfv(GL_LIGHT0, GL_DIFFUSE, self.LIGHT_DIFFUSE)
+
+        # Set up the cell material
+        glEnable(GL_COLOR_MATERIAL)
+        glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
+        glShadeModel(GL_SMOOTH)
+
+        self.sphere_renderer = SphereRenderer()
+        self.sphere_renderer.initialise(self.get_light_position())
+
+    def release_gl(self):
+        """Frees the OpenGL objects created by initialise_gl, while the context is current."""
+        if self.sphere_renderer is not None:
+            self.sphere_renderer.release()
+            self.sphere_renderer = None
+
+    def resize(self, width, height):
+        """Sets the camera projection so the environment is in view at the given aspect ratio.
+
+        The viewport is left to the caller, as Qt sets it for its widgets.
+
+        Parameters
+        ----------
+        width : float
+            the width of the view
+        height : float
+            the height of the view
+        """
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        gluPerspective(self.FIELD_OF_VIEW, width / height, -self.z_near * 0.95, -self.z_far * 1.05)
+
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+
+        if self.sphere_renderer is not None:
+            self.sphere_renderer.set_projection(height, self.FIELD_OF_VIEW)
+
+    def draw(self, render_arrays):
+        """Clears the view and draws the cells and the environment border.
+
+        Parameters
+        ----------
+        render_arrays : dict
+            the render arrays of the iteration to draw, as built by build_render_arrays
+        """
+        # Clear the screen
+        glClearColor(*self.BACKGROUND_COLOUR)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+        # Draw cells and environment
+        glEnable(GL_LIGHTING)
+        self.draw_cells(render_arrays)
+        glDisable(GL_LIGHTING)
+        self.draw_environment_border()
+
+    def draw_cells(self, render_arrays):
+        """Draws spheres with the positions, radii and colours of the given cells.
+
+        Parameters
+        ----------
+        render_arrays : dict
+            the render arrays of the iteration to draw, as built by build_render_arrays
+        """
+        positions = render_arrays["positions"]
+        radii = render_arrays["radii"]
+        colours = render_arrays["colours"]
+
+        if self.cull_hidden_cells or self.clip_depth is not None:
+            drawn = self.get_drawn_cells(render_arrays)
+            positions, radii, colours = positions[drawn], radii[drawn], colours[drawn]
+
+        # Move the cells into the world space, where the environment's z axis points into the screen
+        centres = self.env_origin + positions * np.array([1, 1, -1], dtype=np.float32)
+
+        self.sphere_renderer.draw(centres.astype(np.float32), radii, colours)
+
+    def get_drawn_cells(self, render_arrays):
+        """Finds the cells behind the cross-section plane that may be visible from the camera.
+
+        The result is kept and reused while the same iteration is redrawn with
+        the same options, e.g. while playback is paused.
+
+        Parameters
+        ----------
+        render_arrays : dict
+            the render arrays of the iteration to draw, as built by build_render_arrays
+
+        Returns
+        -------
+        numpy.ndarray(N)
+            a boolean mask of the cells to draw
+        """
+        options = (self.cull_hidden_cells, self.clip_depth)
+        if (self.drawn_cells is not None and self.drawn_cells[0] is render_arrays
+                and self.drawn_cells[1] == options):
+            return self.drawn_cells[2]
+
+        positions = render_arrays["positions"]
+        drawn = np.ones(len(positions), dtype=bool)
+
+        # The cells cut away by the cross-section plane are removed before culling,
+        # so the cells just behind the plane are visible
+        if self.clip_depth is not None:
+            drawn &= positions[:, 2] >= self.clip_depth
+
+        if self.cull_hidden_cells:
+            drawn[drawn] = get_unoccluded_cells(positions[drawn], render_arrays["radii"][drawn],
+                                                self.env_size)
+
+        self.drawn_cells = (render_arrays, options, drawn)
+        return drawn
+
+    def draw_environment_border(self):
+        """Draws the environment.
+
+        Draws lines between each of the environment vertices to form the
+        environment borders.
+        """
+        glBegin(GL_LINES)
+        glColor4f(*self.BORDER_COLOUR)
+        for edge in self.env_edges:
+            for vertex in edge:
+                glVertex3fv(self.env_vertices[vertex])
+        glEnd()
+
+        # Outline the cross-section plane
+        if self.clip_depth is not None:
+            clip_z = self.z_near - self.clip_depth
+            glBegin(GL_LINE_LOOP)
+            for x, y, _ in self.env_vertices[:4]:
+                glVertex3f(x, y, clip_z)
+            glEnd()
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Chooses the initial positions of the cells seeded in a simulation.
+
+By default the initial cells are dropped uniformly at random across the
+environment, as they always have been, and the first overlap solve untangles
+them. With thousands of seeds in a small environment that first solve is the
+most expensive step of a simulation and can stop at its iteration limit with
+overlap left. The other strategies place each seed clear of every cell
+already seeded, checked against a SpatialGrid, so the first solve has nothing
+to do:
+- "poisson_disk" draws uniform random positions, rejecting any that overlap a
+  seeded cell, for up to MAX_ATTEMPTS draws per cell, then fills the gaps left
+  with Bridson's sampling, drawing positions beside an active list of seeded
+  cells and retiring the cells with no space left beside them
+- "lattice" spreads the cells over a cubic lattice filling the environment,
+  taking its sites in random order and jittering each cell within its site
+- "colony" packs the cells into a spherical colony around a centre (the centre
+  of the environment by default), from the lattice sites nearest the centre
+
+The strategy is chosen per cell type with Simulation(..., seeding=...), as
+either one strategy for every cell type or a list with a strategy for each.
+A seed that cannot be placed clear of the others, even on the free sites of
+the densest lattice, as the environment is too full, falls back to the least
+overlapping random position found and is counted in the summary.
+
+The time of the initial seeding and first solve can be compared for each
+strategy:
+
+Usage: python seeding.py [--cells 2000] [--env-size 300] [--solver clusters]
+                         [--strategies random,poisson_disk,lattice,colony]
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from spatial import SpatialGrid
+import utils
+
+# Strategies for seeding the initial cells
+SEEDING_STRATEGIES = ("random", "poisson_disk", "lattice", "colony")
+
+
+def get_seeding_strategies(seeding, num_cell_types):
+    """Gets the seeding strategy of each cell type.
+
+    Parameters
+    ----------
+    seeding : string / list
+        a strategy from SEEDING_STRATEGIES for every cell type, or a list of
+        the strategy of each cell type
+    num_cell_types : int
+        the number of cell types in the simulation
+
+    Returns
+    -------
+    list
+        the seeding strategy of each cell type
+    """
+    strategies = [seeding] * num_cell_types if isinstance(seeding, str) else list(seeding)
+    if len(strategies) != num_cell_types:
+        raise ValueError(f"Expected a seeding strategy for each of the {num_cell_types} cell types, "
+                         f"got {len(strategies)}")
+    for strategy in strategies:
+        if strategy not in SEEDING_STRATEGIES:
+            raise ValueError(f"Unknown seeding strategy: {strategy}")
+    return strategies
+
+
+class InitialSeeding:
+    # Number of uniform random positions drawn for a seed, and of positions drawn beside an active seed
+    MAX_ATTEMPTS = 30
+    # Width of the shell beside an active seed that Bridson's sampling draws positions in,
+    # in contact distances, which is narrow so the cells are packed densely
+    BRIDSON_SHELL_WIDTH = 0.1
+    # Spacing of the colony lattice sites, in seed diameters of the largest cell type
+    COLONY_SPACING_SCALE = 1.1
+
+    def __init__(self, env_size, cell_types, initial_cell_nums, seeding="random", colony_centre=None):
+        """Constructs the necessary attributes for the InitialSeeding object.
+
+        Parameters
+        ----------
+        env_size : float
+            the width of the environment
+        cell_types : list
+            the cell type classes seeded in the simulation
+        initial_cell_nums : list
+            the number of cells of each cell type seeded
+        seeding : string / list
+            a strategy from SEEDING_STRATEGIES for every cell type, or a list of
+            the strategy of each cell type
+        colony_centre : numpy.ndarray(3)
+            the centre of the colony seeded by the colony strategy, the centre
+            of the environment if not given
+
+        Other defined attributes
+        ------------------------
+        strategies : list
+            the seeding strategy of each cell type
+        max_radius : float
+            the seed radius of the largest cell type, which the lattice sites
+            are spaced for
+        grid : SpatialGrid
+            the grid of the cells seeded so far
+        positions : list
+            the position of each cell seeded so far, indexed by the grid
+        radii : list
+            the radius of each cell seeded so far, indexed by the grid
+        active_seeds : list
+            the indices of the seeded cells that may still have space beside
+            them for Poisson-disk sampling
+        lattice_sites : numpy.ndarray(N, 3)
+            the shuffled sites of the lattice strategy
+        lattice_jitter : float
+            the distance a lattice seed can be moved from its site along each axis
+        colony_sites : numpy.ndarray(N, 3)
+            the shuffled sites of the colony strategy
+        colony_jitter : float
+            the distance a colony seed can be moved from its site along each axis
+        fallback_sites : numpy.ndarray(N, 3)
+            the shuffled sites of the densest lattice that fits the largest
+            cells, tried when no other clear position is found, or None until
+            they are first needed
+        fallback_jitter : float
+            the distance a seed can be moved from its fallback site along each axis
+        next_sites : dict
+            the index of the next unused site of the lattice and colony
+            strategies and of the fallback sites
+        overlapping_seeds : int
+            the number of seeds that could not be placed clear of the others
+        """
+        self.env_size = env_size
+        self.cell_types = cell_types
+        self.strategies = get_seeding_strategies(seeding, len(cell_types))
+        self.max_radius = max((cell_type.SEED_RADIUS for cell_type in cell_types), default=0.0)
+        self.grid = SpatialGrid(max(2 * self.max_radius, 1.0))
+        self.positions = []
+        self.radii = []
+        self.active_seeds = []
+        self.overlapping_seeds = 0
+
+        strategy_counts = {strategy: 0 for strategy in SEEDING_STRATEGIES}
+        for strategy, num_cells in zip(self.strategies, initial_cell_nums):
+            strategy_counts[strategy] += num_cells
+
+        # The sites are set up only for the strategies used, so random seeding
+        # draws the same numbers as before
+        self.lattice_sites, self.lattice_jitter = np.empty((0, 3)), 0.0
+        if strategy_counts["lattice"]:
+            self.lattice_sites, self.lattice_jitter = self.get_lattice_sites(strategy_counts["lattice"])
+        self.colony_sites, self.colony_jitter = np.empty((0, 3)), 0.0
+        if strategy_counts["colony"]:
+            if colony_centre is None:
+                colony_centre = np.full(3, env_size / 2)
+            self.colony_sites, self.colony_jitter = self.get_colony_sites(strategy_counts["colony"],
+                                                                          colony_centre)
+        self.fallback_sites, self.fallback_jitter = None, 0.0
+        self.next_sites = {"lattice": 0, "colony": 0, "fallback": 0}
+
+    def get_lattice_sites(self, num_cells):
+        """Gets the sites of a cubic lattice spread over the environment, in random order.
+
+        The lattice has the fewest sites per axis that fit the cells, spread as
+        far apart as the environment allows, or as many sites as fit without
+        the largest cells overlapping if it cannot fit them all. A cell can be
+        jittered from its site by up to half the gap between neighbouring cells
+        along each axis while staying clear of them.
+
+        Parameters
+        ----------
+        num_cells : int
+            the number of cells seeded on the lattice
+
+        Returns
+        -------
+        numpy.ndarray(N, 3)
+            the shuffled lattice sites
+        float
+            the jitter of a cell from its site along each axis
+        """
+        min_spacing = 2 * self.max_radius
+        width = self.env_size - min_spacing
+        sites_per_axis = max(1, math.ceil(round(num_cells ** (1 / 3), 9)))
+        if min_spacing > 0:
+            sites_per_axis = min(sites_per_axis, int(width / min_spacing) + 1)
+        spacing = width / (sites_per_axis - 1) if sites_per_axis > 1 else 0.0
+
+        axis_sites = self.max_radius + spacing * np.arange(sites_per_axis)
+        sites = np.stack(np.meshgrid(axis_sites, axis_sites, axis_sites, indexing="ij"), axis=-1)
+        sites = sites.reshape(-1, 3)
+        return sites[np.random.permutation(len(sites))], max(spacing - min_spacing, 0.0) / 2
+
+    def get_colony_sites(self, num_cells, colony_centre):
+        """Gets the cubic lattice sites nearest a colony centre, in random order.
+
+        The sites are spaced COLONY_SPACING_SCALE seed diameters of the largest
+        cell type apart, and the lattice around the centre is grown until it
+        holds enough sites within the environment.
+
+        Parameters
+        ----------
+        num_cells : int
+            the number of cells seeded in the colony
+        colony_centre : numpy.ndarray(3)
+            the centre of the colony
+
+        Returns
+        -------
+        numpy.ndarray(N, 3)
+            the shuffled colony sites
+        float
+            the jitter of a cell from its site along each axis
+        """
+        min_spacing = 2 * self.max_radius
+        spacing = max(min_spacing * self.COLONY_SPACING_SCALE, 1e-6)
+        colony_radius = spacing * (3 * num_cells / (4 * math.pi)) ** (1 / 3)
+        half_sites = math.ceil(colony_radius / spacing) + 1
+        while True:
+            offsets = np.arange(-half_sites, half_sites + 1) * spacing
+            sites = colony_centre + np.stack(np.meshgrid(offsets, offsets, offsets, indexing="ij"),
+                                             axis=-1).reshape(-1, 3)
+            in_env = np.all((sites >= self.max_radius) & (sites <= self.env_size - self.max_radius), axis=1)
+            sites = sites[in_env]
+            if len(sites) >= num_cells or half_sites * spacing > self.env_size:
+                break
+            half_sites *= 2
+
+        # Random tie breaks keep the shell of sites at the colony edge from favouring any direction
+        centre_dists = np.linalg.norm(sites - colony_centre, axis=1)
+        nearest = np.lexsort((np.random.random(len(sites)), centre_dists))[:num_cells]
+        return sites[np.random.permutation(nearest)], (spacing - min_spacing) / 2
+
+    def get_seed_pos(self, cell_type_index):
+        """Gets the initial position of a cell of a cell type, and records it as seeded.
+
+        Parameters
+        ----------
+        cell_type_index : int
+            the index of the cell type of the cell in the simulation's cell types
+
+        Returns
+        -------
+        numpy.ndarray(3)
+            the initial 3D position of the cell
+        """
+        radius = self.cell_types[cell_type_index].SEED_RADIUS
+        strategy = self.strategies[cell_type_index]
+
+        if strategy == "random":
+            pos = np.random.uniform(radius, self.env_size - radius, [3])
+        else:
+            pos = self.get_clear_pos(strategy, radius)
+
+        self.grid.insert(len(self.positions), pos)
+        self.active_seeds.append(len(self.positions))
+        self.positions.append(pos)
+        self.radii.append(radius)
+        return pos
+
+    def get_clear_pos(self, strategy, radius):
+        """Gets a position for a cell clear of the cells seeded so far.
+
+        The lattice and colony strategies take their next unused site that is
+        clear, skipping those taken by cells of other strategies. When they run
+        out of sites, or for the poisson_disk strategy, uniform random positions
+        are drawn instead, followed by Bridson's sampling beside the active
+        seeds and then the sites of the densest lattice that fits the largest
+        cells. If none of them is clear the least overlapping random position
+        is used.
+
+        Parameters
+        ----------
+        strategy : string
+            the seeding strategy of the cell, other than random
+        radius : float
+            the radius of the cell
+
+        Returns
+        -------
+        numpy.ndarray(3)
+            the position of the cell
+        """
+        if strategy == "lattice":
+            pos = self.get_next_clear_site("lattice", self.lattice_sites, self.lattice_jitter, radius)
+            if pos is not None:
+                return pos
+        elif strategy == "colony":
+            pos = self.get_next_clear_site("colony", self.colony_sites, self.colony_jitter, radius)
+            if pos is not None:
+                return pos
+
+        random_positions = []
+        for _ in range(self.MAX_ATTEMPTS):
+            pos = np.random.uniform(radius, self.env_size - radius, [3])
+            if self.is_clear(pos, radius):
+                return pos
+            random_positions.append(pos)
+
+        pos = self.get_pos_beside_active_seed(radius)
+        if pos is not None:
+            return pos
+
+        # The random positions have run out of space, but the gaps can still fit lattice sites
+        if self.fallback_sites is None:
+            sites_per_axis = int((self.env_size - 2 * self.max_radius) / max(2 * self.max_radius, 1e-6)) + 1
+            self.fallback_sites, self.fallback_jitter = self.get_lattice_sites(sites_per_axis ** 3)
+        pos = self.get_next_clear_site("fallback", self.fallback_sites, self.fallback_jitter, radius)
+        if pos is not None:
+            return pos
+
+        self.overlapping_seeds += 1
+        return min(random_positions, key=lambda pos: self.get_overlap(pos, radius))
+
+    def get_next_clear_site(self, site_name, sites, jitter, radius):
+        """Gets the next unused site that is clear of the cells seeded so far,
+        skipping those that are not.
+
+        Parameters
+        ----------
+        site_name : string
+            the name of the sites in next_sites
+        sites : numpy.ndarray(N, 3)
+            the shuffled sites
+        jitter : float
+            the distance a cell can be moved from its site along each axis
+        radius : float
+            the radius of the cell
+
+        Returns
+        -------
+        numpy.ndarray(3)
+            the jittered position of the cell, or None if the sites have run out
+        """
+        while self.next_sites[site_name] < len(sites):
+            site = sites[self.next_sites[site_name]]
+            self.next_sites[site_name] += 1
+            pos = np.clip(site + np.random.uniform(-jitter, jitter, [3]), radius, self.env_size - radius)
+            if self.is_clear(pos, radius):
+                return pos
+        return None
+
+    def get_pos_beside_active_seed(self, radius):
+        """Gets a position for a cell clear of the cells seeded so far, beside an
+        active seeded cell, with Bridson's Poisson-disk sampling.
+
+        Up to MAX_ATTEMPTS positions are drawn in a shell BRIDSON_SHELL_WIDTH
+        contact distances wide just beyond contact with a random active seed.
+        If none of them is clear, the seed is retired from the active seeds, as
+        the space around it is full, and another is tried. Each seed is retired at most once, so filling the
+        environment takes time linear in the number of seeds. A seed retired
+        for a cell can still have space for a smaller cell, which is not looked
+        for.
+
+        Parameters
+        ----------
+        radius : float
+            the radius of the cell
+
+        Returns
+        -------
+        numpy.ndarray(3)
+            the position of the cell, or None if every seed has been retired
+        """
+        while self.active_seeds:
+            k = np.random.randint(len(self.active_seeds))
+            i = self.active_seeds[k]
+            reach = radius + self.radii[i]
+            for _ in range(self.MAX_ATTEMPTS):
+                direction = utils.rand_unit_vec()
+                distance = np.random.uniform(reach, (1 + self.BRIDSON_SHELL_WIDTH) * reach)
+                pos = np.clip(self.positions[i] + direction * distance, radius, self.env_size - radius)
+                if self.is_clear(pos, radius):
+                    return pos
+
+            self.active_seeds[k] = self.active_seeds[-1]
+            self.active_seeds.pop()
+        return None
+
+    def is_clear(self, pos, radius):
+        """Returns whether a cell placed at a position would overlap none of the cells seeded so far."""
+        for i in self.grid.query(pos, radius + self.max_radius):
+            diff = pos - self.positions[i]
+            reach = radius + self.radii[i]
+            if diff @ diff < reach * reach:
+                return False
+        return True
+
+    def get_overlap(self, pos, radius):
+        """Gets the total overlap of a cell placed at a position with the cells seeded so far.
+
+        Parameters
+        ----------
+        pos : numpy.ndarray(3)
+            the position of the cell
+        radius : float
+            the radius of the cell
+
+        Returns
+        -------
+        float
+            the sum of the overlap with the seeded cells
+        """
+        total_overlap = 0.0
+        for i in self.grid.query(pos, radius + self.max_radius):
+            diff = pos - self.positions[i]
+            reach = radius + self.radii[i]
+            dist_squared = diff @ diff
+            if dist_squared < reach * reach:
+                total_overlap += reach - math.sqrt(dist_squared)
+        return total_overlap
+
+    def get_summary(self):
+        """Summarises the cells seeded.
+
+        Returns
+        -------
+        dict
+            the "strategies" of the cell types, the number of "seeds" and the
+            number of "overlapping_seeds" that could not be placed clear of the
+            others, which are not counted for the random strategy
+        """
+        return {"strategies": list(self.strategies),
+                "seeds": len(self.positions),
+                "overlapping_seeds": self.overlapping_seeds}
+
+
+def compare_strategies(strategies, num_cells, env_size, seed, physics_solver="auto"):
+    """Seeds the same GenericCell simulation with each seeding strategy.
+
+    Parameters
+    ----------
+    strategies : list
+        the seeding strategies to compare
+    num_cells : int
+        the number of cells to seed
+    env_size : float
+        the width of the environment
+    seed : int
+        the random seed of each simulation
+    physics_solver : string
+        the physical model used to solve cell overlap
+
+    Returns
+    -------
+    list
+        the strategy, seconds, first solve telemetry and seeding summary of
+        each simulation
+    """
+    # Imported here as the simulation imports this module
+    from cell_type import GenericCell
+    from simulation import Simulation
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for strategy in strategies:
+            start_time = time.perf_counter()
+            sim = Simulation(os.path.join(output_dir, "seeding.csv"), [GenericCell], [num_cells],
+                             env_size, [], 0, seed, physics_solver=physics_solver, seeding=strategy)
+            sim.close()
+            results.append({"strategy": strategy,
+                            "seconds": time.perf_counter() - start_time,
+                            "first_solve": sim.get_solver_telemetry(0),
+                            "seeding_summary": sim.initial_seeding.get_summary()})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the time of the initial seeding and first solve with each seeding strategy.")
+    parser.add_argument("--cells", type=int, default=2000, help="cells seeded")
+    parser.add_argument("--env-size", type=float, default=300.0, help="width of the environment")
+    parser.add_argument("--solver", default="clusters", help="physical model used to solve cell overlap")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the simulations")
+    parser.add_argument("--strategies", default=",".join(SEEDING_STRATEGIES),
+                        help="comma separated strategies from: " + ", ".join(SEEDING_STRATEGIES))
+    args = parser.parse_args()
+
+    strategies = [strategy for strategy in args.strategies.split(",") if strategy]
+    for strategy in strategies:
+        if strategy not in SEEDING_STRATEGIES:
+            parser.error(f"unknown strategy {strategy}")
+
+    for result in compare_strategies(strategies, args.cells, args.env_size, args.seed, args.solver):
+        first_solve = result["first_solve"] or {}
+        summary = result["seeding_summary"]
+        print(f"{result['strategy']:<13} {result['seconds']:7.2f}s, first solve "
+              f"{first_solve.get('passes', 0):5d} passes ({first_solve.get('exit_reason', 'not solved')}), "
+              f"overlap {first_solve.get('initial_overlap', 0.0):9.1f} -> "
+              f"{first_solve.get('final_overlap', 0.0):7.1f}, "
+              f"{summary['overlapping_seeds']}/{summary['seeds']} overlapping seeds")
+
+
+if __name__ == "__main__":
+    main()
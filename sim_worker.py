@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import traceback
+
+from PySide6.QtCore import QObject, Signal, Slot
+
+from simulation import Simulation
+
+class SimulationWorker(QObject):
+    # Emitted after each simulation iteration with the iteration number, the time
+    # the iteration took in seconds and the alive population of each cell type
+    iteration_finished = Signal(int, float, object)
+    # Emitted when the simulation has finished and its data has been written
+    simulation_finished = Signal()
+    # Emitted when the simulation stops because it was cancelled
+    simulation_cancelled = Signal()
+    # Emitted with the traceback if the simulation raises an exception
+    simulation_failed = Signal(str)
+
+    def __init__(self, save_file, cell_types, initial_cell_nums,
+                 env_size, env_layers, max_iteration, random_seed=None, iteration_hooks=None,
+                 profiler=None, memory_tracker=None, physics_solver="auto", daughter_placement="random",
+                 seeding="random"):
+        """Constructs the necessary attributes for the SimulationWorker object.
+
+        The worker is moved to a QThread and its run slot is connected to the
+        thread's started signal, so the simulation runs without blocking the GUI.
+        The parameters are passed on to the Simulation constructor.
+
+        Parameters
+        ----------
+        save_file : string
+            the name of the data file where the simulation data should be saved
+        cell_types : list
+            a list of the cell type classes to add to the simulation
+        initial_cell_nums : list
+            a list of the counts of each cell type to initialise in the simulation
+        env_size : float
+            the width of the environment
+        env_layers : list
+            a list of the environment layer objects that the user has added to
+            the simulation
+        max_iteration : int
+            the number of iterations the user has chosen to simulate
+        random_seed : int
+            an optional random seed that the user can set for the simulation
+        iteration_hooks : list
+            optional functions that the simulation calls with itself after each
+            iteration has been saved, run in the worker thread
+        profiler : Profiler
+            an optional profiler that the simulation's stages are timed in
+        memory_tracker : MemoryTracker
+            an optional memory tracker that the simulation's memory is recorded in
+        physics_solver : string
+            the physical model used to solve cell overlap, one of PHYSICS_SOLVERS
+        daughter_placement : string
+            how the daughter cells seeded by mitosis are placed, one of
+            PLACEMENT_STRATEGIES
+        seeding : string
+            how the initial cells are positioned, one of SEEDING_STRATEGIES
+
+        Other defined attributes
+        ------------------------
+        cancel_event : threading.Event
+            the event that is set to cooperatively cancel the simulation
+        sim : Simulation
+            the simulation being run, None until it has been constructed
+        """
+        super().__init__()
+        self.save_file = save_file
+        self.cell_types = cell_types
+        self.initial_cell_nums = initial_cell_nums
+        self.env_size = env_size
+        self.env_layers = env_layers
+        self.max_iteration = max_iteration
+        self.random_seed = random_seed
+        self.iteration_hooks = iteration_hooks
+        self.profiler = profiler
+        self.memory_tracker = memory_tracker
+        self.physics_solver = physics_solver
+        self.daughter_placement = daughter_placement
+        self.seeding = seeding
+
+        self.cancel_event = threading.Event()
+        self.sim = None
+
+    @Slot()
+    def run(self):
+        """Constructs and runs the simulation, emitting progress after each iteration."""
+        try:
+            start_time = time.perf_counter()
+            self.sim = Simulation(self.save_file, self.cell_types, self.initial_cell_nums,
+                                  self.env_size, self.env_layers, self.max_iteration,
+                                  self.random_seed, self.cancel_event, self.iteration_hooks,
+                                  self.profiler, memory_tracker=self.memory_tracker,
+                                  physics_solver=self.physics_solver,
+                                  daughter_placement=self.daughter_placement, seeding=self.seeding)
+            if self.sim.is_cancelled():
+                self.simulation_cancelled.emit()
+                return
+
+            self.iteration_finished.emit(0, time.perf_counter() - start_time,
+                                         self.sim.get_population_counts())
+
+            for i in range(1, self.max_iteration + 1):
+                start_time = time.perf_counter()
+                self.sim.run_iteration()
+
+                if self.sim.is_cancelled():
+                    self.simulation_cancelled.emit()
+                    return
+
+                self.iteration_finished.emit(i, time.perf_counter() - start_time,
+                                             self.sim.get_population_counts())
+
+            self.sim.write_simulation()
+            self.simulation_finished.emit()
+
+        except Exception:
+            self.simulation_failed.emit(traceback.format_exc())
+        finally:
+            if self.sim is not None:
+                self.sim.close()
+
+    def cancel(self):
+        """Requests the simulation to stop at the next cancellation point.
+
+        This can be called from any thread.
+        """
+        self.cancel_event.set()
@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import time
+
 from cell_type import *
-from data import DataWriter
+from data import DataWriter, PopulationSummary, get_sidecar_file, get_summary_file
 from environment import *
+from memory import NULL_MEMORY_TRACKER
 from physics import *
+from placement import create_daughter_placement
+from profiling import NULL_PROFILER
+from seeding import InitialSeeding
 import utils
 
 class Simulation():
+    # Names of the stages of each iteration, in the order they are run
+    ITERATION_STAGES = ("cell_behaviour", "buffer_merge", "physics", "data_saving")
     
     def __init__(self, save_file, cell_types, initial_cell_nums, 
-                 env_size, env_layers, max_iteration, random_seed=None):
+                 env_size, env_layers, max_iteration, random_seed=None, cancel_event=None,
+                 iteration_hooks=None, profiler=None, save_solver_telemetry=False,
+                 memory_tracker=None, physics_solver="auto", daughter_placement="random",
+                 seeding="random", physics_workers=None):
         """Constructs the necessary attributes for the Simulation object.
         
         Parameters
@@ -29,11 +40,48 @@ class Simulation():
             the number of iterations the user has chosen to simulate
         random_seed : int
             an optional random seed that the user can set for the simulation
+        cancel_event : threading.Event
+            an optional event that is set to cancel the simulation when it is
+            being run outside of the GUI thread
+        iteration_hooks : list
+            optional functions that are called with the simulation after each
+            iteration's data has been saved, including iteration 0
+        profiler : Profiler
+            an optional profiler that the stages of each iteration, including
+            iteration 0, are timed and counted in
+        save_solver_telemetry : bool
+            whether to save the solver telemetry alongside the simulation data
+            (e.g. sim_data.solver.csv) when the simulation is written, in which
+            case the overlap left by solves stopped at their iteration limit is
+            measured with an extra pass
+        memory_tracker : MemoryTracker
+            an optional memory tracker that the memory in use after each
+            iteration, including iteration 0, and the peak memory of its stages
+            are recorded in
+        physics_solver : string
+            the physical model used to solve cell overlap, one of PHYSICS_SOLVERS,
+            which is chosen to suit the environment size by default
+        daughter_placement : string / DaughterPlacement
+            how the daughter cells seeded by mitosis are placed, one of
+            PLACEMENT_STRATEGIES or a configured DaughterPlacement object
+        seeding : string / list
+            how the initial cells are positioned, one of SEEDING_STRATEGIES for
+            every cell type or a list of the strategy of each cell type
+        physics_workers : int
+            the number of workers that solve the clusters of the "clusters"
+            solver, one per CPU if not given; the worker pool is shut down by
+            close
 
         Other defined attributes
         ------------------------
         data_writer : DataWriter
             the DataWriter object for writing simulation data
+        population_summary : PopulationSummary
+            the counts of the cells of each type and phase at each iteration,
+            which are saved alongside the simulation data
+        solver_telemetry : SolverTelemetry
+            the passes, exit reason, overlap and pair checks of the overlap
+            solve of each iteration
         sim_iteration : int
             the current iteration being simulated
         cells : list
@@ -41,10 +89,20 @@ class Simulation():
         new_cell_buffer : list
             a list of the cells that have been seeded in an iteration to 
             be added to the cells list
-        physics_model : PhysicsModel / PhysicsModelWithLocals
+        physics_model : PhysicalModel
             the physical model used to solve cell overlap
+        daughter_placement : DaughterPlacement
+            the service that chooses the positions of the daughter cells
+        initial_seeding : InitialSeeding
+            the service that chooses the positions of the initial cells
+        stage_times : dict
+            the total time in seconds spent in each stage of run_iteration, keyed
+            by the names in ITERATION_STAGES, or None if the stages are not timed
         """      
         self.data_writer = DataWriter(save_file)
+        self.population_summary = PopulationSummary()
+        self.solver_telemetry = SolverTelemetry()
+        self.save_solver_telemetry = save_solver_telemetry
         self.cell_types = cell_types
         self.initial_cell_nums = initial_cell_nums
         self.env_size = env_size
@@ -56,6 +114,11 @@ class Simulation():
                 self.env_layers.append(env_layer(self.env_size))
 
         self.max_iteration = max_iteration
+        self.cancel_event = cancel_event
+        self.iteration_hooks = iteration_hooks if iteration_hooks is not None else []
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.memory_tracker = memory_tracker if memory_tracker is not None else NULL_MEMORY_TRACKER
+        self.daughter_placement = create_daughter_placement(daughter_placement)
         
         if random_seed:
             np.random.seed(random_seed)
@@ -63,30 +126,40 @@ class Simulation():
         self.sim_iteration = 0
         self.cells = []
         self.new_cell_buffer = []
+        self.stage_times = None
+
+        self.profiler.start_iteration(self.sim_iteration)
         
-        # Seed new cells at random locations
+        # Seed new cells at the locations chosen by each cell type's seeding strategy
+        self.initial_seeding = InitialSeeding(self.env_size, self.cell_types, self.initial_cell_nums, seeding)
         for i in range(len(self.cell_types)):
             cell_type = self.cell_types[i]
             for j in range(self.initial_cell_nums[i]):
-                pos = np.random.uniform(
-                    cell_type.SEED_RADIUS, self.env_size - cell_type.SEED_RADIUS, [3])
+                pos = self.initial_seeding.get_seed_pos(i)
                 self.seed_new_cell(cell_type, pos)
         
         # Add the seeded cells to the cells list
         self.add_buffer_cells()
 
         # Choose which physical model implementation to use
-        max_cell_radius = self.get_max_cell_radius()
-        if int(self.env_size / (max_cell_radius * 4)) < 4:
-            self.physics_model = PhysicalModel(self.env_size)
-        else:
-            self.physics_model = PhysicalModelWithLocals(self.env_size, max_cell_radius)
+        self.physics_model = create_physical_model(
+            self.env_size, self.get_max_cell_radius(), physics_solver, physics_workers)
+        self.physics_model.cancel_event = cancel_event
+        self.physics_model.profiler = self.profiler
+        self.physics_model.measure_final_overlap = save_solver_telemetry
 
-        # Solve any overlap resulting from the random initial cell positions
-        self.physics_model.solve_overlap(self.sim_iteration, self.cells)
+        try:
+            # Solve any overlap resulting from the random initial cell positions
+            self.run_stage("physics", self.solve_overlap)
 
-        # Save iteration 0
-        self.data_writer.save_iteration(self.sim_iteration, self.cells)
+            # Save iteration 0
+            self.run_stage("data_saving", self.save_iteration)
+        except BaseException:
+            # The caller never gets the simulation to close
+            self.close()
+            raise
+        self.memory_tracker.record_iteration(self)
+        self.profiler.end_iteration()
 
     def get_max_cell_radius(self):
         """Gets the fully grown radius of the largest cell type in the simulation.
@@ -112,6 +185,23 @@ class Simulation():
         new_cell_id = len(self.cells) + len(self.new_cell_buffer)
         self.new_cell_buffer.append(cell_type(self, new_cell_id, pos))
 
+    def get_daughter_cell_pos(self, parent, daughter_radius):
+        """Gets the position of a daughter cell seeded by mitosis from the daughter placement.
+
+        Parameters
+        ----------
+        parent : AbstractCellType
+            the cell dividing
+        daughter_radius : float
+            the radius of the daughter cell
+
+        Returns
+        -------
+        np.ndarray(3)
+            the initial 3D position of the daughter cell
+        """
+        return self.daughter_placement.place(parent, daughter_radius)
+
     def add_buffer_cells(self):
         """Adds the cells that have been seeded in the buffer to the cells list."""
         self.cells += self.new_cell_buffer
@@ -136,27 +226,126 @@ class Simulation():
                 return env_layer
         return None
 
+    def is_cancelled(self):
+        """Returns whether the simulation has been cancelled through its cancel event."""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def get_population_counts(self):
+        """Gets the number of alive cells of each cell type in the latest saved iteration.
+
+        Returns
+        -------
+        alive_cell_count : dict
+            a dictionary relating each cell type name to its alive population
+        """
+        return self.population_summary.get_alive_counts(
+            max(self.population_summary.counts),
+            [cell_type.__name__ for cell_type in self.cell_types])
+
     def run_iteration(self):
         """Run an iteration of the simulation.
 
         Applies the cell behaviours to each of the cells, adds any cells that
         have been seeded to the cells list, calls the physical solver to resolve
-        overlap, and saves the iteration data.
+        overlap, and saves the iteration data. If the simulation is cancelled
+        part way through, the iteration is left unfinished.
         """
         self.sim_iteration += 1
+        self.profiler.start_iteration(self.sim_iteration)
+        try:
+            self.run_stage("cell_behaviour", self.run_cell_behaviours)
+            self.run_stage("buffer_merge", self.add_buffer_cells)
+
+            if self.is_cancelled():
+                return
+            
+            self.run_stage("physics", self.solve_overlap)
+
+            if self.is_cancelled():
+                return
+            
+            self.run_stage("data_saving", self.save_iteration)
+            self.memory_tracker.record_iteration(self)
+        finally:
+            self.profiler.end_iteration()
+
+    def run_stage(self, stage_name, stage):
+        """Runs a stage of an iteration, adding its time to stage_times if the stages
+        are timed, timing it in the profiler and measuring its peak memory.
+
+        Parameters
+        ----------
+        stage_name : string
+            the name of the stage, one of ITERATION_STAGES
+        stage : function
+            the method that runs the stage
+        """
+        if self.stage_times is None:
+            with self.profiler.measure(stage_name), self.memory_tracker.measure(stage_name):
+                stage()
+            return
 
+        start_time = time.perf_counter()
+        with self.profiler.measure(stage_name), self.memory_tracker.measure(stage_name):
+            stage()
+        self.stage_times[stage_name] += time.perf_counter() - start_time
+
+    def start_stage_timing(self):
+        """Starts timing the stages of each iteration, resetting any previous times."""
+        self.stage_times = {stage_name: 0.0 for stage_name in self.ITERATION_STAGES}
+
+    def run_cell_behaviours(self):
+        """Applies the cell cycle, migration and type specific behaviours to each alive cell."""
+        self.daughter_placement.start_iteration(self.cells)
         for cell in self.cells:
             if not cell.is_dead:
                 cell.do_cell_cycle()
                 cell.migrate()
                 cell.type_specific_processes()
-        
-        self.add_buffer_cells()
-        
+
+    def solve_overlap(self):
+        """Calls the physical solver to resolve the overlap between the cells,
+        and records its telemetry."""
         self.physics_model.solve_overlap(self.sim_iteration, self.cells)
-        
-        self.data_writer.save_iteration(self.sim_iteration, self.cells)
+        if self.physics_model.last_solve is not None:
+            self.solver_telemetry.record_solve(self.sim_iteration, self.physics_model.last_solve)
+
+    def get_solver_telemetry(self, iteration=None):
+        """Gets the telemetry of the overlap solves.
+
+        Parameters
+        ----------
+        iteration : int
+            an optional iteration to get the telemetry of
+
+        Returns
+        -------
+        SolverTelemetry / dict
+            the telemetry of every solved iteration, or the telemetry of the
+            given iteration's solve (None if it has not been solved)
+        """
+        if iteration is None:
+            return self.solver_telemetry
+        return self.solver_telemetry.solves.get(iteration)
+
+    def save_iteration(self):
+        """Saves the current iteration's data and population counts, and calls the iteration hooks."""
+        self.data_writer.save_iteration(self.sim_iteration, self.cells, self.population_summary)
+
+        for hook in self.iteration_hooks:
+            hook(self)
+
+    def close(self):
+        """Releases the resources held by the simulation, such as the physics solver's worker pool."""
+        self.physics_model.close()
 
     def write_simulation(self):
-        """Calls the DataWriter to save all of the simulation data to a file."""
-        self.data_writer.write_data()
+        """Calls the DataWriter to save all of the simulation data to a file,
+        and saves the population summary, and optionally the solver telemetry, alongside it."""
+        with self.profiler.measure("write_data"):
+            self.data_writer.write_data()
+        with self.profiler.measure("write_summary"):
+            self.population_summary.write(get_summary_file(self.data_writer.output_file))
+        if self.save_solver_telemetry:
+            with self.profiler.measure("write_solver_telemetry"):
+                self.solver_telemetry.write(get_sidecar_file(self.data_writer.output_file, "solver"))
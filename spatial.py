@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""A uniform grid spatial index for finding the cells near a position.
+
+The environment is divided into cubic buckets, each holding the indices of the
+cells whose centres fall within it. Cells can be moved between buckets as they
+move, so the index can be kept up to date without rebuilding it, and the cells
+within a distance of a position are found by only looking in the buckets that
+the distance reaches.
+
+find_close_pairs finds every pair of cells within a distance of each other at
+once, by sorting the cells into buckets with numpy rather than one at a time,
+and a NeighbourList keeps those pairs while the cells move, only finding them
+again once a cell has moved too far.
+"""
+
+import math
+
+import numpy as np
+
+# Offsets of the neighbouring buckets that are compared with each bucket, half of
+# the 26 surrounding buckets so each pair of buckets is only compared once
+HALF_NEIGHBOUR_OFFSETS = tuple((x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)
+                               if (x, y, z) > (0, 0, 0))
+
+
+class SpatialGrid:
+
+    def __init__(self, bucket_size):
+        """Constructs the necessary attributes for the SpatialGrid object.
+
+        Parameters
+        ----------
+        bucket_size : float
+            the width of each bucket, which is best set to the largest distance
+            that is usually queried, so a query looks in at most 27 buckets
+
+        Other defined attributes
+        ------------------------
+        inv_bucket_size : float
+            1 / the width of each bucket
+        buckets : dict
+            a dictionary relating the (x, y, z) indices of each non-empty bucket
+            to the set of cell indices in it
+        bucket_keys : dict
+            a dictionary relating each cell index to the indices of its bucket
+        """
+        self.bucket_size = bucket_size
+        self.inv_bucket_size = 1 / bucket_size
+        self.buckets = {}
+        self.bucket_keys = {}
+
+    def __len__(self):
+        """Returns the number of cells in the grid."""
+        return len(self.bucket_keys)
+
+    def __contains__(self, index):
+        """Returns whether the cell with the given index is in the grid."""
+        return index in self.bucket_keys
+
+    def get_bucket_key(self, pos):
+        """Gets the (x, y, z) indices of the bucket containing a position."""
+        inv_bucket_size = self.inv_bucket_size
+        return (math.floor(pos[0] * inv_bucket_size),
+                math.floor(pos[1] * inv_bucket_size),
+                math.floor(pos[2] * inv_bucket_size))
+
+    def insert(self, index, pos):
+        """Adds a cell to the grid, moving it if it is already in the grid.
+
+        Parameters
+        ----------
+        index : int
+            the index of the cell
+        pos : numpy.ndarray(3)
+            the position of the cell
+        """
+        key = self.get_bucket_key(pos)
+        old_key = self.bucket_keys.get(index)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self.remove_from_bucket(index, old_key)
+
+        self.bucket_keys[index] = key
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = {index}
+        else:
+            bucket.add(index)
+
+    def remove(self, index):
+        """Removes a cell from the grid, if it is in it."""
+        key = self.bucket_keys.pop(index, None)
+        if key is not None:
+            self.remove_from_bucket(index, key)
+
+    def remove_from_bucket(self, index, key):
+        """Removes a cell index from a bucket, dropping the bucket if it is left empty."""
+        bucket = self.buckets[key]
+        bucket.discard(index)
+        if not bucket:
+            del self.buckets[key]
+
+    def query(self, pos, distance):
+        """Gets the cells in the buckets within a distance of a position.
+
+        The cells returned are candidates: every cell within the distance is
+        returned, along with some cells further away in the same buckets.
+
+        Parameters
+        ----------
+        pos : numpy.ndarray(3)
+            the position to search around
+        distance : float
+            the distance to search within
+
+        Returns
+        -------
+        list
+            the indices of the candidate cells
+        """
+        inv_bucket_size = self.inv_bucket_size
+        min_x, min_y, min_z = (math.floor((pos[axis] - distance) * inv_bucket_size) for axis in range(3))
+        max_x, max_y, max_z = (math.floor((pos[axis] + distance) * inv_bucket_size) for axis in range(3))
+
+        candidates = []
+        buckets = self.buckets
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for z in range(min_z, max_z + 1):
+                    bucket = buckets.get((x, y, z))
+                    if bucket is not None:
+                        candidates.extend(bucket)
+        return candidates
+
+    @classmethod
+    def from_positions(cls, bucket_size, positions, indices=None):
+        """Builds a grid holding cells at the given positions.
+
+        Parameters
+        ----------
+        bucket_size : float
+            the width of each bucket
+        positions : numpy.ndarray(N, 3)
+            the positions of the cells
+        indices : iterable
+            the indices of the cells to add, all of them if not given
+
+        Returns
+        -------
+        SpatialGrid
+            the grid holding the cells
+        """
+        grid = cls(bucket_size)
+        if indices is None:
+            indices = range(len(positions))
+        for index in indices:
+            grid.insert(index, positions[index])
+        return grid
+
+
+def find_close_pairs(positions, radii, margin=0.0):
+    """Finds every pair of cells whose surfaces are within a margin of each other.
+
+    The cells are sorted into buckets as wide as the largest possible distance
+    between the centres of a close pair, so only the pairs in the same and
+    neighbouring buckets need to be compared, and the comparisons are vectorised.
+
+    Parameters
+    ----------
+    positions : numpy.ndarray(N, 3)
+        the positions of the cells
+    radii : numpy.ndarray(N)
+        the radii of the cells
+    margin : float
+        the distance between the surfaces of two cells within which they are close
+
+    Returns
+    -------
+    i : numpy.ndarray
+        the index of the first cell of each close pair
+    j : numpy.ndarray
+        the index of the second cell of each close pair, which is not the first
+        cell and is paired with it only once
+    """
+    num_cells = len(positions)
+    if num_cells < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    bucket_size = max(2 * float(radii.max()) + margin, 1e-9)
+    coords = np.floor(positions / bucket_size).astype(np.int64)
+
+    # Pad the bucket coordinates by one on each side so every neighbour has a unique key
+    coords -= coords.min(axis=0) - 1
+    dims = coords.max(axis=0) + 2
+    keys = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+    order = np.argsort(keys, kind="stable")
+    bucket_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    pairs_i = []
+    pairs_j = []
+    for offset in ((0, 0, 0),) + HALF_NEIGHBOUR_OFFSETS:
+        target_keys = bucket_keys + (offset[0] * dims[1] + offset[1]) * dims[2] + offset[2]
+        matches = np.minimum(np.searchsorted(bucket_keys, target_keys), len(bucket_keys) - 1)
+        found = bucket_keys[matches] == target_keys
+        buckets_a = np.flatnonzero(found)
+        buckets_b = matches[found]
+
+        # Expand each pair of buckets into every pair of their cells
+        sizes = counts[buckets_a] * counts[buckets_b]
+        total = int(sizes.sum())
+        if total == 0:
+            continue
+        bucket_pair = np.repeat(np.arange(len(buckets_a)), sizes)
+        k = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        counts_b = counts[buckets_b][bucket_pair]
+        i = order[starts[buckets_a][bucket_pair] + k // counts_b]
+        j = order[starts[buckets_b][bucket_pair] + k % counts_b]
+        if offset == (0, 0, 0):
+            in_order = i < j
+            i = i[in_order]
+            j = j[in_order]
+        pairs_i.append(i)
+        pairs_j.append(j)
+
+    if not pairs_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    i = np.concatenate(pairs_i)
+    j = np.concatenate(pairs_j)
+    diff = positions[i] - positions[j]
+    reach = radii[i] + radii[j] + margin
+    close = np.einsum("ij,ij->i", diff, diff) <= reach * reach
+    return i[close], j[close]
+
+
+class NeighbourList:
+
+    def __init__(self, radii, skin, margin=0.0, pairs=None, positions=None, allowances=None):
+        """Constructs the necessary attributes for the NeighbourList object.
+
+        The list holds the pairs of cells whose surfaces are within margin + skin
+        of each other, so it holds every pair within margin of each other until
+        a cell has moved more than half of the skin since the list was built,
+        when it is rebuilt. It can be started warm from the pairs of an earlier
+        list, with how far each cell can still move before they are out of date.
+
+        Parameters
+        ----------
+        radii : numpy.ndarray(N)
+            the radii of the cells
+        skin : float
+            the extra distance between the surfaces of the pairs held, so the
+            list can be reused as the cells move
+        margin : float
+            the distance between the surfaces of the pairs that must be held
+        pairs : tuple
+            optional (i, j) index arrays of the pairs of a warm start
+        positions : numpy.ndarray(N, 3)
+            the positions of the cells when the warm pairs are given
+        allowances : numpy.ndarray(N)
+            how far each cell can move from the given positions before the warm
+            pairs must be rebuilt, which must not be negative
+
+        Other defined attributes
+        ------------------------
+        rebuilds : int
+            the number of times the list has been built
+        """
+        self.radii = radii
+        self.skin = skin
+        self.margin = margin
+        self.pairs = pairs
+        self.positions = positions
+        self.allowances = allowances
+        self.rebuilds = 0
+
+    def get_pairs(self, positions):
+        """Gets the pairs of cells that could be within margin of each other,
+        rebuilding the list if a cell has moved too far since it was built.
+
+        Parameters
+        ----------
+        positions : numpy.ndarray(N, 3)
+            the current positions of the cells
+
+        Returns
+        -------
+        i : numpy.ndarray
+            the index of the first cell of each pair
+        j : numpy.ndarray
+            the index of the second cell of each pair
+        """
+        if self.pairs is None or self.has_moved_too_far(positions):
+            self.pairs = find_close_pairs(positions, self.radii, self.margin + self.skin)
+            self.positions = positions.copy()
+            self.allowances = self.skin / 2
+            self.rebuilds += 1
+        return self.pairs
+
+    def has_moved_too_far(self, positions):
+        """Returns whether a cell has moved further than its allowance since the list was built."""
+        moved = positions - self.positions
+        return bool(np.any(np.einsum("ij,ij->i", moved, moved) > np.square(self.allowances)))
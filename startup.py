@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import os
+import sys
+import time
+
+class StartupTimer:
+    # Time in seconds that the application should take for the main window to appear
+    STARTUP_BUDGET = 1.0
+    # Setting this environment variable always prints the startup report
+    REPORT_ENV_VAR = "CELL_ABM_STARTUP_REPORT"
+
+    def __init__(self):
+        """Constructs the necessary attributes for the StartupTimer object.
+
+        Other defined attributes
+        ------------------------
+        start_time : float
+            the performance counter time that the timer was created at
+        timings : list
+            a list of (name, seconds) tuples for each measured startup step
+        """
+        self.start_time = time.perf_counter()
+        self.timings = []
+
+    @contextmanager
+    def measure(self, name):
+        """Context manager that records how long the code inside it takes to run.
+
+        Parameters
+        ----------
+        name : string
+            the name of the startup step being measured, e.g. the imported module
+        """
+        step_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - step_start))
+
+    def elapsed(self):
+        """Gets the time since the timer was created.
+
+        Returns
+        -------
+        float
+            the elapsed startup time in seconds
+        """
+        return time.perf_counter() - self.start_time
+
+    def report(self, stream=None, force=False):
+        """Prints the time taken by each startup step.
+
+        The report is only printed if the startup took longer than STARTUP_BUDGET,
+        if the REPORT_ENV_VAR environment variable is set, or if it is forced.
+
+        Parameters
+        ----------
+        stream : file
+            the stream to print the report to, stderr if not given
+        force : bool
+            whether to print the report regardless of the startup time
+
+        Returns
+        -------
+        bool
+            whether the startup was within STARTUP_BUDGET
+        """
+        total = self.elapsed()
+        within_budget = total <= self.STARTUP_BUDGET
+
+        if force or not within_budget or os.environ.get(self.REPORT_ENV_VAR):
+            stream = stream if stream is not None else sys.stderr
+            print(f"Startup time: {total:.3f}s (budget {self.STARTUP_BUDGET:.3f}s)", file=stream)
+            for name, seconds in sorted(self.timings, key=lambda timing: -timing[1]):
+                print(f"  {seconds:8.3f}s  {name}", file=stream)
+            if not within_budget:
+                print("  Startup budget exceeded", file=stream)
+
+        return within_budget
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from OpenGL.GL import *
+
+class VideoExportPipeline:
+    # Number of frame buffers recycled between the OpenGL and encoder threads
+    NUM_FRAME_BUFFERS = 4
+    # Number of iterations whose render arrays are prepared ahead of being drawn
+    PREFETCH_ITERATIONS = 8
+
+    def __init__(self, file_path, frame_rate, width, height):
+        """Constructs the necessary attributes for the VideoExportPipeline object.
+
+        The pipeline exports a video in three stages that run at the same time:
+        a prefetch thread prepares the render arrays of upcoming iterations, the
+        thread that owns the OpenGL context draws each frame and reads it back
+        into a free buffer from a recycled pool, and an encoder thread writes the
+        frames to the video and returns their buffers to the pool. The stages
+        are connected by bounded queues, so no stage can run far ahead of the others.
+
+        Parameters
+        ----------
+        file_path : string
+            name of the file location to save the video in
+        frame_rate : int
+            the frame rate to save the video with
+        width : int
+            the width in pixels of the frames
+        height : int
+            the height in pixels of the frames
+
+        Other defined attributes
+        ------------------------
+        stop_event : threading.Event
+            the event set to stop the pipeline threads, e.g. when the export is cancelled
+        errors : list
+            the exceptions raised in the pipeline threads
+        """
+        self.file_path = file_path
+        self.frame_rate = frame_rate
+        self.width = width
+        self.height = height
+        self.stop_event = threading.Event()
+        self.errors = []
+
+    def run(self, iterations, get_render_arrays, draw_frame, progress_callback=None):
+        """Renders and encodes a frame for each of the given iterations.
+
+        This must be called from the thread where the OpenGL context is current.
+
+        Parameters
+        ----------
+        iterations : list
+            the simulation iterations to export, in order
+        get_render_arrays : function
+            function returning the render arrays of an iteration, which is called
+            from the prefetch thread so must be thread safe
+        draw_frame : function
+            function that draws the given render arrays in the current OpenGL context
+        progress_callback : function
+            optional function called with the number of frames drawn and the
+            total number of frames, which can return False to cancel the export
+
+        Returns
+        -------
+        stats : dict
+            the number of frames written, the time taken in seconds, the throughput
+            in frames per second and whether the export was cancelled
+        """
+        iterations = list(iterations)
+        start_time = time.perf_counter()
+
+        prefetch_queue = queue.Queue(maxsize=self.PREFETCH_ITERATIONS)
+        encode_queue = queue.Queue(maxsize=self.NUM_FRAME_BUFFERS)
+        free_buffers = queue.Queue()
+        for _ in range(self.NUM_FRAME_BUFFERS):
+            free_buffers.put(np.empty((self.height, self.width, 3), dtype=np.uint8))
+
+        frames_written = [0]
+        video = cv2.VideoWriter(self.file_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                self.frame_rate, (self.width, self.height))
+        if not video.isOpened():
+            raise OSError(f"Could not open the video file {self.file_path} for writing")
+
+        # Set once every frame has been drawn, so the encoder drains the queue and finishes
+        frames_drawn = threading.Event()
+        prefetch_thread = threading.Thread(
+            target=self.prefetch, args=(iterations, get_render_arrays, prefetch_queue), daemon=True)
+        encoder_thread = threading.Thread(
+            target=self.encode, args=(video, encode_queue, free_buffers, frames_written, frames_drawn),
+            daemon=True)
+        prefetch_thread.start()
+        encoder_thread.start()
+
+        cancelled = False
+        finished_drawing = False
+        try:
+            # Pack the pixel rows without padding so frames of any width can be read back
+            glPixelStorei(GL_PACK_ALIGNMENT, 1)
+
+            for frame_num in range(len(iterations)):
+                render_arrays = self.get_from_queue(prefetch_queue)
+                pixel_buffer = self.get_from_queue(free_buffers)
+                if render_arrays is None or pixel_buffer is None:
+                    break
+
+                draw_frame(render_arrays)
+                glReadPixels(0, 0, self.width, self.height, GL_BGR, GL_UNSIGNED_BYTE, pixel_buffer)
+                if not self.put_in_queue(encode_queue, pixel_buffer):
+                    break
+
+                if progress_callback is not None and progress_callback(frame_num + 1, len(iterations)) is False:
+                    cancelled = True
+                    self.stop_event.set()
+                    break
+            finished_drawing = True
+        finally:
+            # Stop the threads straight away if drawing failed, otherwise wait for the encoder to finish
+            if not finished_drawing:
+                self.stop_event.set()
+            frames_drawn.set()
+            encoder_thread.join()
+            self.stop_event.set()
+            prefetch_thread.join()
+            video.release()
+
+            # Don't leave a partial video behind if the export was cancelled or failed
+            if (cancelled or self.errors or not finished_drawing) and os.path.exists(self.file_path):
+                os.remove(self.file_path)
+
+        if self.errors:
+            raise self.errors[0]
+
+        seconds = time.perf_counter() - start_time
+        return {"frames": frames_written[0], "seconds": seconds,
+                "fps": frames_written[0] / seconds if seconds > 0 else 0.0,
+                "cancelled": cancelled}
+
+    def prefetch(self, iterations, get_render_arrays, prefetch_queue):
+        """Prefetch thread, preparing the render arrays of each iteration in order."""
+        try:
+            for iteration in iterations:
+                if not self.put_in_queue(prefetch_queue, get_render_arrays(iteration)):
+                    return
+        except Exception as error:
+            self.errors.append(error)
+            self.stop_event.set()
+
+    def encode(self, video, encode_queue, free_buffers, frames_written, frames_drawn):
+        """Encoder thread, writing each read back frame to the video until every
+        drawn frame is written or the pipeline is stopped."""
+        # OpenGL reads the rows from the bottom of the image up, so each frame is flipped
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    pixel_buffer = encode_queue.get(timeout=0.1)
+                except queue.Empty:
+                    if frames_drawn.is_set():
+                        return
+                    continue
+                cv2.flip(pixel_buffer, 0, dst=frame)
+                free_buffers.put(pixel_buffer)
+                video.write(frame)
+                frames_written[0] += 1
+        except Exception as error:
+            self.errors.append(error)
+            self.stop_event.set()
+
+    def get_from_queue(self, from_queue):
+        """Gets the next item from the queue, or None if the pipeline has been stopped."""
+        while not self.stop_event.is_set():
+            try:
+                return from_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def put_in_queue(self, to_queue, item):
+        """Puts the item in the queue, waiting for space unless the pipeline has been stopped.
+
+        Returns
+        -------
+        bool
+            whether the item was put in the queue
+        """
+        while not self.stop_event.is_set():
+            try:
+                to_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -1,36 +1,23 @@
 # -*- coding: utf-8 -*-
 
-import cv2
-import glfw
-import numpy as np
-import os
-import shutil
+import time
 
-from PySide6.QtGui import QOpenGLContext
 from PySide6.QtOpenGLWidgets import QOpenGLWidget
 from PySide6.QtWidgets import QVBoxLayout
 
 from OpenGL.GL import *
-from OpenGL.GLU import *
-from OpenGL.GLUT import *
 
-from data import DataReader
-import utils
+from data import Trajectory
+from render_data import CELL_COLOURS, RenderArrayCache, get_empty_render_arrays
+from scene import Scene
 
 class Visualiser(QOpenGLWidget):
     
-    # Add colours for normal and quiescent states of each implemented cell type class
-    cell_colours = {"GenericCell": {"Normal": (0.6, 0.2, 0.2), "Quiescent": (0.7, 0.5, 0.5)},
-                    "CancerousCell": {"Normal": (0.2, 0.4, 0.7), "Quiescent": (0.4, 0.6, 0.8)}}
-    
-    # Define 12 edges for the environment borders
-    env_edges = (
-        (0,1), (1,2), (2,3), (3,0),
-        (4,5), (5,6), (6,7), (7,4),
-        (0,4), (1,5), (2,6), (3,7)
-    )
-
-    def __init__(self, parent, w, h, input_file, env_size):
+    # The colours of each cell type are defined in render_data.py
+    cell_colours = CELL_COLOURS
+
+    def __init__(self, parent, w, h, input_file, env_size, data_source=None,
+                 render_cache_max_bytes=None):
         """Constructs the necessary attributes for the Visualiser widget.
         
         Parameters
@@ -45,21 +32,27 @@ class Visualiser(QOpenGLWidget):
             the name of the data file for the simulation to be visualised
         env_size : float
             the width of the environment to be visualised
+        data_source : Trajectory / IterationRingBuffer
+            an optional source of the simulation data to visualise, used instead
+            of opening the input file, e.g. to visualise a simulation while it runs
+        render_cache_max_bytes : int
+            an optional limit on the memory used to cache the render arrays of
+            recently drawn iterations
 
         Other defined attributes
         ------------------------
-        data_reader : DataReader
-            the DataReader object for reading simulation data to visualise
-        env_origin : list
-            the x, y and z coordinates of the environment origin
-        z_near : float
-            the z coordinate of the near side of the environment in the world space
-        z_far : float
-            the z coordinate of the far side of the environment in the world space
-        env_vertices : tuple
-            a tuple of 8 xyz coordinate tuples of the environment corners
+        data_source : Trajectory / IterationRingBuffer
+            the object that the simulation data to visualise is read from
+        render_cache : RenderArrayCache
+            the cache of the arrays needed to draw recently visualised iterations
+        scene : Scene
+            the OpenGL scene of the environment and cells, shared with the video export
         iteration : int
             the current iteration that should be displayed in the visualiser
+        use_impostors : bool
+            whether small cells are drawn as point sprite impostors
+        frame_time : float
+            the time in seconds taken to draw the latest frame, None until one is drawn
         """
         super(Visualiser, self).__init__(parent)
 
@@ -69,78 +62,54 @@ class Visualiser(QOpenGLWidget):
         self.w = w
         self.h = h
 
-        self.data_reader = DataReader(input_file)
-        self.data_reader.read_data()
+        if data_source is None:
+            data_source = Trajectory(input_file)
+        self.data_source = data_source
+        self.render_cache_max_bytes = render_cache_max_bytes
+        self.render_cache = RenderArrayCache(data_source, render_cache_max_bytes)
 
         self.env_size = env_size
-        self.env_origin, self.z_near, self.z_far, self.env_vertices = self.get_env_coords()
+        self.scene = Scene(env_size)
 
         self.iteration = 0
+        self.use_impostors = False
+        self.frame_time = None
+
+    def get_render_arrays(self, iteration):
+        """Gets the arrays needed to draw an iteration of the simulation.
+
+        Each iteration is only converted into arrays once, and is then reused
+        from the render cache whenever it is redrawn.
+
+        Parameters
+        ----------
+        iteration : int
+            the simulation iteration to get the render arrays of
 
-    def get_env_coords(self):
-        """Gets coordinates relating to the environment position in the world space.
-        
         Returns
         -------
-        env_origin : list
-            the x, y and z coordinates of the environment origin
-        z_near : float
-            the z coordinate of the near side of the environment in the world space
-        z_far : float
-            the z coordinate of the far side of the environment in the world space
-        env_vertices : tuple
-            a tuple of 8 xyz coordinate tuples of the environment corners
+        render_arrays : dict
+            the positions, radii and colours of the live cell agents, as built by
+            build_render_arrays
         """
+        render_arrays = self.render_cache.get_iteration(iteration)
+
+        # The iteration may not have arrived yet, or have been dropped, when visualising live
+        if render_arrays is None:
+            return get_empty_render_arrays()
+
+        return render_arrays
+
+    def set_data_source(self, data_source):
+        """Sets the object that the simulation data to visualise is read from.
         
-        half_env_size = self.env_size / 2.0
-        
-        # Gets z coordinates to place environment in world space needed 
-        # for it to be in full view of the camera
-        z_near = -(half_env_size * 1.05) / utils.TAN_10_DEGREES
-        z_far = z_near - self.env_size
-        
-        env_origin = [-half_env_size, -half_env_size, z_near]
-        env_vertices = (
-            (-half_env_size, -half_env_size, z_near),
-            (half_env_size, -half_env_size, z_near),
-            (half_env_size, half_env_size, z_near),
-            (-half_env_size, half_env_size, z_near),
-            (-half_env_size, -half_env_size, z_far),
-            (half_env_size, -half_env_size, z_far),
-            (half_env_size, half_env_size, z_far),
-            (-half_env_size, half_env_size, z_far),
-        )
-
-        return env_origin, z_near, z_far, env_vertices
-
-    def get_vis_data(self):
-        """Gets the cell data needed to visualise an iteration of the simulation.
-        
-        Returns
-        -------
-        positions : list
-            a list of the cell agent positions (3D numpy arrays)
-        radii : list
-            a list of the cell agent radii (floats)
-        colours : list
-            a list of the colours to apply to each cell agent
+        Parameters
+        ----------
+        data_source : Trajectory / IterationRingBuffer
+            the new source of the simulation data
         """
-        cells = self.data_reader.get_iteration(self.iteration)
-        
-        positions = []
-        radii = []
-        colours = []
-        
-        for cell in cells:
-            if not cell["is_dead"]:
-                positions.append(cell["pos"])
-                radii.append(cell["radius"])
-                if cell["current_phase"] == "G0":
-                    colours.append(self.cell_colours[cell["cell_type"]]["Quiescent"])
-                else:
-                    colours.append(self.cell_colours[cell["cell_type"]]["Normal"])
-        
-        return positions, radii, colours
+        self.data_source = data_source
+        self.render_cache = RenderArrayCache(data_source, self.render_cache_max_bytes)
 
     def set_iteration(self, iteration):
         """Sets the current iteration that should be displayed.
@@ -157,29 +126,21 @@ class Visualiser(QOpenGLWidget):
         """Initialises the Visualiser widget, setting up OpenGL functions.
         
         Overrides the QOpenGLWidget initializeGL function. It is called once 
-        on initialisation of the widget, sets necessary options and sets up
-        the lighting and materials for the scene.
+        on initialisation of the widget, and sets up the scene's options,
+        lighting and materials.
         """
-        f = QOpenGLContext.currentContext().functions()
-        f.glEnable(GL_DEPTH_TEST)
-        f.glDepthFunc(GL_LEQUAL)
-
-        f.glEnable(GL_LIGHTING)
+        self.scene.initialise_gl()
+        self.scene.sphere_renderer.use_impostors = self.use_impostors
 
-        glLightModelfv(GL_LIGHT_MODEL_AMBIENT, [0.8, 0.8, 0.8, 1.0])
+        # Free the scene's OpenGL objects when the context is destroyed
+        self.context().aboutToBeDestroyed.connect(self.release_gl_resources)
 
-        # Enable light number 0
-        f.glEnable(GL_LIGHT0)
-
-        # Set position and intensity of light
-        light_z_pos = self.z_near + 2 * self.env_size
-        glLightfv(GL_LIGHT0, GL_POSITION, [self.env_size, self.env_size, light_z_pos, 1.0])
-        glLightfv(GL_LIGHT0, GL_DIFFUSE, [0.7, 0.7, 0.7, 1.0])
-
-        # Set up the cell material
-        f.glEnable(GL_COLOR_MATERIAL)
-        glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
-        glShadeModel(GL_SMOOTH)
+    def release_gl_resources(self):
+        """Frees the OpenGL objects created by the visualiser."""
+        if self.scene.sphere_renderer is not None:
+            self.makeCurrent()
+            self.scene.release_gl()
+            self.doneCurrent()
 
     def resizeGL(self, w, h):
         """Repositions the camera view when the widget is resized.
@@ -191,13 +152,7 @@ class Visualiser(QOpenGLWidget):
         self.w = w
         self.h = h
 
-        glMatrixMode(GL_PROJECTION)
-        gluPerspective(20, (w/h), -self.z_near * 0.95, -self.z_far * 1.05)
-
-        glMatrixMode(GL_MODELVIEW)
-        gluLookAt(0, 0, 0, 0, 0, -100, 0, 0, 0)
-        viewMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glLoadIdentity()
+        self.scene.resize(w, h)
 
     def paintGL(self):
         """Draws the current simulation iteration.
@@ -207,64 +162,67 @@ class Visualiser(QOpenGLWidget):
         and draws the cells in the current simulation iteration and 
         environment.
         """
-        f = QOpenGLContext.currentContext().functions()
-        
-        # Clear the screen
-        f.glClearColor(1, 1, 1, 1)
-        f.glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
-
-        # Draw cells and environment
-        f.glEnable(GL_LIGHTING)
-        self.draw_cells()
-        f.glDisable(GL_LIGHTING)
-        self.draw_environment_border()
-
-    def draw_cells(self):
-        """Draws the cells in the current simulation iteration.
-        
-        Gets the positions, radii, and colours of the cell agents in
-        the current iteration and draws spheres with these attributes.
+        start_time = time.perf_counter()
+        self.scene.draw(self.get_render_arrays(self.iteration))
+
+        # Wait for the frame to be drawn, so its time can be used to adjust the level of detail
+        glFinish()
+        self.frame_time = time.perf_counter() - start_time
+
+    def set_use_impostors(self, use_impostors):
+        """Sets whether small cells are drawn as point sprite impostors.
+
+        Parameters
+        ----------
+        use_impostors : bool
+            whether cells covering only a few pixels are drawn as impostors
         """
-        positions, radii, colours = self.get_vis_data()
-        
-        for i in range(len(radii)):
-            pos = positions[i]
-            colour = colours[i]
-            radius = radii[i]
-            
-            glPushMatrix()
-            
-            #Create new sphere
-            sphere = gluNewQuadric()
-            
-            # Move to the cell position
-            glTranslatef(self.env_origin[0] + pos[0],
-                         self.env_origin[1] + pos[1], 
-                         self.env_origin[2] - pos[2])
-            
-            # Put cell color
-            glColor4f(colour[0], colour[1], colour[2], 1)
-            
-            # Draw sphere with cell's radius
-            gluSphere(sphere, radius, 32, 16)
-            
-            glPopMatrix()
-
-    def draw_environment_border(self):
-        """Draws the environment.
-        
-        Draws lines between each of the environment vertices to form the
-        environment borders.
+        self.use_impostors = use_impostors
+        if self.scene.sphere_renderer is not None:
+            self.scene.sphere_renderer.use_impostors = use_impostors
+
+    def set_cull_hidden_cells(self, cull_hidden_cells):
+        """Sets whether cells hidden behind densely packed cells are left out of the drawing.
+
+        Parameters
+        ----------
+        cull_hidden_cells : bool
+            whether to cull the hidden cells
+        """
+        self.scene.cull_hidden_cells = cull_hidden_cells
+
+    def set_clip_depth(self, clip_depth):
+        """Sets the depth of the cross-section plane, in front of which cells are not drawn.
+
+        Parameters
+        ----------
+        clip_depth : float
+            the depth into the environment of the plane, or None to draw the whole environment
         """
-        glBegin(GL_LINES)
-        glColor4f(0.4, 0.4, 0.4, 1)
-        for edge in self.env_edges:
-            for vertex in edge:
-                glVertex3fv(self.env_vertices[vertex])
-        glEnd()
+        self.scene.clip_depth = clip_depth
+
+    def adjust_detail(self, target_frame_time):
+        """Adjusts the level of detail so the frames are drawn within the target time.
+
+        Parameters
+        ----------
+        target_frame_time : float
+            the time in seconds that each frame should take at most
+        """
+        if self.scene.sphere_renderer is not None and self.frame_time is not None:
+            self.scene.sphere_renderer.adjust_detail(self.frame_time, target_frame_time)
+
+    def reset_detail(self):
+        """Returns to the full level of detail."""
+        if self.scene.sphere_renderer is not None:
+            self.scene.sphere_renderer.reset_detail()
     
-    def save_video(self, file_path, max_iteration, frame_rate):
+    def save_video(self, file_path, max_iteration, frame_rate, progress_callback=None):
         """Writes a video of the simulation visualisation to the given file location.
+
+        The frames are rendered and encoded by a VideoExportPipeline, so the
+        render arrays of upcoming iterations are prepared and earlier frames
+        are encoded while each frame is drawn.
         
         Parameters
         ----------
@@ -274,13 +232,25 @@ class Visualiser(QOpenGLWidget):
             the last iteration of the simulation
         frame_rate : int
             the frame rate to save the video with
+        progress_callback : function
+            optional function called with the number of frames drawn and the
+            total number of frames after each frame, which can return False to
+            cancel the export
+
+        Returns
+        -------
+        stats : dict
+            the export statistics returned by VideoExportPipeline.run, including
+            the throughput in frames per second, or None if no OpenGL context
+            could be created for the export
         """
-        # Save current iteration being displayed so this can be returned to
-        current_iteration = self.iteration
+        # Video export is rarely used so its dependencies are only imported here
+        import glfw
+        from video_export import VideoExportPipeline
 
         # Initialise glfw
         if not glfw.init():
-            return
+            return None
     
         glfw.window_hint(glfw.VISIBLE, False)
         
@@ -288,88 +258,31 @@ class Visualiser(QOpenGLWidget):
         window = glfw.create_window(self.w, self.h, "hidden window", None, None)
         if not window:
             glfw.terminate()
-            return
+            return None
         
         # Make the window's context current
         glfw.make_context_current(window)
 
-        # Set up visualisation OpenGL options
-        glEnable(GL_DEPTH_TEST)
-        glDepthFunc(GL_LEQUAL)
-
-        glEnable(GL_LIGHTING)
-        glLightModelfv(GL_LIGHT_MODEL_AMBIENT, [0.8, 0.8, 0.8, 1.0])
-
-        # Enable light number 0
-        glEnable(GL_LIGHT0)
-
-        # Set position and intensity of light
-        light_z_pos = self.z_near + 2 * self.env_size
-        glLightfv(GL_LIGHT0, GL_POSITION, [self.env_size, self.env_size, light_z_pos, 1.0])
-        glLightfv(GL_LIGHT0, GL_DIFFUSE, [0.7, 0.7, 0.7, 1.0])
-
-        # Set up the cell material
-        glEnable(GL_COLOR_MATERIAL)
-        glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
-        glShadeModel(GL_SMOOTH)
-
-        # Position the camera to look at the environment
-        glMatrixMode(GL_PROJECTION)
-        gluPerspective(20, (self.w/self.h), -self.z_near * 0.95, -self.z_far * 1.05)
-
-        glMatrixMode(GL_MODELVIEW)
-        gluLookAt(0, 0, 0, 0, 0, -100, 0, 0, 0)
-        viewMatrix = glGetFloatv(GL_MODELVIEW_MATRIX)
-        glLoadIdentity()
-
-        # Create temporary folder to store video frames
-        image_folder = os.getcwd() + "\\" + "images"
-        os.mkdir(image_folder)
-        
-        # Save frames of each iteration
-        for i in range(max_iteration + 1):
-            self.iteration = i
-            
-            # Clear the screen
-            glClearColor(1, 1, 1, 1)
-            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-            # Draw cells and environment
-            glEnable(GL_LIGHTING)
-            self.draw_cells()
-            glDisable(GL_LIGHTING)
-            self.draw_environment_border()
-
-            # Read pixels and save frame
-            image_buffer = glReadPixels(0, 0, self.w, self.h, OpenGL.GL.GL_BGR, 
-                                        OpenGL.GL.GL_UNSIGNED_BYTE)
-            image = np.frombuffer(image_buffer, dtype=np.uint8).reshape(self.w, self.h, 3)
-            image = np.flip(image, 0)
-            num_preceding_zeros = len(str(max_iteration)) - len(str(self.iteration))
-            file_name = "images" + "\\" + "0" * num_preceding_zeros + str(self.iteration) + ".png"
-            cv2.imwrite(file_name, image)
-
-        glfw.destroy_window(window)
-        glfw.terminate()
-
-        
-        # Get frames and write video to file location
-        images = [img for img in os.listdir(image_folder)]
-        frame = cv2.imread(os.path.join(image_folder, images[0]))
-        height, width, layers = frame.shape
-
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video = cv2.VideoWriter(file_path, fourcc, frame_rate, (width, height))
-
-        for image in images:
-            video.write(cv2.imread(os.path.join(image_folder, image)))
-
-        # Release resources
-        cv2.destroyAllWindows()
-        video.release()
-
-        # Delete temporary frames folder
-        shutil.rmtree("images")
+        # The framebuffer can be a different size to the window, e.g. on high DPI displays
+        width, height = glfw.get_framebuffer_size(window)
+        glViewport(0, 0, width, height)
+
+        # The hidden window has its own context, so needs its own scene objects
+        video_scene = Scene(self.env_size)
+        video_scene.cull_hidden_cells = self.scene.cull_hidden_cells
+        video_scene.clip_depth = self.scene.clip_depth
+        video_scene.initialise_gl()
+        video_scene.sphere_renderer.use_impostors = self.use_impostors
+        video_scene.resize(width, height)
+
+        try:
+            pipeline = VideoExportPipeline(file_path, frame_rate, width, height)
+            stats = pipeline.run(range(max_iteration + 1), self.get_render_arrays,
+                                 video_scene.draw, progress_callback)
+        finally:
+            # Release resources
+            video_scene.release_gl()
+            glfw.destroy_window(window)
+            glfw.terminate()
 
-        # Return to iteration that was originally being displayed
-        self.iteration = current_iteration
\ No newline at end of file
+        return stats